@@ -3,4 +3,8 @@ from django.apps import AppConfig
 
 class MusicAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'music_app'
\ No newline at end of file
+    name = 'music_app'
+
+    def ready(self):
+        import music_app.checks
+        import music_app.signals
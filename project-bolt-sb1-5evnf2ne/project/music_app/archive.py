@@ -0,0 +1,218 @@
+"""
+Cold storage for old listening history.
+
+Rows older than the retention period are rolled into ArchivedListeningSummary
+(so statistics still count them), appended to one gzip NDJSON file per month
+and deleted from ListeningHistory. Archive files are append-only: each run
+adds a new gzip member, and index.json records the rows and time range of
+every month. iter_archived_history() streams archived rows back for offline
+jobs.
+"""
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ListeningHistory, ArchivedListeningSummary
+from .rollups import day_start
+
+INDEX_NAME = 'index.json'
+
+
+def _archive_dir():
+    return Path(getattr(settings, 'LISTENING_ARCHIVE_DIR', Path(settings.BASE_DIR) / 'var' / 'listening_archive'))
+
+
+def _month_file(month):
+    return f'listening-history-{month}.ndjson.gz'
+
+
+def read_index():
+    try:
+        with open(_archive_dir() / INDEX_NAME) as index_file:
+            return json.load(index_file)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_index(index):
+    path = _archive_dir() / INDEX_NAME
+    temporary = path.with_suffix('.tmp')
+    with open(temporary, 'w') as index_file:
+        json.dump(index, index_file, indent=2, sort_keys=True)
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    os.replace(temporary, path)
+
+
+def archive_listening_history(older_than_days=None, batch_size=5000):
+    """
+    Move history rows older than the retention period to the archive.
+    Whole days are archived. Returns the number of rows archived.
+    """
+    if older_than_days is None:
+        older_than_days = getattr(settings, 'LISTENING_HISTORY_RETENTION_DAYS', 180)
+    cutoff = day_start(timezone.now() - timedelta(days=older_than_days))
+
+    archive_dir = _archive_dir()
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    index = read_index()
+    archived = 0
+
+    while True:
+        rows = list(
+            ListeningHistory.objects.filter(listened_at__lt=cutoff).order_by('id').values_list(
+                'id', 'user_id', 'music_id', 'listened_at', 'listened_duration'
+            )[:batch_size]
+        )
+        if not rows:
+            break
+
+        # The index lists the ids of the batch as pending until they are
+        # deleted: a run stopped before the delete does not write them again
+        # on the next run. A run stopped before the index is written writes
+        # them twice, never loses them.
+        archived_ids = _append_to_archive(rows, index)
+        _write_index(index)
+
+        # Only delete the rows safely on disk
+        archived_rows = [row for row in rows if row[0] in archived_ids]
+        with transaction.atomic():
+            _add_to_summaries(archived_rows)
+            ListeningHistory.objects.filter(id__in=archived_ids).delete()
+        _clear_pending(index, archived_ids)
+        _write_index(index)
+        archived += len(archived_rows)
+
+    return archived
+
+
+def _append_to_archive(rows, index):
+    """Append the rows to their month files. Returns the ids of the rows now in the archive."""
+    by_month = defaultdict(list)
+    for row in rows:
+        by_month[timezone.localtime(row[3]).strftime('%Y-%m')].append(row)
+
+    archived_ids = set()
+    for month, month_rows in by_month.items():
+        entry = index.setdefault(month, {
+            'file': _month_file(month),
+            'rows': 0,
+            'last_id': 0,
+            'first_listened_at': None,
+            'last_listened_at': None,
+        })
+        # Rows written by a run that stopped before deleting them
+        pending_ids = set(entry.get('pending_ids', []))
+        entry['pending_ids'] = sorted(pending_ids | {row[0] for row in month_rows})
+        archived_ids.update(row[0] for row in month_rows)
+        month_rows = [row for row in month_rows if row[0] not in pending_ids]
+        if not month_rows:
+            continue
+
+        lines = ''.join(
+            json.dumps({
+                'id': row_id,
+                'user_id': user_id,
+                'music_id': music_id,
+                'listened_at': listened_at.isoformat(),
+                'listened_duration': listened_duration.total_seconds() if listened_duration is not None else None,
+            }) + '\n'
+            for row_id, user_id, music_id, listened_at, listened_duration in month_rows
+        )
+        # Appending adds a new gzip member, readers see one continuous stream
+        with open(_archive_dir() / entry['file'], 'ab') as raw_file:
+            with gzip.GzipFile(fileobj=raw_file, mode='wb') as archive_file:
+                archive_file.write(lines.encode('utf-8'))
+            raw_file.flush()
+            os.fsync(raw_file.fileno())
+
+        times = [row[3].isoformat() for row in month_rows]
+        entry['rows'] += len(month_rows)
+        entry['last_id'] = max(entry['last_id'], max(row[0] for row in month_rows))
+        entry['first_listened_at'] = min(filter(None, [entry['first_listened_at'], min(times)]))
+        entry['last_listened_at'] = max(filter(None, [entry['last_listened_at'], max(times)]))
+    return archived_ids
+
+
+def _clear_pending(index, deleted_ids):
+    for entry in index.values():
+        pending_ids = [row_id for row_id in entry.pop('pending_ids', []) if row_id not in deleted_ids]
+        if pending_ids:
+            entry['pending_ids'] = pending_ids
+
+
+def _add_to_summaries(rows):
+    pairs = defaultdict(lambda: [0, timedelta(), None])
+    for _, user_id, music_id, listened_at, listened_duration in rows:
+        pair = pairs[(user_id, music_id)]
+        pair[0] += 1
+        if listened_duration:
+            pair[1] += listened_duration
+        if pair[2] is None or listened_at > pair[2]:
+            pair[2] = listened_at
+
+    # One query reads the summaries of the batch and two write them all.
+    # The rows stay locked until the batch is deleted, so concurrent runs
+    # add to the totals instead of overwriting them.
+    existing = {
+        (summary.user_id, summary.music_id): summary
+        for summary in ArchivedListeningSummary.objects.select_for_update().filter(
+            user_id__in={user_id for user_id, _ in pairs},
+            music_id__in={music_id for _, music_id in pairs}
+        )
+    }
+    created, updated = [], []
+    for key, (plays, duration, last_played) in pairs.items():
+        summary = existing.get(key)
+        if summary is None:
+            created.append(ArchivedListeningSummary(
+                user_id=key[0],
+                music_id=key[1],
+                plays=plays,
+                duration_played=duration,
+                last_played=last_played
+            ))
+        else:
+            summary.plays += plays
+            summary.duration_played += duration
+            summary.last_played = max(filter(None, [summary.last_played, last_played]))
+            updated.append(summary)
+
+    ArchivedListeningSummary.objects.bulk_create(created, batch_size=500)
+    ArchivedListeningSummary.objects.bulk_update(
+        updated, ['plays', 'duration_played', 'last_played'], batch_size=500
+    )
+
+
+def iter_archived_history(start=None, end=None, music_id=None, user_id=None):
+    """
+    Stream archived rows as dicts, oldest month first. start and end are
+    datetimes bounding listened_at; only the months in range are read.
+    """
+    for month, entry in sorted(read_index().items()):
+        if start and entry['last_listened_at'] and datetime.fromisoformat(entry['last_listened_at']) < start:
+            continue
+        if end and entry['first_listened_at'] and datetime.fromisoformat(entry['first_listened_at']) >= end:
+            continue
+
+        with gzip.open(_archive_dir() / entry['file'], 'rt', encoding='utf-8') as archive_file:
+            for line in archive_file:
+                row = json.loads(line)
+                if music_id is not None and row['music_id'] != music_id:
+                    continue
+                if user_id is not None and row['user_id'] != user_id:
+                    continue
+                listened_at = datetime.fromisoformat(row['listened_at'])
+                if (start and listened_at < start) or (end and listened_at >= end):
+                    continue
+                row['listened_at'] = listened_at
+                if row['listened_duration'] is not None:
+                    row['listened_duration'] = timedelta(seconds=row['listened_duration'])
+                yield row
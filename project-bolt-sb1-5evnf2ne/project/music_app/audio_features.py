@@ -0,0 +1,362 @@
+"""
+Content features of the audio files, for tracks that have no listens yet.
+
+Each uploaded file gets a fixed-size feature vector: its technical metadata
+read by mutagen (duration, bitrate, sample rate, channels, which tags are
+filled in) and, when the audio can be decoded here (PCM WAV with the
+standard library), NumPy spectral summaries of up to a minute from the
+middle of the track. Compressed formats keep zeros in the spectral part and
+are compared on their metadata.
+
+The vectors of the whole catalog live in one .npz file, written by
+`manage.py extract_audio_features`. Uploads and deletes in between are
+appended to a change log next to it, so an upload extracts its own file and
+writes one record whatever the catalog size; workers read only the records
+added since their last read and the next extraction folds the log in.
+Similarity is a cosine between vectors standardized over the catalog,
+computed for every track at once.
+"""
+import logging
+import os
+import struct
+import wave
+from pathlib import Path
+
+import mutagen
+import numpy as np
+from django.conf import settings
+
+from .models import Music
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+TAGS = ['title', 'artist', 'album', 'date', 'genre']
+# Mutagen tag keys of each format for the tags above
+TAG_KEYS = {
+    'title': ('TIT2', 'title', '\xa9nam'),
+    'artist': ('TPE1', 'artist', '\xa9ART'),
+    'album': ('TALB', 'album', '\xa9alb'),
+    'date': ('TDRC', 'date', '\xa9day'),
+    'genre': ('TCON', 'genre', '\xa9gen'),
+}
+BANDS = 8
+
+FEATURE_NAMES = (
+    ['log_duration', 'log_bitrate', 'log_sample_rate', 'channels']
+    + [f'has_{tag}' for tag in TAGS]
+    + ['decoded', 'rms_mean', 'rms_std', 'zero_crossing_rate', 'centroid_mean', 'centroid_std',
+       'rolloff', 'flatness']
+    + [f'band_{band}' for band in range(BANDS)]
+)
+
+FRAME_SIZE = 2048
+MAX_SECONDS = 60
+
+# Change log records: music id (negative for a removal) and feature vector
+LOG_RECORD = struct.Struct(f'<q{len(FEATURE_NAMES)}f')
+
+
+def _store_path():
+    return Path(getattr(settings, 'AUDIO_FEATURES_PATH', Path(settings.BASE_DIR) / 'var' / 'models' / 'audio_features.npz'))
+
+
+def _log_path():
+    return _store_path().with_suffix('.log')
+
+
+def extract_features(path):
+    """Feature vector of an audio file, in the order of FEATURE_NAMES."""
+    vector = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+    try:
+        audio = mutagen.File(path)
+    except mutagen.MutagenError:
+        # Unreadable metadata: compared on the decoded audio alone, if any
+        audio = None
+    if audio is not None:
+        info = audio.info
+        vector[0] = np.log1p(getattr(info, 'length', 0) or 0)
+        vector[1] = np.log1p(getattr(info, 'bitrate', 0) or 0)
+        vector[2] = np.log1p(getattr(info, 'sample_rate', 0) or 0)
+        vector[3] = getattr(info, 'channels', 0) or 0
+        keys = set(audio.tags.keys()) if audio.tags else set()
+        for position, tag in enumerate(TAGS):
+            vector[4 + position] = float(any(key in keys for key in TAG_KEYS[tag]))
+
+    samples, sample_rate = _decode(path)
+    if samples is not None and len(samples) >= FRAME_SIZE:
+        vector[4 + len(TAGS):] = _spectral_summary(samples, sample_rate)
+    return vector
+
+
+def _decode(path):
+    """Mono samples in [-1, 1] from the middle of a PCM WAV file, or (None, None)."""
+    try:
+        with wave.open(str(path), 'rb') as wav:
+            channels, width, rate, frames = wav.getnchannels(), wav.getsampwidth(), wav.getframerate(), wav.getnframes()
+            keep = min(frames, rate * MAX_SECONDS)
+            wav.setpos((frames - keep) // 2)
+            data = wav.readframes(keep)
+    except (wave.Error, EOFError, OSError):
+        return None, None
+
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 2 ** 15
+    elif width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) | raw[:, 1].astype(np.int32) << 8 | raw[:, 2].astype(np.int32) << 16)
+        samples = np.where(samples >= 2 ** 23, samples - 2 ** 24, samples).astype(np.float32) / 2 ** 23
+    elif width == 4:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / 2 ** 31
+    else:
+        return None, None
+    return samples.reshape(-1, channels).mean(axis=1), rate
+
+
+def _spectral_summary(samples, sample_rate):
+    frames = samples[:len(samples) // FRAME_SIZE * FRAME_SIZE].reshape(-1, FRAME_SIZE)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    zero_crossings = np.mean(np.abs(np.diff(np.signbit(frames), axis=1)), axis=1)
+
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE), axis=1))
+    frequencies = np.fft.rfftfreq(FRAME_SIZE, 1 / sample_rate)
+    power = spectrum.sum(axis=1)
+    audible = power > 0
+    spectrum, power = spectrum[audible], power[audible]
+    if not len(spectrum):
+        return np.concatenate(([1, rms.mean(), rms.std(), zero_crossings.mean()], np.zeros(4 + BANDS)))
+
+    nyquist = sample_rate / 2
+    centroid = (spectrum @ frequencies) / power / nyquist
+    cumulative = np.cumsum(spectrum, axis=1)
+    rolloff = frequencies[np.argmax(cumulative >= 0.85 * power[:, None], axis=1)] / nyquist
+    flatness = np.exp(np.mean(np.log(spectrum + 1e-10), axis=1)) / (spectrum.mean(axis=1) + 1e-10)
+
+    # Energy share of logarithmic bands from 20 Hz to the Nyquist frequency
+    edges = np.geomspace(20, nyquist, BANDS + 1)
+    band_energy = np.array([
+        spectrum[:, (frequencies >= low) & (frequencies < high)].sum() for low, high in zip(edges[:-1], edges[1:])
+    ])
+    band_energy /= band_energy.sum() or 1
+
+    return np.concatenate((
+        [1, rms.mean(), rms.std(), zero_crossings.mean(), centroid.mean(), centroid.std(),
+         rolloff.mean(), flatness.mean()],
+        band_energy
+    ))
+
+
+class FeatureStore:
+    """The feature vectors of the catalog, one row per track."""
+
+    def __init__(self, music_ids, features):
+        order = np.argsort(music_ids)
+        self.music_ids = np.asarray(music_ids, dtype=np.int64)[order]
+        self.features = np.asarray(features, dtype=np.float32).reshape(len(order), len(FEATURE_NAMES))[order]
+        # Standardized over the catalog and normalized, for cosine similarity
+        self.mean = self.features.mean(axis=0) if len(order) else np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+        spread = self.features.std(axis=0) if len(order) else np.ones(len(FEATURE_NAMES), dtype=np.float32)
+        self.spread = np.where(spread > 0, spread, 1)
+        self.unit = self._unit(self.features)
+        # Changes read from the log, standardized like the catalog
+        self.added_ids = []
+        self.added_unit = np.empty((0, len(FEATURE_NAMES)), dtype=np.float32)
+        self.added_positions = {}
+        self.removed = set()
+        self.log_offset = 0
+
+    def _unit(self, features):
+        standardized = (features - self.mean) / self.spread
+        norms = np.linalg.norm(standardized, axis=-1, keepdims=True)
+        return (standardized / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['music_ids'], data['features'])
+
+    def save(self, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix('.tmp')
+        with open(temporary, 'wb') as store_file:
+            np.savez(store_file, music_ids=self.music_ids, features=self.features)
+        os.replace(temporary, path)
+
+    def apply_log(self, path):
+        """Apply the records appended to the change log since the last call."""
+        records = _read_log(path, self.log_offset)
+        self.log_offset += len(records) * LOG_RECORD.size
+        added = []
+        for music_id, *vector in records:
+            if music_id < 0:
+                self.removed.add(-music_id)
+            elif music_id not in self.added_positions:
+                self.added_positions[music_id] = len(self.added_ids)
+                self.added_ids.append(music_id)
+                added.append(vector)
+        if added:
+            self.added_unit = np.vstack([self.added_unit, self._unit(np.array(added, dtype=np.float32))])
+
+    def similar_to(self, seeds, exclude=(), limit=10):
+        """
+        Tracks whose content is closest to the seeds, best first, as
+        (music_id, score) pairs. seeds maps music ids to their weight.
+        """
+        seeds = {music_id: weight for music_id, weight in seeds.items() if music_id not in self.removed}
+        seed_ids = np.fromiter(seeds, dtype=np.int64, count=len(seeds))
+        weights = np.fromiter(seeds.values(), dtype=np.float64, count=len(seeds))
+        positions = np.searchsorted(self.music_ids, seed_ids)
+        known = positions < len(self.music_ids)
+        known[known] = self.music_ids[positions[known]] == seed_ids[known]
+        added = [music_id for music_id in seeds if music_id in self.added_positions]
+        if not known.any() and not added:
+            return []
+
+        query = weights[known] @ self.unit[positions[known]]
+        if added:
+            query = query + np.array([seeds[music_id] for music_id in added]) @ self.added_unit[
+                [self.added_positions[music_id] for music_id in added]
+            ]
+
+        music_ids = np.concatenate([self.music_ids, np.array(self.added_ids, dtype=np.int64)])
+        scores = np.concatenate([self.unit @ query, self.added_unit @ query])
+        excluded = np.isin(music_ids, np.fromiter(set(seeds) | set(exclude) | self.removed, dtype=np.int64))
+        scores[excluded] = -np.inf
+
+        limit = min(limit, int((~excluded).sum()))
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(music_ids[position]), float(scores[position])) for position in best]
+
+
+class _locked:
+    """Serialize writers of the store file and its change log across processes."""
+
+    def __enter__(self):
+        path = _store_path().with_suffix('.lock')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_file = open(path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock_file.close()
+
+
+def _read_store():
+    path = _store_path()
+    return FeatureStore.load(path) if path.exists() else FeatureStore([], [])
+
+
+def _read_log(path, offset=0):
+    """Records of the change log from a byte offset."""
+    try:
+        with open(path, 'rb') as log_file:
+            log_file.seek(offset)
+            data = log_file.read()
+    except FileNotFoundError:
+        return []
+    # A record being appended is read on the next call
+    data = data[:len(data) - len(data) % LOG_RECORD.size]
+    return list(LOG_RECORD.iter_unpack(data))
+
+
+def _append_to_log(music_id, vector):
+    with _locked():
+        if not _store_path().exists():
+            # Not extracted yet: the first extraction reads the whole catalog
+            return
+        with open(_log_path(), 'ab') as log_file:
+            log_file.write(LOG_RECORD.pack(music_id, *vector))
+
+
+def ingest(music):
+    """Extract the features of a new track and add them to the store, through the change log."""
+    try:
+        vector = extract_features(music.audio_file.path)
+    except Exception:
+        logger.exception('Could not extract the audio features of track %s', music.pk)
+        return
+    _append_to_log(music.pk, vector)
+
+
+def remove_track(music_id):
+    """Remove a deleted track from the store, through the change log."""
+    _append_to_log(-music_id, np.zeros(len(FEATURE_NAMES), dtype=np.float32))
+
+
+def rebuild_store(only_missing=False):
+    """
+    Extract the features of every track, or only of the tracks missing from
+    the store and its change log, and fold the log into the store. Returns
+    the number of tracks extracted.
+    """
+    known = set()
+    if only_missing:
+        known.update(_read_store().music_ids.tolist())
+        known.update(record[0] for record in _read_log(_log_path()) if record[0] > 0)
+    extracted = {}
+    for music in Music.objects.exclude(audio_file='').only('id', 'audio_file').iterator():
+        if music.pk in known:
+            continue
+        try:
+            extracted[music.pk] = extract_features(music.audio_file.path)
+        except Exception:
+            logger.exception('Could not extract the audio features of track %s', music.pk)
+
+    with _locked():
+        vectors = {}
+        if only_missing:
+            store = _read_store()
+            vectors.update(zip(store.music_ids.tolist(), store.features))
+        vectors.update(extracted)
+        # Uploads and deletes logged since the last extraction, including
+        # those made while this one read the catalog
+        for music_id, *vector in _read_log(_log_path()):
+            if music_id < 0:
+                vectors.pop(-music_id, None)
+            else:
+                vectors.setdefault(music_id, np.array(vector, dtype=np.float32))
+        FeatureStore(
+            list(vectors),
+            np.vstack(list(vectors.values())) if vectors else []
+        ).save(_store_path())
+        _log_path().unlink(missing_ok=True)
+    return len(extracted)
+
+
+_loaded = {'store': None, 'mtime': None}
+
+
+def get_store():
+    """
+    The feature store of this worker process, reloaded when the file changes,
+    with the changes appended to the log since the last call, or None.
+    """
+    path = _store_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    try:
+        log_size = os.stat(_log_path()).st_size
+    except FileNotFoundError:
+        log_size = 0
+
+    store = _loaded['store']
+    # An extraction removes the log: start over from its beginning
+    if _loaded['mtime'] != mtime or log_size < store.log_offset:
+        store = FeatureStore.load(path)
+        _loaded.update(store=store, mtime=mtime)
+    if log_size > store.log_offset:
+        store.apply_log(_log_path())
+    return store
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Cache backends that keep their entries in each process
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Recommendation cache versions must be seen by every worker."""
+    warnings = []
+    for alias in sorted({'default', getattr(settings, 'RECOMMENDATION_CACHE', 'default')}):
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in PROCESS_LOCAL_BACKENDS:
+            warnings.append(Warning(
+                f'The {alias!r} cache is not shared between worker processes.',
+                hint='Use the database, Redis or Memcached cache backend.',
+                obj=alias,
+                id='music_app.W001',
+            ))
+    return warnings
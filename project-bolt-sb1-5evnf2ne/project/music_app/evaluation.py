@@ -0,0 +1,241 @@
+"""
+Offline evaluation of the recommendation strategies.
+
+The listening history is split in time: plays before the split are what the
+recommenders know, plays after it are what users went on to listen to. For
+every test user, each strategy alone and the weighted blend recommend k
+tracks from the training part, and the report gives:
+
+- precision@k and recall@k against the tracks first heard after the split,
+- coverage, the share of the catalog recommended to at least one user,
+- novelty, the mean self-information -log2(popularity) of the recommended
+  tracks, so that recommending only hits scores low,
+- p50/p95 latency and query counts of each run.
+
+Each strategy is evaluated on its own scores, without the popular tracks
+that fill short recommendation lists; only the blend is filled, as it is
+served.
+
+Everything runs inside a transaction that is rolled back: the test plays are
+deleted while evaluating, and a synthetic dataset can be added to the
+database content for the run. Models are retrained on the training part
+only, in a temporary directory, and the play rollups the popular tracks are
+read from are rebuilt from it, so that the test plays do not leak into
+them. Ratings and favorites are kept as they are, since their dates are not
+recorded.
+"""
+import math
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from .models import Music, ListeningHistory, UserMusicPreference, UserHeardSet
+from .recommendations import DEFAULT_WEIGHTS, STRATEGIES, get_recommendations
+from . import factorization, popularity, rollups, similarity
+
+
+def generate_synthetic_dataset(users=200, tracks=500, days=90, seed=0):
+    """
+    Users with a taste for a couple of genres listen mostly to the popular
+    tracks of those genres. Returns the number of plays created.
+    """
+    generator = random.Random(seed)
+    genres = [code for code, _ in Music.GENRE_CHOICES]
+    User = get_user_model()
+
+    artists = [
+        User.objects.create_user(f'synthetic-artist-{seed}-{index}', user_type=User.ARTIST).artist_profile
+        for index in range(max(tracks // 10, 1))
+    ]
+    artist_genres = {artist.pk: generator.choice(genres) for artist in artists}
+
+    musics = Music.objects.bulk_create(
+        Music(
+            title=f'Synthetic {index}',
+            artist=artist,
+            genre=artist_genres[artist.pk],
+            release_date=date.today() - timedelta(days=generator.randrange(3650)),
+            audio_file='music/synthetic.mp3'
+        )
+        for index, artist in ((index, generator.choice(artists)) for index in range(tracks))
+    )
+    by_genre = defaultdict(list)
+    for music in musics:
+        by_genre[music.genre].append(music)
+
+    listeners = User.objects.bulk_create(
+        User(username=f'synthetic-listener-{seed}-{index}') for index in range(users)
+    )
+    now = timezone.now()
+    plays = []
+    preferences = []
+    for listener in listeners:
+        liked_genres = generator.sample([genre for genre in by_genre], min(2, len(by_genre)))
+        pool = [music for genre in liked_genres for music in by_genre[genre]]
+        # Zipf-like popularity inside the pool
+        weights = [1 / (rank + 1) for rank in range(len(pool))]
+        heard = set()
+        for _ in range(generator.randint(5, 60)):
+            music = generator.choices(pool, weights)[0]
+            heard.add(music)
+            plays.append(ListeningHistory(
+                user=listener,
+                music=music,
+                listened_at=now - timedelta(seconds=generator.randrange(days * 24 * 3600)),
+                listened_duration=timedelta(seconds=generator.randint(30, 240))
+            ))
+        for music in heard:
+            if generator.random() < 0.3:
+                preferences.append(UserMusicPreference(
+                    user=listener,
+                    music=music,
+                    rating=generator.randint(3, 5),
+                    favorite=generator.random() < 0.2
+                ))
+    ListeningHistory.objects.bulk_create(plays, batch_size=1000)
+    UserMusicPreference.objects.bulk_create(preferences, batch_size=1000)
+    return len(plays)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def _latency(seconds):
+    if not seconds:
+        return None
+    return {'p50': _percentile(seconds, 0.5) * 1000, 'p95': _percentile(seconds, 0.95) * 1000}
+
+
+class _Rollback(Exception):
+    pass
+
+
+def evaluate(k=10, test_fraction=0.2, max_users=200, synthetic=None, retrain=True, seed=0):
+    """
+    Run the evaluation and return the report as a dict. synthetic holds the
+    keyword arguments of generate_synthetic_dataset() to add generated data
+    to the database content for the run.
+    """
+    report = {}
+    try:
+        with transaction.atomic():
+            if synthetic is not None:
+                report['synthetic'] = dict(synthetic, plays=generate_synthetic_dataset(seed=seed, **synthetic))
+            report.update(_evaluate(k, test_fraction, max_users, retrain, seed))
+            raise _Rollback
+    except _Rollback:
+        pass
+    finally:
+        # The lists of this process were computed from the training plays
+        popularity.reset()
+    return report
+
+
+def _evaluate(k, test_fraction, max_users, retrain, seed):
+    history = ListeningHistory.objects.order_by('listened_at')
+    total = history.count()
+    if total < 2:
+        return {'error': 'Not enough listening history to split'}
+    train_plays = int(total * (1 - test_fraction))
+    split = history.values_list('listened_at', flat=True)[train_plays]
+
+    # What users first heard after the split
+    train_pairs = set(ListeningHistory.objects.filter(listened_at__lt=split).values_list('user_id', 'music_id').distinct())
+    truth = defaultdict(set)
+    for user_id, music_id in ListeningHistory.objects.filter(listened_at__gte=split).values_list('user_id', 'music_id'):
+        if (user_id, music_id) not in train_pairs:
+            truth[user_id].add(music_id)
+    ListeningHistory.objects.filter(listened_at__gte=split).delete()
+    UserHeardSet.rebuild()
+    rollups.backfill_rollups()
+    popularity.reset()
+
+    # Listeners of each track in the training part, for novelty
+    train_users = len({user_id for user_id, _ in train_pairs}) or 1
+    listeners = defaultdict(int)
+    for _, music_id in train_pairs:
+        listeners[music_id] += 1
+    catalog = Music.objects.count()
+
+    test_users = sorted(truth)
+    random.Random(seed).shuffle(test_users)
+    test_users = get_user_model().objects.in_bulk(test_users[:max_users])
+
+    variants = {name: {name: 1.0} for name in STRATEGIES}
+    variants['blend'] = getattr(settings, 'RECOMMENDATION_WEIGHTS', DEFAULT_WEIGHTS)
+
+    with tempfile.TemporaryDirectory() as model_dir, override_settings(
+        SIMILARITY_MODEL_PATH=Path(model_dir) / 'item_similarity.npz',
+        RECOMMENDER_MODEL_DIR=Path(model_dir) / 'als',
+    ):
+        if retrain:
+            similarity.build_similarity_model()
+            factorization.train_factor_model()
+        results = {
+            name: _evaluate_variant(weights, name == 'blend', test_users, truth, k, listeners, train_users, catalog)
+            for name, weights in variants.items()
+        }
+
+    return {
+        'k': k,
+        'split': split.isoformat(),
+        'train_plays': train_plays,
+        'test_plays': total - train_plays,
+        'test_users': len(test_users),
+        'catalog': catalog,
+        'models_retrained': retrain,
+        'variants': results,
+    }
+
+
+def _evaluate_variant(weights, fill, users, truth, k, listeners, train_users, catalog):
+    precisions, recalls, novelties, latencies, queries = [], [], [], [], []
+    steps = defaultdict(list)
+    recommended = set()
+
+    with override_settings(RECOMMENDATION_WEIGHTS=weights):
+        for user_id, user in users.items():
+            with CaptureQueriesContext(connection) as captured:
+                timings = {}
+                started = time.perf_counter()
+                music_ids = [music.id for music in get_recommendations(user, limit=k, timings=timings, fill=fill)]
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            for step, seconds in timings.items():
+                steps[step].append(seconds)
+
+            hits = len(truth[user_id].intersection(music_ids))
+            precisions.append(hits / k)
+            recalls.append(hits / len(truth[user_id]))
+            recommended.update(music_ids)
+            novelties.extend(
+                -math.log2((listeners[music_id] + 1) / (train_users + 1)) for music_id in music_ids
+            )
+
+    count = len(users) or 1
+    return {
+        'weights': weights,
+        'precision_at_k': sum(precisions) / count,
+        'recall_at_k': sum(recalls) / count,
+        'coverage': len(recommended) / catalog if catalog else 0,
+        'novelty': sum(novelties) / len(novelties) if novelties else None,
+        'latency_ms': _latency(latencies),
+        'step_latency_ms': {step: _latency(seconds) for step, seconds in steps.items()},
+        'queries': {
+            'mean': sum(queries) / count,
+            'p95': _percentile(queries, 0.95),
+        },
+    }
@@ -0,0 +1,104 @@
+"""
+Streaming exports of the listening history, user preferences and statistics.
+
+Rows are read with values_list() and iterator(), so no model instances are
+built and memory stays flat whatever the size of the table. They are
+rendered line by line as CSV or NDJSON for a StreamingHttpResponse or a file.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import ListeningHistory, UserMusicPreference, MusicStatistics
+
+CHUNK_SIZE = 2000
+
+# Dataset name: (model, exported columns, date field, artist lookup)
+DATASETS = {
+    'history': (
+        ListeningHistory,
+        ['id', 'user_id', 'music_id', 'music__artist_id', 'listened_at', 'listened_duration'],
+        'listened_at',
+        'music__artist_id',
+    ),
+    'preferences': (
+        UserMusicPreference,
+        ['id', 'user_id', 'music_id', 'music__artist_id', 'rating', 'favorite', 'listen_count', 'last_listened'],
+        'last_listened',
+        'music__artist_id',
+    ),
+    'statistics': (
+        MusicStatistics,
+        ['music_id', 'music__artist_id', 'total_plays', 'unique_listeners', 'average_rating',
+         'total_favorites', 'total_duration_played', 'last_played', 'updated_at'],
+        'last_played',
+        'music__artist_id',
+    ),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def parse_date(value, end=False):
+    """Turn a YYYY-MM-DD string into the aware datetime starting (or ending) that day."""
+    if not value:
+        return None
+    day = datetime.strptime(value, '%Y-%m-%d').date()
+    if end:
+        day += timedelta(days=1)
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def export_rows(dataset, start=None, end=None, artist_id=None):
+    """
+    Column headers and a lazy iterator over the rows of a dataset. start is
+    inclusive and end exclusive, both on the dataset's date field.
+    """
+    model, columns, date_field, artist_lookup = DATASETS[dataset]
+    rows = model.objects.order_by()
+    if start:
+        rows = rows.filter(**{f'{date_field}__gte': start})
+    if end:
+        rows = rows.filter(**{f'{date_field}__lt': end})
+    if artist_id:
+        rows = rows.filter(**{artist_lookup: artist_id})
+    headers = [column.replace('music__', '') for column in columns]
+    return headers, rows.values_list(*columns).iterator(chunk_size=CHUNK_SIZE)
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+class _Echo:
+    """File-like object returning what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def render_csv(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_plain(value) for value in row])
+
+
+def render_ndjson(columns, rows):
+    for row in rows:
+        yield json.dumps({column: _plain(value) for column, value in zip(columns, row)}) + '\n'
+
+
+def render(export_format, columns, rows):
+    if export_format == 'csv':
+        return render_csv(columns, rows)
+    return render_ndjson(columns, rows)
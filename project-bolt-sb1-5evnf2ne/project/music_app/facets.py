@@ -0,0 +1,49 @@
+"""
+Track counts per genre and per artist, for the filters of the music browser.
+
+Counts of the whole catalog are materialized in FacetCount. Signals move a
+track from one count to another when it is created, deleted, or changes
+genre or artist, so reading them is one query on a table of a row per genre
+and per artist, whatever the catalog size. Bulk inserts and queryset
+updates bypass the signals; the rebuild_facet_counts command recounts
+everything.
+
+Counts of a search are grouped in the full-text index, which holds the
+genre of every track, without reading the catalog table. They include every
+match, also past the SEARCH_MAX_RESULTS tracks listed. Without the index,
+the tracks found by the LIKE search are grouped instead.
+"""
+from django.db import DatabaseError
+from django.db.models import Count
+
+from .models import FacetCount, Music
+from . import search
+
+
+def genre_counts(search_text=''):
+    """Number of tracks of each genre code, in the catalog or matching a search."""
+    if not search_text:
+        return FacetCount.counts(FacetCount.GENRE)
+
+    if search.fts_enabled():
+        try:
+            return search.genre_counts(search_text)
+        except DatabaseError:
+            # The index was not created: count the tracks found without it
+            pass
+    found = search.search(Music.objects.all(), search_text)
+    return dict(found.order_by().values_list('genre').annotate(count=Count('id')))
+
+
+def artist_counts(artist_ids):
+    """Number of tracks of each artist, by artist id."""
+    counts = FacetCount.objects.filter(
+        facet=FacetCount.ARTIST,
+        value__in=[str(artist_id) for artist_id in artist_ids]
+    ).values_list('value', 'count')
+    return {int(value): count for value, count in counts}
+
+
+def genre_choices(counts):
+    """(code, name, count) of every genre, in the order of Music.GENRE_CHOICES."""
+    return [(code, name, counts.get(code, 0)) for code, name in Music.GENRE_CHOICES]
@@ -0,0 +1,190 @@
+"""
+Implicit-feedback matrix factorization (ALS) for recommendations.
+
+train_factor_model() learns one vector per user and per track from play
+counts, favorites and ratings, following Hu, Koren and Volinsky's implicit
+ALS: every interaction is a positive preference whose confidence grows with
+its strength. The factors are saved as .npy files in a new version
+directory and manifest.json is switched to it, so serving workers open them
+with np.load(mmap_mode='r') and share one copy through the page cache.
+Recommending is then a dot product with the track factors and a partial sort.
+"""
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+
+from .models import UserMusicPreference, ListeningHistory, ArchivedListeningSummary
+from .similarity import FAVORITE_WEIGHT, rating_weight
+
+MANIFEST_NAME = 'manifest.json'
+
+DEFAULT_FACTORS = 32
+DEFAULT_ITERATIONS = 15
+DEFAULT_REGULARIZATION = 0.1
+DEFAULT_ALPHA = 20.0
+
+
+def _model_dir():
+    return Path(getattr(settings, 'RECOMMENDER_MODEL_DIR', Path(settings.BASE_DIR) / 'var' / 'models' / 'als'))
+
+
+def _strengths():
+    """Strength of every (user, track) pair with a positive signal."""
+    plays = defaultdict(int)
+    counts = ListeningHistory.objects.order_by().values_list('user_id', 'music_id').annotate(plays=Count('id'))
+    for user_id, music_id, count in counts.iterator(chunk_size=5000):
+        plays[(user_id, music_id)] += count
+    archived = ArchivedListeningSummary.objects.order_by().values_list('user_id', 'music_id', 'plays')
+    for user_id, music_id, count in archived.iterator(chunk_size=5000):
+        plays[(user_id, music_id)] += count
+
+    strengths = {pair: float(np.log1p(count)) for pair, count in plays.items()}
+    preferences = UserMusicPreference.objects.order_by().values_list('user_id', 'music_id', 'rating', 'favorite')
+    for user_id, music_id, rating, favorite in preferences.iterator(chunk_size=5000):
+        extra = (FAVORITE_WEIGHT if favorite else 0) + (rating_weight(rating) if rating is not None else 0)
+        if extra:
+            strengths[(user_id, music_id)] = strengths.get((user_id, music_id), 0) + extra
+    return strengths
+
+
+def _solve(fixed, ptr, indices, confidences, regularization):
+    """One ALS half step: the factors of every row given the fixed factors of the other side."""
+    factors = fixed.shape[1]
+    gram = fixed.T @ fixed + regularization * np.eye(factors)
+    solved = np.zeros((len(ptr) - 1, factors))
+    for row in range(len(ptr) - 1):
+        start, end = ptr[row], ptr[row + 1]
+        if start == end:
+            continue
+        vectors = fixed[indices[start:end]]
+        confidence = confidences[start:end]
+        # Only the observed entries differ from the shared Gram matrix
+        system = gram + (vectors.T * (confidence - 1)) @ vectors
+        solved[row] = np.linalg.solve(system, vectors.T @ confidence)
+    return solved
+
+
+def _grouped(keys, others, values, size):
+    order = np.argsort(keys, kind='stable')
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(keys, minlength=size))))
+    return ptr, others[order], values[order]
+
+
+def train_factor_model(factors=DEFAULT_FACTORS, iterations=DEFAULT_ITERATIONS,
+                       regularization=DEFAULT_REGULARIZATION, alpha=DEFAULT_ALPHA, seed=0):
+    """Train the factors and publish them. Returns (users, tracks) in the model."""
+    strengths = _strengths()
+    user_ids = np.array(sorted({user_id for user_id, _ in strengths}), dtype=np.int64)
+    music_ids = np.array(sorted({music_id for _, music_id in strengths}), dtype=np.int64)
+
+    pairs = np.array(list(strengths), dtype=np.int64).reshape(-1, 2)
+    rows = np.searchsorted(user_ids, pairs[:, 0])
+    columns = np.searchsorted(music_ids, pairs[:, 1])
+    confidences = 1 + alpha * np.fromiter(strengths.values(), dtype=np.float64, count=len(strengths))
+
+    user_ptr, user_items, user_confidences = _grouped(rows, columns, confidences, len(user_ids))
+    item_ptr, item_users, item_confidences = _grouped(columns, rows, confidences, len(music_ids))
+
+    random = np.random.default_rng(seed)
+    user_factors = random.normal(scale=0.01, size=(len(user_ids), factors))
+    item_factors = random.normal(scale=0.01, size=(len(music_ids), factors))
+    for _ in range(iterations):
+        user_factors = _solve(item_factors, user_ptr, user_items, user_confidences, regularization)
+        item_factors = _solve(user_factors, item_ptr, item_users, item_confidences, regularization)
+
+    _publish({
+        'user_ids': user_ids,
+        'music_ids': music_ids,
+        'user_factors': user_factors.astype(np.float32),
+        'item_factors': item_factors.astype(np.float32),
+    }, factors)
+    return len(user_ids), len(music_ids)
+
+
+def _publish(arrays, factors):
+    model_dir = _model_dir()
+    version = f'v{time.time_ns()}'
+    (model_dir / version).mkdir(parents=True)
+    for name, array in arrays.items():
+        np.save(model_dir / version / f'{name}.npy', array)
+
+    manifest = model_dir / MANIFEST_NAME
+    previous = read_manifest()
+    temporary = manifest.with_suffix('.tmp')
+    with open(temporary, 'w') as manifest_file:
+        json.dump({'version': version, 'factors': factors, 'trained_at': time.time()}, manifest_file)
+    os.replace(temporary, manifest)
+
+    # Mapped files stay readable once unlinked, but a worker may be about to
+    # open the previous version: keep it until the next training
+    keep = {version, previous['version'] if previous else None}
+    for path in model_dir.iterdir():
+        if path.is_dir() and path.name.startswith('v') and path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_manifest():
+    try:
+        with open(_model_dir() / MANIFEST_NAME) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+
+
+class FactorModel:
+    def __init__(self, path):
+        # Memory-mapped: the pages are shared between all worker processes
+        self.user_ids = np.load(path / 'user_ids.npy', mmap_mode='r')
+        self.music_ids = np.load(path / 'music_ids.npy', mmap_mode='r')
+        self.user_factors = np.load(path / 'user_factors.npy', mmap_mode='r')
+        self.item_factors = np.load(path / 'item_factors.npy', mmap_mode='r')
+
+    def recommend(self, user_id, exclude=(), limit=10):
+        """Best scored tracks for a user, as (music_id, score) pairs, or [] for an unknown user."""
+        row = np.searchsorted(self.user_ids, user_id)
+        if row >= len(self.user_ids) or self.user_ids[row] != user_id:
+            return []
+
+        scores = self.item_factors @ self.user_factors[row]
+        if exclude:
+            excluded = np.asarray(list(exclude), dtype=np.int64)
+            positions = np.searchsorted(self.music_ids, excluded)
+            known = positions < len(self.music_ids)
+            positions = positions[known][self.music_ids[positions[known]] == excluded[known]]
+            scores[positions] = -np.inf
+
+        limit = min(limit, len(scores))
+        if not limit:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [
+            (int(self.music_ids[position]), float(scores[position]))
+            for position in best if np.isfinite(scores[position])
+        ]
+
+
+_loaded = {'model': None, 'mtime': None}
+
+
+def get_model():
+    """
+    The published model mapped in this worker process, or None before the
+    first training. It is mapped again only when a new version is published.
+    """
+    manifest = _model_dir() / MANIFEST_NAME
+    try:
+        mtime = os.stat(manifest).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _loaded['mtime'] != mtime:
+        _loaded['model'] = FactorModel(_model_dir() / read_manifest()['version'])
+        _loaded['mtime'] = mtime
+    return _loaded['model']
@@ -0,0 +1,81 @@
+"""
+HyperLogLog sketch for approximate distinct counts.
+
+A sketch of 2^precision registers estimates the number of distinct values
+added to it with a standard error of about 1.04 / sqrt(2^precision), and
+sketches of the same precision merge into the sketch of the union. Sketches
+with few non-zero registers are serialized sparsely, so a track heard by a
+handful of users on a day costs a few bytes.
+"""
+import hashlib
+import math
+import struct
+
+PRECISION = 11
+
+DENSE = 0
+SPARSE = 1
+SPARSE_ENTRY = struct.Struct('>HB')
+
+
+class HyperLogLog:
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    @classmethod
+    def from_bytes(cls, data, precision=PRECISION):
+        sketch = cls(precision)
+        if not data:
+            return sketch
+
+        data = bytes(data)
+        if data[0] == DENSE:
+            if len(data) - 1 != len(sketch.registers):
+                raise ValueError('Sketch precision does not match')
+            sketch.registers[:] = data[1:]
+        else:
+            for index, rank in SPARSE_ENTRY.iter_unpack(data[1:]):
+                sketch.registers[index] = rank
+        return sketch
+
+    def to_bytes(self):
+        used = [(index, rank) for index, rank in enumerate(self.registers) if rank]
+        if not used:
+            return b''
+        if len(used) * SPARSE_ENTRY.size < len(self.registers):
+            return bytes([SPARSE]) + b''.join(SPARSE_ENTRY.pack(index, rank) for index, rank in used)
+        return bytes([DENSE]) + bytes(self.registers)
+
+    def add(self, value):
+        """Add a value, returns True when the sketch changed."""
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+
+        rest_bits = 64 - self.precision
+        index = hashed >> rest_bits
+        rest = hashed & ((1 << rest_bits) - 1)
+        # Position of the first set bit in the remaining bits
+        rank = rest_bits - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge sketches of different precisions')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -rank for rank in self.registers)
+
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
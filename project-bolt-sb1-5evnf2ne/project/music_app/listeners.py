@@ -0,0 +1,96 @@
+"""
+Approximate unique listeners per track over any range of days.
+
+Each play adds its user to the HyperLogLog sketch of the track and day, and
+the sketches of a range of days are merged to count its distinct listeners
+without reading the listening history.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .hyperloglog import HyperLogLog
+from .models import ListeningHistory, ListenerSketch
+
+
+def record_listeners(plays):
+    """
+    Add listeners to the daily sketches.
+
+    plays is an iterable of (music_id, user_id, listened_at).
+    """
+    users_by_day = defaultdict(set)
+    for music_id, user_id, listened_at in plays:
+        users_by_day[(music_id, timezone.localdate(listened_at))].add(user_id)
+
+    for (music_id, day), user_ids in users_by_day.items():
+        with transaction.atomic():
+            row, _ = ListenerSketch.objects.select_for_update().get_or_create(music_id=music_id, day=day)
+            sketch = HyperLogLog.from_bytes(row.sketch)
+            changed = False
+            for user_id in user_ids:
+                changed |= sketch.add(user_id)
+            # Returning listeners usually leave the sketch unchanged
+            if changed:
+                row.sketch = sketch.to_bytes()
+                row.save(update_fields=['sketch'])
+
+
+def unique_listeners(music, start=None, end=None):
+    """Approximate number of distinct listeners of a track between two dates, both included."""
+    sketches = ListenerSketch.objects.filter(music=music)
+    if start:
+        sketches = sketches.filter(day__gte=start)
+    if end:
+        sketches = sketches.filter(day__lte=end)
+
+    merged = HyperLogLog()
+    for data in sketches.values_list('sketch', flat=True).iterator():
+        merged.merge(HyperLogLog.from_bytes(data))
+    return merged.count()
+
+
+def unique_listeners_last_days(music, days=30):
+    today = timezone.localdate()
+    return unique_listeners(music, today - timedelta(days=days - 1), today)
+
+
+def backfill_sketches():
+    """
+    Rebuild the sketches from the listening history. Days older than the
+    oldest history row only hold archived plays and are kept as they are.
+    Returns the number of sketches created.
+    """
+    oldest = ListeningHistory.objects.order_by('listened_at').values_list('listened_at', flat=True).first()
+    if oldest is None:
+        return 0
+    created = 0
+
+    with transaction.atomic():
+        ListenerSketch.objects.filter(day__gte=timezone.localdate(oldest)).delete()
+
+        rows = ListeningHistory.objects.annotate(day=TruncDate('listened_at')).values_list(
+            'music_id', 'day', 'user_id'
+        ).distinct().order_by('music_id', 'day')
+
+        batch = []
+        current_key, sketch = None, None
+        for music_id, day, user_id in rows.iterator():
+            if (music_id, day) != current_key:
+                if sketch is not None:
+                    batch.append(ListenerSketch(music_id=current_key[0], day=current_key[1], sketch=sketch.to_bytes()))
+                current_key, sketch = (music_id, day), HyperLogLog()
+            sketch.add(user_id)
+
+            if len(batch) >= 1000:
+                created += len(ListenerSketch.objects.bulk_create(batch))
+                batch = []
+
+        if sketch is not None:
+            batch.append(ListenerSketch(music_id=current_key[0], day=current_key[1], sketch=sketch.to_bytes()))
+        created += len(ListenerSketch.objects.bulk_create(batch))
+
+    return created
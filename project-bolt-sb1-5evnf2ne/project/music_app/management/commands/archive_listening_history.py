@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from music_app.archive import archive_listening_history
+
+class Command(BaseCommand):
+    help = 'Move old listening history to compressed monthly archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days',
+            type=int,
+            default=getattr(settings, 'LISTENING_HISTORY_RETENTION_DAYS', 180),
+            help='Archive plays older than this many days'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows archived per batch')
+
+    def handle(self, *args, **options):
+        archived = archive_listening_history(
+            older_than_days=options['older_than_days'],
+            batch_size=options['batch_size']
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully archived {archived} listening history entries'
+            )
+        )
@@ -0,0 +1,79 @@
+import threading
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from music_app.models import Music, MusicStatistics, MusicStatisticsShard
+from users.models import CustomUser
+
+class Command(BaseCommand):
+    help = 'Measure play counter throughput with many threads playing the same track'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='Number of concurrent listeners')
+        parser.add_argument('--plays', type=int, default=100, help='Plays recorded by each listener')
+        parser.add_argument('--shards', type=int, default=8, help='Counter shards for the sharded run')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        plays = options['plays']
+
+        # Throwaway artist and track, deleted with everything they own
+        user = CustomUser.objects.create_user(
+            username=f'benchmark-{time.time_ns()}',
+            user_type=CustomUser.ARTIST
+        )
+        try:
+            music = Music.objects.create(
+                title='Contention benchmark',
+                artist=user.artist_profile,
+                release_date=date.today()
+            )
+
+            self.stdout.write(f'{threads} threads x {plays} plays on one track')
+            self.stdout.write(f'{"mode":<12} {"seconds":>8} {"plays/s":>9} {"retries":>8}')
+            for label, shards in (('single row', 0), (f'{options["shards"]} shards', options['shards'])):
+                elapsed, retries = self._run(music, shards, threads, plays)
+                self.stdout.write(
+                    f'{label:<12} {elapsed:>8.2f} {threads * plays / elapsed:>9.0f} {retries:>8}'
+                )
+
+            MusicStatisticsShard.fold_into_statistics()
+            total_plays = MusicStatistics.objects.get(music=music).total_plays
+            if total_plays != 2 * threads * plays:
+                self.stdout.write(self.style.ERROR(f'Lost plays: counted {total_plays} of {2 * threads * plays}'))
+            else:
+                self.stdout.write(self.style.SUCCESS('All plays were counted'))
+        finally:
+            user.delete()
+
+    def _run(self, music, shards, threads, plays):
+        retries = [0]
+        lock = threading.Lock()
+
+        def listener():
+            try:
+                for _ in range(plays):
+                    while True:
+                        try:
+                            MusicStatistics.apply_play_delta(music.pk)
+                            break
+                        except OperationalError:
+                            # "database is locked" on SQLite
+                            with lock:
+                                retries[0] += 1
+            finally:
+                connection.close()
+
+        with override_settings(STATISTICS_COUNTER_SHARDS=shards):
+            workers = [threading.Thread(target=listener) for _ in range(threads)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+
+        return elapsed, retries[0]
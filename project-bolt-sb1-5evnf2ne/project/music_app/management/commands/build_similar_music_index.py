@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from music_app.vector_index import build_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the vector index used to find similar music'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions',
+            type=int,
+            help='Split the index into this many partitions (default: automatic, 0 to disable)'
+        )
+
+    def handle(self, *args, **options):
+        if options['partitions'] is not None and options['partitions'] < 0:
+            raise CommandError('--partitions cannot be negative')
+
+        tracks = build_index(partitions=options['partitions'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully indexed {tracks} tracks'
+            )
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from music_app.similarity import DEFAULT_NEIGHBOURS, build_similarity_model
+
+class Command(BaseCommand):
+    help = 'Build the item-item similarity model used for collaborative recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbours',
+            type=int,
+            default=DEFAULT_NEIGHBOURS,
+            help='Most similar tracks kept for each track'
+        )
+        parser.add_argument('--output', help='Where to write the model (defaults to SIMILARITY_MODEL_PATH)')
+
+    def handle(self, *args, **options):
+        if options['neighbours'] < 1:
+            raise CommandError('--neighbours must be positive')
+
+        tracks = build_similarity_model(neighbours=options['neighbours'], path=options['output'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully built the similarity model for {tracks} tracks'
+            )
+        )
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from music_app.listeners import backfill_sketches
+from music_app.rollups import DEFAULT_KEEP_HOURS, backfill_rollups, compact_rollups
+
+class Command(BaseCommand):
+    help = 'Fold hourly play rollups of past days into daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-hours',
+            type=int,
+            default=DEFAULT_KEEP_HOURS,
+            help='Keep hourly buckets for the days that ended less than this many hours ago'
+        )
+        parser.add_argument(
+            '--backfill',
+            action='store_true',
+            help='Rebuild every rollup and listener sketch from the listening history first'
+        )
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            created = backfill_rollups(keep_hours=options['keep_hours'])
+            self.stdout.write(f'Rebuilt {created} rollup buckets from the listening history')
+            sketches = backfill_sketches()
+            self.stdout.write(f'Rebuilt {sketches} daily listener sketches from the listening history')
+
+        folded = compact_rollups(keep_hours=options['keep_hours'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully folded {folded} hourly buckets into daily buckets'
+            )
+        )
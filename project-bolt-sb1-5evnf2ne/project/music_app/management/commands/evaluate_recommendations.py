@@ -0,0 +1,62 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from music_app.evaluation import evaluate
+
+class Command(BaseCommand):
+    help = 'Evaluate the quality and speed of each recommendation strategy on a time split of the history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-k', type=int, default=10, help='Recommendations evaluated per user')
+        parser.add_argument('--test-fraction', type=float, default=0.2, help='Share of the latest plays held out')
+        parser.add_argument('--users', type=int, default=200, help='Test users evaluated at most')
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            metavar='USERS',
+            help='Add a generated dataset with this many listeners to the database content for the run'
+        )
+        parser.add_argument('--tracks', type=int, default=500, help='Tracks of the generated dataset')
+        parser.add_argument('--no-retrain', action='store_true', help='Skip the model-based strategies')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        if options['k'] < 1 or options['users'] < 1:
+            raise CommandError('-k and --users must be positive')
+        if not 0 < options['test_fraction'] < 1:
+            raise CommandError('--test-fraction must be between 0 and 1')
+
+        synthetic = None
+        if options['synthetic']:
+            synthetic = {'users': options['synthetic'], 'tracks': options['tracks']}
+
+        report = evaluate(
+            k=options['k'],
+            test_fraction=options['test_fraction'],
+            max_users=options['users'],
+            synthetic=synthetic,
+            retrain=not options['no_retrain'],
+            seed=options['seed']
+        )
+        if 'error' in report:
+            raise CommandError(report['error'])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, sort_keys=True)
+
+        k = report['k']
+        for name, result in report['variants'].items():
+            self.stdout.write(
+                f"{name:<14} precision@{k} {result['precision_at_k']:.4f}  recall@{k} {result['recall_at_k']:.4f}  "
+                f"coverage {result['coverage']:.3f}  novelty {result['novelty'] or 0:.2f}  "
+                f"p50 {result['latency_ms']['p50']:.1f}ms  p95 {result['latency_ms']['p95']:.1f}ms  "
+                f"queries {result['queries']['mean']:.1f}"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully evaluated {report['test_users']} users"
+            )
+        )
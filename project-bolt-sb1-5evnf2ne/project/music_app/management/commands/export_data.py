@@ -0,0 +1,31 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from music_app import exports
+
+class Command(BaseCommand):
+    help = 'Stream the listening history, preferences or statistics as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(exports.DATASETS))
+        parser.add_argument('--format', choices=sorted(exports.FORMATS), default='csv')
+        parser.add_argument('--start', help='First day included (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last day included (YYYY-MM-DD)')
+        parser.add_argument('--artist', type=int, help='Only rows for tracks of this artist id')
+        parser.add_argument('--output', '-o', help='Output file, standard output by default')
+
+    def handle(self, *args, **options):
+        try:
+            start = exports.parse_date(options['start'])
+            end = exports.parse_date(options['end'], end=True)
+        except ValueError:
+            raise CommandError('--start and --end must be dates in the YYYY-MM-DD format')
+
+        columns, rows = exports.export_rows(options['dataset'], start=start, end=end, artist_id=options['artist'])
+        lines = exports.render(options['format'], columns, rows)
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            sys.stdout.writelines(lines)
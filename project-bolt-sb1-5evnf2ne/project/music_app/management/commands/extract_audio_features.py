@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from music_app.audio_features import rebuild_store
+
+class Command(BaseCommand):
+    help = 'Extract the audio features of the tracks for content-based recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Only extract the tracks that are not in the feature store yet'
+        )
+
+    def handle(self, *args, **options):
+        tracks = rebuild_store(only_missing=options['missing'])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully extracted the audio features of {tracks} tracks'
+            )
+        )
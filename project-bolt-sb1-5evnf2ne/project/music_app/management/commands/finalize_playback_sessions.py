@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from music_app.playback import finalize_stale_sessions
+
+class Command(BaseCommand):
+    help = 'Record the playback sessions that stopped pinging as plays, for every user'
+
+    def handle(self, *args, **options):
+        finalized = finalize_stale_sessions()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully finalized {finalized} playback sessions'
+            )
+        )
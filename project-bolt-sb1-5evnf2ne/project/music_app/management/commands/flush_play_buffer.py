@@ -0,0 +1,41 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from music_app.playbuffer import STALE_CLAIM_AGE, flush_play_buffer, should_flush
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Write buffered play events to the listening history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='Keep running and flush whenever the buffer is full or its oldest play is too old'
+        )
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds between two checks of the buffer with --watch')
+
+    def handle(self, *args, **options):
+        if options['watch']:
+            retried_at = time.monotonic()
+            while True:
+                # Batches left claimed by a failed flush are retried once stale
+                retry = time.monotonic() - retried_at >= STALE_CLAIM_AGE
+                if retry or should_flush():
+                    try:
+                        flush_play_buffer(include_stale=retry)
+                    except Exception:
+                        logger.exception('Play buffer flush failed')
+                    if retry:
+                        retried_at = time.monotonic()
+                time.sleep(options['poll'])
+
+        written = flush_play_buffer(include_stale=True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully flushed {written} buffered plays'
+            )
+        )
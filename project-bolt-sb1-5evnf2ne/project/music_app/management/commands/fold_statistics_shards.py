@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from music_app.models import MusicStatisticsShard
+
+class Command(BaseCommand):
+    help = 'Fold the sharded play counters back into music statistics'
+
+    def handle(self, *args, **options):
+        folded = MusicStatisticsShard.fold_into_statistics()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully folded {folded} plays into music statistics'
+            )
+        )
@@ -0,0 +1,61 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time
+from functools import partial
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from music_app import precompute
+
+class Command(BaseCommand):
+    help = 'Precompute the top recommendations of every user in a pool of processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=precompute.DEFAULT_LIMIT, help='Recommendations kept per user')
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes')
+        parser.add_argument('--batch-size', type=int, default=200, help='Users per task')
+        parser.add_argument(
+            '--incremental',
+            action='store_true',
+            help='Only recompute users with activity since the last run and users without recommendations'
+        )
+        parser.add_argument('--since', help='Only recompute users with activity since this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        if options['limit'] < 1 or options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--limit, --workers and --batch-size must be positive')
+
+        since = None
+        if options['since']:
+            try:
+                since = timezone.make_aware(datetime.combine(datetime.strptime(options['since'], '%Y-%m-%d').date(), time.min))
+            except ValueError:
+                raise CommandError('--since must be a date in the YYYY-MM-DD format')
+        elif options['incremental']:
+            since = precompute.last_run()
+
+        # Activity during the run is picked up by the next incremental run
+        started = timezone.now()
+        user_ids = precompute.users_to_refresh(since)
+        batches = [user_ids[start:start + options['batch_size']] for start in range(0, len(user_ids), options['batch_size'])]
+
+        # Workers open their own connections
+        connections.close_all()
+        stored = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=_init_worker) as executor:
+            compute = partial(precompute.compute_batch, limit=options['limit'])
+            for results in executor.map(compute, batches):
+                stored += precompute.store_batch(results, options['limit'], started)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully precomputed recommendations for {stored} users'
+            )
+        )
+
+
+def _init_worker():
+    # Workers started with spawn need Django set up again
+    django.setup()
+    precompute.init_worker()
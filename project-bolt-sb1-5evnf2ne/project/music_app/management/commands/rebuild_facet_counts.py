@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from music_app.models import FacetCount
+
+class Command(BaseCommand):
+    help = 'Recount the tracks of every genre and artist shown by the music browser filters'
+
+    def handle(self, *args, **options):
+        counts = FacetCount.rebuild()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully rebuilt {counts} facet counts'
+            )
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from music_app.search import fts_enabled, rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of the music catalog'
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            raise CommandError('The full-text search index is only available on SQLite')
+
+        with transaction.atomic():
+            tracks = rebuild_index()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully indexed {tracks} tracks'
+            )
+        )
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from music_app.models import Music, MusicStatistics, ListeningHistory, UserMusicPreference
+
+class Command(BaseCommand):
+    help = 'Recompute the statistics of every track with grouped aggregate queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Tracks recomputed per batch')
+        parser.add_argument('--workers', type=int, default=1, help='Batches recomputed in parallel')
+        parser.add_argument(
+            '--since',
+            help='Only rebuild tracks played or rated since this date (YYYY-MM-DD)'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size and --workers must be positive')
+
+        # Tracks without statistics get an empty row first
+        missing = Music.objects.filter(statistics__isnull=True).values_list('id', flat=True)
+        created = MusicStatistics.objects.bulk_create(
+            [MusicStatistics(music_id=music_id) for music_id in missing.iterator()],
+            batch_size=chunk_size
+        )
+        if created:
+            self.stdout.write(f'Created {len(created)} missing statistics entries')
+
+        if options['since']:
+            music_ids = self._active_music_ids(options['since'])
+        else:
+            music_ids = MusicStatistics.objects.order_by('music_id').values_list('music_id', flat=True)
+        music_ids = list(music_ids)
+        chunks = [music_ids[start:start + chunk_size] for start in range(0, len(music_ids), chunk_size)]
+
+        # Workers run the aggregate queries in parallel while the results are
+        # written from this thread, so writers never wait on each other.
+        # Tracks that changed since their chunk was computed are recomputed
+        # by rebuild() as it writes
+        updated = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for chunk, (computed_at, values) in zip(chunks, executor.map(self._recompute_chunk, chunks)):
+                updated += MusicStatistics.rebuild(chunk, values, computed_at)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully rebuilt statistics for {updated} tracks'
+            )
+        )
+
+    def _active_music_ids(self, since):
+        try:
+            since = timezone.make_aware(datetime.combine(datetime.strptime(since, '%Y-%m-%d').date(), time.min))
+        except ValueError:
+            raise CommandError('--since must be a date in the YYYY-MM-DD format')
+
+        played = ListeningHistory.objects.filter(listened_at__gte=since).values_list('music_id', flat=True)
+        rated = UserMusicPreference.objects.filter(last_listened__gte=since).values_list('music_id', flat=True)
+        return sorted(set(played.distinct()) | set(rated.distinct()))
+
+    def _recompute_chunk(self, music_ids):
+        try:
+            computed_at = timezone.now()
+            return computed_at, MusicStatistics.recompute(music_ids)
+        finally:
+            # Each worker thread has its own connection
+            connection.close()
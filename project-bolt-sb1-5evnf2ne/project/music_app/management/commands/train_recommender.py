@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from music_app import factorization
+
+class Command(BaseCommand):
+    help = 'Train the implicit matrix factorization model used for recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--factors', type=int, default=factorization.DEFAULT_FACTORS, help='Size of the vectors')
+        parser.add_argument('--iterations', type=int, default=factorization.DEFAULT_ITERATIONS, help='ALS iterations')
+        parser.add_argument(
+            '--regularization',
+            type=float,
+            default=factorization.DEFAULT_REGULARIZATION,
+            help='L2 regularization of the factors'
+        )
+        parser.add_argument(
+            '--alpha',
+            type=float,
+            default=factorization.DEFAULT_ALPHA,
+            help='How fast confidence grows with the strength of an interaction'
+        )
+
+    def handle(self, *args, **options):
+        if options['factors'] < 1 or options['iterations'] < 1:
+            raise CommandError('--factors and --iterations must be positive')
+
+        users, tracks = factorization.train_factor_model(
+            factors=options['factors'],
+            iterations=options['iterations'],
+            regularization=options['regularization'],
+            alpha=options['alpha']
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully trained factors for {users} users and {tracks} tracks'
+            )
+        )
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:45
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_rating_sums(apps, schema_editor):
+    MusicStatistics = apps.get_model('music_app', 'MusicStatistics')
+    UserMusicPreference = apps.get_model('music_app', 'UserMusicPreference')
+
+    ratings = UserMusicPreference.objects.filter(rating__isnull=False).values('music').annotate(
+        total=Sum('rating'),
+        count=Count('id')
+    )
+    for row in ratings:
+        MusicStatistics.objects.filter(music_id=row['music']).update(
+            rating_sum=row['total'],
+            rating_count=row['count']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0003_musicstatistics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='musicstatistics',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='musicstatistics',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_sums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:46
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0004_musicstatistics_rating_sum'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listeninghistory',
+            name='listened_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
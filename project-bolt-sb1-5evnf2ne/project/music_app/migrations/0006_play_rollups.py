@@ -0,0 +1,64 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:47
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0005_alter_listeninghistory_listened_at'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenrePlayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], default='hour', max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('duration_played', models.DurationField(default=datetime.timedelta(0))),
+                ('genre', models.CharField(choices=[('pop', 'Pop'), ('rock', 'Rock'), ('jazz', 'Jazz'), ('classical', 'Classical'), ('hip_hop', 'Hip Hop'), ('electronic', 'Electronic'), ('country', 'Country'), ('r_and_b', 'R&B'), ('indie', 'Indie'), ('chaabi', 'chaabi'), ('other', 'Other')], max_length=20)),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'unique_together': {('genre', 'period', 'bucket_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ArtistPlayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], default='hour', max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('duration_played', models.DurationField(default=datetime.timedelta(0))),
+                ('artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='play_rollups', to='users.artist')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'unique_together': {('artist', 'period', 'bucket_start')},
+            },
+        ),
+        migrations.CreateModel(
+            name='TrackPlayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], default='hour', max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('duration_played', models.DurationField(default=datetime.timedelta(0))),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='play_rollups', to='music_app.music')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+                'abstract': False,
+                'unique_together': {('music', 'period', 'bucket_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:49
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0006_play_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MusicStatisticsShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('total_plays', models.PositiveIntegerField(default=0)),
+                ('total_duration_played', models.DurationField(default=datetime.timedelta(0))),
+                ('last_played', models.DateTimeField(blank=True, null=True)),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='statistics_shards', to='music_app.music')),
+            ],
+            options={
+                'unique_together': {('music', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0007_musicstatisticsshard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListenerSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('sketch', models.BinaryField(default=b'')),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='listener_sketches', to='music_app.music')),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('music', 'day')},
+            },
+        ),
+    ]
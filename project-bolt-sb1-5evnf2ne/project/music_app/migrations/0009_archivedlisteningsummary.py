@@ -0,0 +1,32 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:53
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0008_listenersketch'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedListeningSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('duration_played', models.DurationField(default=datetime.timedelta(0))),
+                ('last_played', models.DateTimeField(blank=True, null=True)),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_listening', to='music_app.music')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Archived Listening Summaries',
+                'unique_together': {('user', 'music')},
+            },
+        ),
+    ]
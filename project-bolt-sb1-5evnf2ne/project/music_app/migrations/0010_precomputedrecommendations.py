@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0009_archivedlisteningsummary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrecomputedRecommendations',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('packed_music_ids', models.BinaryField(default=b'')),
+                ('limit', models.PositiveIntegerField()),
+                ('computed_at', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='precomputed_recommendations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Precomputed Recommendations',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0010_precomputedrecommendations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserHeardSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('packed_music_ids', models.BinaryField(default=b'')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='heard_set', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
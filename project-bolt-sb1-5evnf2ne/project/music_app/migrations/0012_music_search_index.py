@@ -0,0 +1,75 @@
+# Generated by Django 5.0.2 on 2026-10-18 12:30
+
+from django.db import migrations
+
+# SQLite only: other databases search with LIKE queries
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE music_app_music_fts USING fts5(
+        title, artist, genre,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER music_app_music_fts_insert AFTER INSERT ON music_app_music BEGIN
+        INSERT INTO music_app_music_fts (rowid, title, artist, genre)
+        SELECT new.id, new.title, (SELECT full_name FROM users_artist WHERE id = new.artist_id), new.genre;
+    END
+    """,
+    """
+    CREATE TRIGGER music_app_music_fts_update AFTER UPDATE OF title, artist_id, genre ON music_app_music BEGIN
+        DELETE FROM music_app_music_fts WHERE rowid = old.id;
+        INSERT INTO music_app_music_fts (rowid, title, artist, genre)
+        SELECT new.id, new.title, (SELECT full_name FROM users_artist WHERE id = new.artist_id), new.genre;
+    END
+    """,
+    """
+    CREATE TRIGGER music_app_music_fts_delete AFTER DELETE ON music_app_music BEGIN
+        DELETE FROM music_app_music_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER music_app_music_fts_artist AFTER UPDATE OF full_name ON users_artist BEGIN
+        UPDATE music_app_music_fts SET artist = new.full_name
+        WHERE rowid IN (SELECT id FROM music_app_music WHERE artist_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO music_app_music_fts (rowid, title, artist, genre)
+    SELECT music.id, music.title, artist.full_name, music.genre
+    FROM music_app_music music JOIN users_artist artist ON artist.id = music.artist_id
+    """,
+]
+
+DROP_INDEX = [
+    'DROP TRIGGER IF EXISTS music_app_music_fts_artist',
+    'DROP TRIGGER IF EXISTS music_app_music_fts_delete',
+    'DROP TRIGGER IF EXISTS music_app_music_fts_update',
+    'DROP TRIGGER IF EXISTS music_app_music_fts_insert',
+    'DROP TABLE IF EXISTS music_app_music_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_INDEX:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_INDEX:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0011_userheardset'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0012_music_search_index'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='listeninghistory',
+            index=models.Index(fields=['music', 'listened_at'], name='music_app_l_music_i_29a2ac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='music',
+            index=models.Index(fields=['release_date', 'id'], name='music_app_m_release_32f3b3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='music',
+            index=models.Index(fields=['genre', 'release_date', 'id'], name='music_app_m_genre_157206_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playlist',
+            index=models.Index(fields=['creator', 'created_at', 'id'], name='music_app_p_creator_c58e05_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usermusicpreference',
+            index=models.Index(fields=['user', 'favorite'], name='music_app_u_user_id_035399_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:21
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_facet_counts(apps, schema_editor):
+    FacetCount = apps.get_model('music_app', 'FacetCount')
+    Music = apps.get_model('music_app', 'Music')
+
+    FacetCount.objects.bulk_create(
+        [
+            FacetCount(facet=facet, value=str(value), count=count)
+            for facet, field in (('genre', 'genre'), ('artist', 'artist_id'))
+            for value, count in Music.objects.order_by().values_list(field).annotate(count=Count('id'))
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0013_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('genre', 'Genre'), ('artist', 'Artist')], max_length=6)),
+                ('value', models.CharField(max_length=20)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('facet', 'value')},
+            },
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
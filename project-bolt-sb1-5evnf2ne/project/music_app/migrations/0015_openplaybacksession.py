@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0014_facetcount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenPlaybackSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(max_length=64)),
+                ('opened_at', models.DateTimeField(auto_now_add=True)),
+                ('music', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='music_app.music')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'music', 'session_id')},
+            },
+        ),
+    ]
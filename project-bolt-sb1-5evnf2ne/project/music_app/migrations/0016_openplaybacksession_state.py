@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:45
+
+import datetime
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0015_openplaybacksession'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='openplaybacksession',
+            name='last_ping',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='openplaybacksession',
+            name='listened',
+            field=models.DurationField(default=datetime.timedelta),
+        ),
+        migrations.AddField(
+            model_name='openplaybacksession',
+            name='playing',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='openplaybacksession',
+            index=models.Index(fields=['last_ping'], name='music_app_o_last_pi_ccc982_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:52
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # The table of the database cache in CACHES; nothing to do for other
+    # backends or when it exists already
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_app', '0016_openplaybacksession_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,17 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from mutagen.mp3 import MP3
+import copy
 import os
+import random
+import struct
+from collections import defaultdict
 from datetime import timedelta
-from django.db.models import Avg, Sum
+from django.db.models import Avg, Count, Exists, Max, OuterRef, Subquery, Sum, F, Q, Case, When, Value, FloatField
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
 from django.utils import timezone
-from django.db.models.signals import post_save
-from django.dispatch import receiver
 
 
 class Music(models.Model):
@@ -36,9 +41,32 @@ class Music(models.Model):
     class Meta:
         verbose_name_plural = 'Music'
         ordering = ['-release_date']
+        indexes = [
+            # Keyset pagination of the catalog, whole and per genre
+            models.Index(fields=['release_date', 'id']),
+            models.Index(fields=['genre', 'release_date', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.artist.full_name}"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.remember_stored_facets()
+
+    def remember_stored_facets(self):
+        # Keep the genre and artist as they are in the database so that the
+        # facet counts can be moved when the track is saved
+        if 'genre' in self.__dict__ and 'artist_id' in self.__dict__:
+            self._stored_facets = (self.genre, self.artist_id)
+        else:
+            self._stored_facets = None
+
+    def load_stored_facets(self):
+        # Loaded with deferred fields: read the stored genre and artist of
+        # this row only
+        if self._stored_facets is None and self.pk is not None:
+            self._stored_facets = Music.objects.filter(pk=self.pk).order_by().values_list('genre', 'artist_id').first()
     
     def save(self, *args, **kwargs):
         # Calculate duration if not provided
@@ -67,16 +95,37 @@ class Music(models.Model):
 class ListeningHistory(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     music = models.ForeignKey(Music, on_delete=models.CASCADE)
-    listened_at = models.DateTimeField(auto_now_add=True)
+    listened_at = models.DateTimeField(default=timezone.now)
     listened_duration = models.DurationField(null=True, blank=True)
 
     class Meta:
         verbose_name_plural = 'Listening Histories'
         ordering = ['-listened_at']
+        indexes = [
+            # Plays of a track over a time window
+            models.Index(fields=['music', 'listened_at']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} listened to {self.music.title}"
 
+    @classmethod
+    def heard_pairs(cls, user_ids, music_ids, exclude_ids=()):
+        """(user id, music id) pairs with an earlier play, archived plays included."""
+        pairs = set(
+            cls.objects.filter(
+                user_id__in=user_ids,
+                music_id__in=music_ids
+            ).exclude(id__in=exclude_ids).values_list('user_id', 'music_id').distinct()
+        )
+        pairs.update(
+            ArchivedListeningSummary.objects.filter(
+                user_id__in=user_ids,
+                music_id__in=music_ids
+            ).values_list('user_id', 'music_id')
+        )
+        return pairs
+
 
 class UserMusicPreference(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
@@ -88,10 +137,71 @@ class UserMusicPreference(models.Model):
 
     class Meta:
         unique_together = ['user', 'music']
+        indexes = [
+            # Favorites of a user
+            models.Index(fields=['user', 'favorite']),
+        ]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.remember_stored_state()
 
     def __str__(self):
         return f"{self.user.username}'s preference for {self.music.title}"
 
+    def remember_stored_state(self):
+        # Keep the rating and favorite flag as they are in the database so that
+        # statistics can be updated with a delta when the preference is saved
+        if 'rating' in self.__dict__ and 'favorite' in self.__dict__:
+            self._stored_state = (self.rating, self.favorite)
+        else:
+            self._stored_state = None
+
+    def _lock_stored_state(self):
+        # The state this instance was loaded with may be outdated by another
+        # request's save: lock the row and read it, so that two saves of the
+        # same preference never apply the same delta twice
+        self._stored_state = UserMusicPreference.objects.select_for_update().filter(pk=self.pk).values_list(
+            'rating', 'favorite'
+        ).first() or (None, False)
+
+    @staticmethod
+    def changes_statistics(update_fields):
+        """Whether a save with these update_fields can change the track's statistics."""
+        return update_fields is None or bool({'rating', 'favorite'} & set(update_fields))
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or not self.changes_statistics(kwargs.get('update_fields')):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            self._lock_stored_state()
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self._lock_stored_state()
+            return super().delete(*args, **kwargs)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        if fields is None or {'rating', 'favorite'} <= set(fields):
+            self.remember_stored_state()
+
+    @classmethod
+    def change_favorite_count(cls, user_id, delta):
+        """
+        Apply a change to the user's favorite_count column, in the same
+        transaction as the preference. A delta of None recounts it.
+        """
+        users = get_user_model().objects.filter(pk=user_id)
+        if delta is None:
+            favorites = cls.objects.filter(user_id=user_id, favorite=True).order_by().values('user_id').annotate(
+                count=Count('id')
+            ).values('count')
+            users.update(favorite_count=Coalesce(Subquery(favorites), 0))
+        else:
+            users.update(favorite_count=Greatest(F('favorite_count') + delta, 0))
+
     @classmethod
     def get_user_preferred_genres(cls, user, limit=3):
         return cls.objects.filter(
@@ -111,6 +221,14 @@ class UserMusicPreference(models.Model):
         ).order_by('-avg_rating')[:limit]
 
 
+def latest_of(field, moment):
+    """Expression keeping the latest of a nullable datetime column and a moment."""
+    return Case(
+        When(Q(**{f'{field}__isnull': True}) | Q(**{f'{field}__lt': moment}), then=Value(moment)),
+        default=F(field)
+    )
+
+
 class MusicStatistics(models.Model):
     music = models.OneToOneField(Music, on_delete=models.CASCADE, related_name='statistics')
     total_plays = models.PositiveIntegerField(default=0)
@@ -119,6 +237,8 @@ class MusicStatistics(models.Model):
     total_favorites = models.PositiveIntegerField(default=0)
     last_played = models.DateTimeField(null=True, blank=True)
     total_duration_played = models.DurationField(default=timedelta())
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -128,30 +248,574 @@ class MusicStatistics(models.Model):
     def __str__(self):
         return f"Statistics for {self.music.title}"
 
-    def update_statistics(self):
-        # Update total plays and unique listeners
-        history = ListeningHistory.objects.filter(music=self.music)
-        self.total_plays = history.count()
-        self.unique_listeners = history.values('user').distinct().count()
+    @classmethod
+    def apply_play_delta(cls, music_id, plays=1, duration=None, listened_at=None, new_listeners=0):
+        """Add new plays to the statistics of a track with a single UPDATE."""
+        shards = getattr(settings, 'STATISTICS_COUNTER_SHARDS', 0)
+        if shards > 1:
+            # Spread the play counters of hot tracks over several rows, they
+            # are folded back by MusicStatisticsShard.fold_into_statistics()
+            MusicStatisticsShard.add_plays(music_id, random.randrange(shards), plays, duration, listened_at)
+            if new_listeners:
+                cls._apply_delta(music_id, {'unique_listeners': F('unique_listeners') + new_listeners})
+            return
+
+        changes = {
+            'total_plays': F('total_plays') + plays,
+            'unique_listeners': F('unique_listeners') + new_listeners,
+        }
+        if duration:
+            changes['total_duration_played'] = F('total_duration_played') + duration
+        if listened_at:
+            changes['last_played'] = latest_of('last_played', listened_at)
+        cls._apply_delta(music_id, changes)
 
-        # Update total duration played
-        total_duration = history.aggregate(total=Sum('listened_duration'))['total']
-        self.total_duration_played = total_duration if total_duration else timedelta()
+    @classmethod
+    def apply_preference_delta(cls, music_id, old_rating, new_rating, old_favorite, new_favorite, create_missing=True):
+        """
+        Apply the change of one user's rating and favorite flag to the
+        statistics of a track. Without create_missing, a track without
+        statistics is left as it is.
+        """
+        rating_sum_delta = (new_rating or 0) - (old_rating or 0)
+        rating_count_delta = (new_rating is not None) - (old_rating is not None)
+        favorites_delta = bool(new_favorite) - bool(old_favorite)
+
+        changes = {}
+        if rating_sum_delta or rating_count_delta:
+            # The right-hand side of an UPDATE sees the old values, so the new
+            # average is computed from the old sum and count plus the delta
+            changes['rating_sum'] = F('rating_sum') + rating_sum_delta
+            changes['rating_count'] = F('rating_count') + rating_count_delta
+            changes['average_rating'] = Case(
+                When(rating_count=-rating_count_delta, then=Value(0.0)),
+                default=Round(
+                    Cast(F('rating_sum') + rating_sum_delta, FloatField()) / (F('rating_count') + rating_count_delta),
+                    2
+                ),
+                output_field=FloatField()
+            )
+        if favorites_delta:
+            changes['total_favorites'] = F('total_favorites') + favorites_delta
+
+        if changes:
+            cls._apply_delta(music_id, changes, create_missing)
 
-        # Update average rating
-        ratings = UserMusicPreference.objects.filter(music=self.music, rating__isnull=False)
-        avg_rating = ratings.aggregate(avg=Avg('rating'))['avg']
-        self.average_rating = round(avg_rating, 2) if avg_rating else 0.0
+    @classmethod
+    def _apply_delta(cls, music_id, changes, create_missing=True):
+        changes['updated_at'] = timezone.now()
+        if not cls.objects.filter(music_id=music_id).update(**changes) and create_missing:
+            # No statistics yet for this track: build them from scratch
+            statistics, _ = cls.objects.get_or_create(music_id=music_id)
+            statistics.update_statistics()
+
+    def with_shards(self):
+        """
+        Copy of the statistics including the plays still held in counter
+        shards. The shard totals are cached for a few seconds.
+        """
+        key = f'music-statistics-shards:{self.music_id}'
+        pending = cache.get(key)
+        if pending is None:
+            pending = MusicStatisticsShard.objects.filter(music_id=self.music_id).aggregate(
+                plays=Sum('total_plays'),
+                duration=Sum('total_duration_played'),
+                last_played=Max('last_played')
+            )
+            cache.set(key, pending, getattr(settings, 'STATISTICS_SHARD_CACHE_TIMEOUT', 5))
+
+        statistics = copy.copy(self)
+        statistics.total_plays += pending['plays'] or 0
+        statistics.total_duration_played += pending['duration'] or timedelta()
+        if pending['last_played'] and (not statistics.last_played or pending['last_played'] > statistics.last_played):
+            statistics.last_played = pending['last_played']
+        return statistics
+
+    # Fields recomputed from the history and preferences
+    RECOMPUTED_FIELDS = [
+        'total_plays', 'unique_listeners', 'total_duration_played', 'last_played',
+        'rating_sum', 'rating_count', 'average_rating', 'total_favorites', 'updated_at',
+    ]
 
-        # Update total favorites
-        self.total_favorites = UserMusicPreference.objects.filter(music=self.music, favorite=True).count()
+    def update_statistics(self):
+        """Recompute every statistic from the raw history and preferences.
 
-        # Update last played
-        last_play = history.order_by('-listened_at').first()
-        self.last_played = last_play.listened_at if last_play else None
+        Plays and preference changes are applied as deltas, so this full
+        recompute is only needed to repair statistics that drifted.
+        """
+        # The history already includes the plays held in counter shards
+        MusicStatisticsShard.objects.filter(music_id=self.music_id).delete()
+        cache.delete(f'music-statistics-shards:{self.music_id}')
 
+        self._set_recomputed_values(self.recompute([self.music_id]).get(self.music_id, {}))
         self.save()
 
+    @classmethod
+    def rebuild(cls, music_ids, values=None, computed_at=None):
+        """
+        Recompute the statistics of several tracks at once, or write values
+        returned by recompute() when it started at computed_at. Returns the
+        number of rows updated.
+
+        Tracks whose statistics received a delta since computed_at, or with
+        plays held in counter shards, are recomputed under the row locks, so
+        no play or rating applied meanwhile is overwritten or dropped.
+        """
+        music_ids = list(music_ids)
+        with transaction.atomic():
+            rows = list(cls.objects.select_for_update().filter(music_id__in=music_ids))
+            if values is None:
+                stale = music_ids
+            else:
+                sharded = set(
+                    MusicStatisticsShard.objects.select_for_update().filter(
+                        music_id__in=music_ids,
+                        total_plays__gt=0
+                    ).values_list('music_id', flat=True)
+                )
+                stale = [
+                    statistics.music_id for statistics in rows
+                    if statistics.music_id in sharded or statistics.updated_at >= computed_at
+                ]
+            if stale:
+                # The history already includes the plays held in counter shards
+                MusicStatisticsShard.objects.filter(music_id__in=stale).delete()
+                values = {**(values or {}), **cls.recompute(stale)}
+            for statistics in rows:
+                statistics._set_recomputed_values(values.get(statistics.music_id, {}))
+            cls.objects.bulk_update(rows, cls.RECOMPUTED_FIELDS)
+        cache.delete_many([f'music-statistics-shards:{music_id}' for music_id in stale])
+        return len(rows)
+
+    @staticmethod
+    def recompute(music_ids):
+        """Aggregate the statistics of tracks with one grouped query per source table."""
+        values = defaultdict(dict)
+
+        # Plays, unique listeners, duration and last play. Listeners with
+        # archived plays are counted from the archive summaries below
+        archived_listener = ArchivedListeningSummary.objects.filter(
+            user_id=OuterRef('user_id'),
+            music_id=OuterRef('music_id')
+        )
+        history = ListeningHistory.objects.filter(music_id__in=music_ids).values('music').annotate(
+            plays=Count('id'),
+            listeners=Count('user', distinct=True, filter=~Exists(archived_listener)),
+            duration=Sum('listened_duration'),
+            last=Max('listened_at')
+        ).order_by()
+        for row in history:
+            values[row['music']].update(
+                total_plays=row['plays'],
+                unique_listeners=row['listeners'],
+                total_duration_played=row['duration'] or timedelta(),
+                last_played=row['last']
+            )
+
+        # Plays moved out of the history into the archive
+        archived = ArchivedListeningSummary.objects.filter(music_id__in=music_ids).values('music').annotate(
+            plays=Sum('plays'),
+            listeners=Count('user'),
+            duration=Sum('duration_played'),
+            last=Max('last_played')
+        ).order_by()
+        for row in archived:
+            track = values[row['music']]
+            track['total_plays'] = track.get('total_plays', 0) + row['plays']
+            track['unique_listeners'] = track.get('unique_listeners', 0) + row['listeners']
+            track['total_duration_played'] = track.get('total_duration_played', timedelta()) + (row['duration'] or timedelta())
+            if not track.get('last_played') or (row['last'] and row['last'] > track['last_played']):
+                track['last_played'] = row['last']
+
+        # Ratings and favorites
+        preferences = UserMusicPreference.objects.filter(music_id__in=music_ids).values('music').annotate(
+            ratings_total=Sum('rating'),
+            ratings=Count('rating'),
+            favorites=Count('id', filter=Q(favorite=True))
+        ).order_by()
+        for row in preferences:
+            values[row['music']].update(
+                rating_sum=row['ratings_total'] or 0,
+                rating_count=row['ratings'],
+                total_favorites=row['favorites']
+            )
+
+        return values
+
+    def _set_recomputed_values(self, values):
+        self.total_plays = values.get('total_plays', 0)
+        self.unique_listeners = values.get('unique_listeners', 0)
+        self.total_duration_played = values.get('total_duration_played', timedelta())
+        self.last_played = values.get('last_played')
+        self.rating_sum = values.get('rating_sum', 0)
+        self.rating_count = values.get('rating_count', 0)
+        self.average_rating = round(self.rating_sum / self.rating_count, 2) if self.rating_count else 0.0
+        self.total_favorites = values.get('total_favorites', 0)
+        self.updated_at = timezone.now()
+
+
+class MusicStatisticsShard(models.Model):
+    """One of the rows the play counters of a track are spread over."""
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='statistics_shards')
+    shard = models.PositiveSmallIntegerField()
+    total_plays = models.PositiveIntegerField(default=0)
+    total_duration_played = models.DurationField(default=timedelta())
+    last_played = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['music', 'shard']
+
+    def __str__(self):
+        return f"Statistics shard {self.shard} for {self.music.title}"
+
+    @classmethod
+    def add_plays(cls, music_id, shard, plays, duration=None, listened_at=None):
+        changes = {'total_plays': F('total_plays') + plays}
+        if duration:
+            changes['total_duration_played'] = F('total_duration_played') + duration
+        if listened_at:
+            changes['last_played'] = latest_of('last_played', listened_at)
+
+        if cls.objects.filter(music_id=music_id, shard=shard).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    music_id=music_id,
+                    shard=shard,
+                    total_plays=plays,
+                    total_duration_played=duration or timedelta(),
+                    last_played=listened_at
+                )
+        except IntegrityError:
+            # The shard was created concurrently
+            cls.objects.filter(music_id=music_id, shard=shard).update(**changes)
+
+    @classmethod
+    def fold_into_statistics(cls):
+        """Move the shard counters into MusicStatistics. Returns the number of plays moved."""
+        folded = 0
+        music_ids = cls.objects.filter(total_plays__gt=0).values_list('music_id', flat=True).distinct()
+
+        for music_id in list(music_ids):
+            with transaction.atomic():
+                shards = list(cls.objects.filter(music_id=music_id, total_plays__gt=0))
+                plays = sum(shard.total_plays for shard in shards)
+                duration = sum((shard.total_duration_played for shard in shards), timedelta())
+                last_played = max((shard.last_played for shard in shards if shard.last_played), default=None)
+
+                changes = {'total_plays': F('total_plays') + plays}
+                if duration:
+                    changes['total_duration_played'] = F('total_duration_played') + duration
+                if last_played:
+                    changes['last_played'] = latest_of('last_played', last_played)
+                MusicStatistics._apply_delta(music_id, changes)
+
+                # Subtract what was read rather than resetting, so plays added
+                # to a shard in the meantime are kept
+                for shard in shards:
+                    cls.objects.filter(pk=shard.pk).update(
+                        total_plays=F('total_plays') - shard.total_plays,
+                        total_duration_played=F('total_duration_played') - shard.total_duration_played
+                    )
+            cache.delete(f'music-statistics-shards:{music_id}')
+            folded += plays
+
+        return folded
+
+
+class ArchivedListeningSummary(models.Model):
+    """Plays of a user on a track that were moved from ListeningHistory to the archive."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='archived_listening')
+    plays = models.PositiveIntegerField(default=0)
+    duration_played = models.DurationField(default=timedelta())
+    last_played = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ['user', 'music']
+        verbose_name_plural = 'Archived Listening Summaries'
+
+    def __str__(self):
+        return f"{self.user.username}'s archived plays of {self.music.title}"
+
+
+class OpenPlaybackSession(models.Model):
+    """
+    A playback session that was not recorded as a play yet, with the state
+    its pings update: the last ping, whether the track was playing then and
+    the time listened so far.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    music = models.ForeignKey(Music, on_delete=models.CASCADE)
+    session_id = models.CharField(max_length=64)
+    opened_at = models.DateTimeField(auto_now_add=True)
+    last_ping = models.DateTimeField(default=timezone.now)
+    playing = models.BooleanField(default=False)
+    listened = models.DurationField(default=timedelta)
+
+    class Meta:
+        unique_together = ['user', 'music', 'session_id']
+        indexes = [
+            # Sessions that stopped pinging
+            models.Index(fields=['last_ping']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} playing {self.music.title}"
+
+
+class PlayRollup(models.Model):
+    """Plays aggregated per time bucket, recent plays per hour and older plays per day."""
+    HOUR = 'hour'
+    DAY = 'day'
+
+    PERIOD_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, default=HOUR)
+    bucket_start = models.DateTimeField()
+    plays = models.PositiveIntegerField(default=0)
+    duration_played = models.DurationField(default=timedelta())
+
+    class Meta:
+        abstract = True
+        ordering = ['bucket_start']
+
+
+class TrackPlayRollup(PlayRollup):
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='play_rollups')
+
+    class Meta(PlayRollup.Meta):
+        unique_together = ['music', 'period', 'bucket_start']
+
+    def __str__(self):
+        return f"{self.music.title} - {self.period} of {self.bucket_start}"
+
+
+class ArtistPlayRollup(PlayRollup):
+    artist = models.ForeignKey('users.Artist', on_delete=models.CASCADE, related_name='play_rollups')
+
+    class Meta(PlayRollup.Meta):
+        unique_together = ['artist', 'period', 'bucket_start']
+
+    def __str__(self):
+        return f"{self.artist.full_name} - {self.period} of {self.bucket_start}"
+
+
+class GenrePlayRollup(PlayRollup):
+    genre = models.CharField(max_length=20, choices=Music.GENRE_CHOICES)
+
+    class Meta(PlayRollup.Meta):
+        unique_together = ['genre', 'period', 'bucket_start']
+
+    def __str__(self):
+        return f"{self.get_genre_display()} - {self.period} of {self.bucket_start}"
+
+
+class FacetCount(models.Model):
+    """Number of tracks of a genre or of an artist, kept up to date as tracks are saved and deleted."""
+    GENRE = 'genre'
+    ARTIST = 'artist'
+
+    FACET_CHOICES = [
+        (GENRE, 'Genre'),
+        (ARTIST, 'Artist'),
+    ]
+
+    # Music field counted by each facet
+    FIELDS = {GENRE: 'genre', ARTIST: 'artist_id'}
+
+    facet = models.CharField(max_length=6, choices=FACET_CHOICES)
+    # Genre code or artist id
+    value = models.CharField(max_length=20)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['facet', 'value']
+
+    def __str__(self):
+        return f"{self.facet} {self.value}: {self.count} tracks"
+
+    @classmethod
+    def apply_delta(cls, facet, value, delta):
+        """Add tracks to a count with a single UPDATE."""
+        value = str(value)
+        if not cls.objects.filter(facet=facet, value=value).update(count=Greatest(F('count') + delta, 0)):
+            # No count yet for this value: count its tracks from scratch
+            facet_count, _ = cls.objects.get_or_create(facet=facet, value=value)
+            facet_count.count = Music.objects.filter(**{cls.FIELDS[facet]: value}).count()
+            facet_count.save(update_fields=['count'])
+
+    @classmethod
+    def move(cls, old_facets, new_facets):
+        """Move a track from the counts of its old genre and artist to the new ones."""
+        old_facets = old_facets or (None, None)
+        new_facets = new_facets or (None, None)
+        for facet, old_value, new_value in zip((cls.GENRE, cls.ARTIST), old_facets, new_facets):
+            if old_value == new_value:
+                continue
+            if old_value is not None:
+                cls.apply_delta(facet, old_value, -1)
+            if new_value is not None:
+                cls.apply_delta(facet, new_value, 1)
+
+    @classmethod
+    def rebuild(cls):
+        """Recount every genre and artist with grouped queries. Returns the number of counts."""
+        counts = [
+            cls(facet=facet, value=str(value), count=count)
+            for facet, field in cls.FIELDS.items()
+            for value, count in Music.objects.order_by().values_list(field).annotate(count=Count('id'))
+        ]
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(counts, batch_size=1000)
+        return len(counts)
+
+    @classmethod
+    def counts(cls, facet):
+        """Track counts of a facet, by genre code or artist id as a string."""
+        return dict(cls.objects.filter(facet=facet).values_list('value', 'count'))
+
+
+class ListenerSketch(models.Model):
+    """HyperLogLog sketch of the users who listened to a track on a day."""
+    music = models.ForeignKey(Music, on_delete=models.CASCADE, related_name='listener_sketches')
+    day = models.DateField()
+    sketch = models.BinaryField(default=b'')
+
+    class Meta:
+        unique_together = ['music', 'day']
+        ordering = ['day']
+
+    def __str__(self):
+        return f"Listeners of {self.music.title} on {self.day}"
+
+
+def pack_ids(ids):
+    """Pack ids as little-endian 64-bit integers."""
+    return struct.pack(f'<{len(ids)}q', *ids)
+
+
+def unpack_ids(data):
+    data = bytes(data)
+    return list(struct.unpack(f'<{len(data) // 8}q', data))
+
+
+class UserHeardSet(models.Model):
+    """Every track a user has listened to, archived plays included."""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='heard_set'
+    )
+    # Sorted music ids, packed as little-endian 64-bit integers
+    packed_music_ids = models.BinaryField(default=b'')
+
+    def __str__(self):
+        return f"Tracks heard by {self.user.username}"
+
+    @property
+    def music_ids(self):
+        return unpack_ids(self.packed_music_ids)
+
+    @classmethod
+    def for_user(cls, user_id):
+        """The music ids heard by a user, as a set."""
+        packed = cls.objects.filter(user_id=user_id).values_list('packed_music_ids', flat=True).first()
+        if packed is None:
+            # Users who listened before heard sets existed
+            return set(cls.rebuild([user_id]).get(user_id, ()))
+        return set(unpack_ids(packed))
+
+    @classmethod
+    def add(cls, user_id, music_ids):
+        """Add newly heard tracks to a user's set."""
+        with transaction.atomic():
+            heard_set, created = cls.objects.select_for_update().get_or_create(user_id=user_id)
+            if created:
+                # Start from the history, which includes these plays
+                cls.rebuild([user_id])
+                return
+            heard = heard_set.music_ids
+            merged = sorted(set(heard).union(music_ids))
+            if len(merged) != len(heard):
+                heard_set.packed_music_ids = pack_ids(merged)
+                heard_set.save(update_fields=['packed_music_ids'])
+
+    @classmethod
+    def rebuild(cls, user_ids=None):
+        """
+        Rebuild the sets of some users, or of everyone, from the history and
+        the archived plays. Returns the music ids of each user.
+        """
+        heard = defaultdict(set)
+        for model in (ListeningHistory, ArchivedListeningSummary):
+            rows = model.objects.order_by().values_list('user_id', 'music_id').distinct()
+            if user_ids is not None:
+                rows = rows.filter(user_id__in=user_ids)
+            for user_id, music_id in rows.iterator(chunk_size=5000):
+                heard[user_id].add(music_id)
+
+        with transaction.atomic():
+            if user_ids is None:
+                cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [
+                    cls(user_id=user_id, packed_music_ids=pack_ids(sorted(heard.get(user_id, ()))))
+                    for user_id in (heard if user_ids is None else user_ids)
+                ],
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['user'],
+                update_fields=['packed_music_ids']
+            )
+        return heard
+
+
+class PrecomputedRecommendations(models.Model):
+    """Top recommendations of a user computed by the precompute_recommendations command."""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='precomputed_recommendations'
+    )
+    # Music ids, best first, packed as little-endian 64-bit integers
+    packed_music_ids = models.BinaryField(default=b'')
+    # How many were asked for: fewer ids means there were no more to recommend
+    limit = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = 'Precomputed Recommendations'
+
+    def __str__(self):
+        return f"Recommendations for {self.user.username}"
+
+    @staticmethod
+    def pack(music_ids):
+        return pack_ids(music_ids)
+
+    @property
+    def music_ids(self):
+        return unpack_ids(self.packed_music_ids)
+
+
+class PlaylistQuerySet(models.QuerySet):
+    def with_summary(self):
+        """
+        Annotate each playlist with its track_count and the cover_image_name
+        of its first track, so that a listing does not query them per row.
+        """
+        first_cover = Music.objects.filter(playlists=OuterRef('pk')).values('cover_image')[:1]
+        return self.annotate(
+            track_count=Count('music', distinct=True),
+            cover_image_name=Subquery(first_cover)
+        )
+
 
 class Playlist(models.Model):
     name = models.CharField(max_length=100)
@@ -160,12 +824,25 @@ class Playlist(models.Model):
     total_duration = models.DurationField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PlaylistQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a user's playlists
+            models.Index(fields=['creator', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def cover_url(self):
+        """URL of the cover of the first track, for playlists loaded with with_summary()."""
+        if not self.cover_image_name:
+            return None
+        return Music._meta.get_field('cover_image').storage.url(self.cover_image_name)
+
     def save(self, *args, **kwargs):
         # Appeler la méthode parente
         super().save(*args, **kwargs)
@@ -184,20 +861,3 @@ class Playlist(models.Model):
         if self.total_duration != total:
             self.total_duration = total
             self.save(update_fields=['total_duration'])
-
-
-@receiver(post_save, sender=ListeningHistory)
-def update_statistics_on_history(sender, instance, created, **kwargs):
-    if created:
-        instance.music.get_statistics().update_statistics()
-
-
-@receiver(post_save, sender=UserMusicPreference)
-def update_statistics_on_preference(sender, instance, **kwargs):
-    instance.music.statistics.update_statistics()
-
-
-@receiver(post_save, sender=Music)
-def create_music_statistics(sender, instance, created, **kwargs):
-    if created:
-        MusicStatistics.objects.create(music=instance)
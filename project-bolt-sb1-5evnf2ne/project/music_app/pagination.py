@@ -0,0 +1,111 @@
+"""
+Keyset (cursor) pagination of listings.
+
+A listing is ordered by a few keys ending with the primary key, e.g.
+(release_date, id) from newest to oldest for the catalog. A page is the
+first rows after the keys of the last row of the previous page, so every
+page is read through the index like the first one, where OFFSET would read
+and skip all the previous rows. Rows inserted or deleted meanwhile do not
+shift the following pages either.
+
+The cursor handed to clients is the keys of the last row, JSON-encoded in
+URL-safe base64.
+"""
+import base64
+import json
+from datetime import date
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+
+# Listing orders, as (field, descending) pairs
+CATALOG_KEYS = [('release_date', True), ('id', True)]
+SEARCH_KEYS = [('search_rank', False), ('release_date', True), ('id', True)]
+PLAYLIST_KEYS = [('created_at', True), ('id', True)]
+USER_KEYS = [('date_joined', True), ('id', True)]
+
+MAX_PAGE_SIZE = 100
+
+
+def page_size(request):
+    """The page size asked for with ?limit=, within bounds, or PAGE_SIZE."""
+    default = getattr(settings, 'PAGE_SIZE', 24)
+    try:
+        return min(max(int(request.GET.get('limit', default)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return default
+
+
+class Page:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    data = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(queryset, keys, cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError
+        return [_field(queryset, name).to_python(value) for (name, _), value in zip(keys, values)]
+    except (ValueError, TypeError, ValidationError) as error:
+        raise Http404('Invalid cursor') from error
+
+
+def _field(queryset, name):
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    return queryset.model._meta.get_field(name)
+
+
+def _after(keys, values):
+    """Rows strictly after the key values, in the order of the keys."""
+    condition = Q()
+    for position, (name, descending) in enumerate(keys):
+        # Equal on the previous keys, after on this one
+        step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[position]})
+        for (previous, _), value in zip(keys[:position], values):
+            step &= Q(**{previous: value})
+        condition |= step
+    return condition
+
+
+def paginate(queryset, keys, cursor=None, size=24):
+    """The page of the queryset after the cursor, ordered by the keys."""
+    queryset = queryset.order_by(*[f'-{name}' if descending else name for name, descending in keys])
+    if cursor:
+        queryset = queryset.filter(_after(keys, _decode_cursor(queryset, keys, cursor)))
+
+    items = list(queryset[:size + 1])
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        next_cursor = encode_cursor([getattr(items[-1], name) for name, _ in keys])
+    return Page(items, next_cursor)
+
+
+def next_url(request, page, param='cursor'):
+    """The URL of the page after this one, with the same query parameters, or None."""
+    if not page.has_next:
+        return None
+    query = request.GET.copy()
+    query[param] = page.next_cursor
+    return f'{request.path}?{query.urlencode()}'
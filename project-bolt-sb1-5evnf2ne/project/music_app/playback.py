@@ -0,0 +1,107 @@
+"""
+Playback sessions reported by the players' heartbeats.
+
+While a track plays, the player pings the heartbeat endpoint. Each (user,
+track, session) has an OpenPlaybackSession row holding its last ping and
+the time listened so far, to which the time between two pings is added
+while the track is playing. When playback ends, or the session stops
+pinging for PLAYBACK_SESSION_TIMEOUT seconds, the row becomes a single play
+with its real listened duration.
+
+A ping reads its session and writes it back with one UPDATE conditioned on
+the last ping it read. Of two overlapping pings only one matches; the other
+reads the new state and counts the time since that ping, so the same
+interval is never counted twice. Stale sessions are finalized when their
+user opens a track page, and for every user by
+`manage.py finalize_playback_sessions`, which should run every few minutes.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Music, OpenPlaybackSession
+from .recommendations import update_user_preferences
+
+EVENTS = ('play', 'progress', 'pause', 'ended')
+
+# Conditional updates tried before a ping gives way to overlapping ones
+PING_ATTEMPTS = 3
+
+
+def _heartbeat_interval():
+    return getattr(settings, 'PLAYBACK_HEARTBEAT_INTERVAL', 15)
+
+
+def _session_timeout():
+    return getattr(settings, 'PLAYBACK_SESSION_TIMEOUT', 60)
+
+
+def heartbeat(user, music_id, session_id, event):
+    """Record a ping of a playback session. Returns the seconds listened so far."""
+    now = timezone.now()
+    playing = event in ('play', 'progress')
+    sessions = OpenPlaybackSession.objects.filter(user=user, music_id=music_id, session_id=session_id)
+
+    for _ in range(PING_ATTEMPTS):
+        session = sessions.first()
+        if session is None:
+            if not Music.objects.filter(pk=music_id).exists():
+                return 0.0
+            session, created = OpenPlaybackSession.objects.get_or_create(
+                user=user, music_id=music_id, session_id=session_id,
+                defaults={'last_ping': now, 'playing': playing}
+            )
+            if created:
+                break
+
+        listened = session.listened
+        if session.playing:
+            # A stalled tab does not get its idle time counted
+            elapsed = min(now - session.last_ping, timedelta(seconds=2 * _heartbeat_interval()))
+            listened += max(elapsed, timedelta(0))
+        last_ping = max(now, session.last_ping)
+        if sessions.filter(pk=session.pk, last_ping=session.last_ping).update(
+            last_ping=last_ping, playing=playing, listened=listened
+        ):
+            session.last_ping, session.playing, session.listened = last_ping, playing, listened
+            break
+    else:
+        # Overlapping pings of this session counted the time
+        return session.listened.total_seconds()
+
+    if event == 'ended':
+        _finalize(session, user)
+    return session.listened.total_seconds()
+
+
+def finalize_stale_sessions(user=None):
+    """
+    Turn the sessions that stopped pinging into plays, for one user or for
+    all of them. Returns the number of sessions finalized.
+    """
+    sessions = OpenPlaybackSession.objects.filter(
+        last_ping__lt=timezone.now() - timedelta(seconds=_session_timeout())
+    ).select_related('user', 'music').order_by('pk')
+    if user is not None:
+        sessions = sessions.filter(user=user)
+
+    finalized = 0
+    for session in sessions.iterator(chunk_size=500):
+        finalized += _finalize(session, user or session.user)
+    return finalized
+
+
+def _finalize(session, user):
+    # Only the request that removes the session as it was read records the
+    # play; a session pinged meanwhile is left open
+    deleted, _ = OpenPlaybackSession.objects.filter(pk=session.pk, last_ping=session.last_ping).delete()
+    if not deleted:
+        return 0
+
+    listened = session.listened.total_seconds()
+    if listened < getattr(settings, 'PLAYBACK_MIN_LISTEN_SECONDS', 5):
+        return 0
+
+    update_user_preferences(user, session.music, listened_duration=timedelta(seconds=round(listened)))
+    return 1
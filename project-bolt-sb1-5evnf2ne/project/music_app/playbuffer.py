@@ -0,0 +1,253 @@
+"""
+Write-behind buffer for play events.
+
+Plays are appended to a local spool file as fixed-size binary records, which
+costs no database write in the request. flush_play_buffer(), run by the
+flush_play_buffer command outside of any request, then writes a whole batch
+to ListeningHistory with bulk_create and applies the aggregated preference
+and statistics updates once per batch.
+"""
+import math
+import os
+import struct
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+
+from .models import Music, ListeningHistory, MusicStatistics, UserMusicPreference, UserHeardSet
+from . import listeners, recommendation_cache, rollups
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# user id, music id, POSIX timestamp, listened seconds (NaN when unknown)
+RECORD = struct.Struct('<qqdd')
+SPOOL_NAME = 'plays.spool'
+CLAIMED_SUFFIX = '.flushing'
+
+# A claimed batch that is still on disk after this delay was left behind by
+# a flush that failed or was killed
+STALE_CLAIM_AGE = 600
+
+
+def buffer_enabled():
+    return getattr(settings, 'PLAY_BUFFER_ENABLED', False)
+
+
+def _spool_dir():
+    return Path(getattr(settings, 'PLAY_BUFFER_DIR', Path(settings.BASE_DIR) / 'var' / 'play_buffer'))
+
+
+def _batch_size():
+    return getattr(settings, 'PLAY_BUFFER_BATCH_SIZE', 100)
+
+
+def _flush_interval():
+    return getattr(settings, 'PLAY_BUFFER_FLUSH_INTERVAL', 30)
+
+
+def record_play(user, music, listened_duration=None):
+    """Queue a play event; it is written to the database by the next flush."""
+    seconds = listened_duration.total_seconds() if listened_duration is not None else math.nan
+    _append(RECORD.pack(user.pk, music.pk, time.time(), seconds))
+
+
+def _append(data):
+    spool_dir = _spool_dir()
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    path = spool_dir / SPOOL_NAME
+
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                # The spool may have been claimed by a flusher between open()
+                # and flock(): write to the new spool file instead
+                try:
+                    if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                        continue
+                except FileNotFoundError:
+                    continue
+            os.write(fd, data)
+            return
+        finally:
+            os.close(fd)
+
+
+def pending_events():
+    try:
+        return os.stat(_spool_dir() / SPOOL_NAME).st_size // RECORD.size
+    except FileNotFoundError:
+        return 0
+
+
+def should_flush():
+    """Whether the buffer is full or its oldest play is older than the flush interval."""
+    pending = pending_events()
+    if not pending:
+        return False
+    if pending >= _batch_size():
+        return True
+
+    # Flush when the oldest buffered event is older than the flush interval
+    try:
+        with open(_spool_dir() / SPOOL_NAME, 'rb') as spool:
+            first = spool.read(RECORD.size)
+    except FileNotFoundError:
+        return False
+    if len(first) < RECORD.size:
+        return False
+    return time.time() - RECORD.unpack(first)[2] >= _flush_interval()
+
+
+def flush_play_buffer(include_stale=False):
+    """
+    Write the buffered plays to the database.
+
+    With include_stale, batches left claimed by a failed flush are retried
+    as well. Returns the number of plays written.
+    """
+    spool_dir = _spool_dir()
+    claimed = []
+
+    if include_stale and spool_dir.exists():
+        now = time.time()
+        for path in spool_dir.glob(f'{SPOOL_NAME}.*{CLAIMED_SUFFIX}'):
+            if now - path.stat().st_mtime >= STALE_CLAIM_AGE:
+                claimed.append(path)
+
+    # Claim the current spool: new plays go to a fresh file from now on
+    claim = spool_dir / f'{SPOOL_NAME}.{os.getpid()}.{time.time_ns()}{CLAIMED_SUFFIX}'
+    try:
+        os.replace(spool_dir / SPOOL_NAME, claim)
+        claimed.append(claim)
+    except FileNotFoundError:
+        pass
+
+    written = 0
+    for path in claimed:
+        records = _read_claimed(path)
+        if records:
+            _apply_batch(records)
+        path.unlink()
+        written += len(records)
+    return written
+
+
+def _read_claimed(path):
+    with open(path, 'rb') as spool:
+        if fcntl is not None:
+            # Wait for writers that opened the spool before it was claimed
+            fcntl.flock(spool.fileno(), fcntl.LOCK_EX)
+        data = spool.read()
+    # Ignore a trailing partial record
+    usable = len(data) - len(data) % RECORD.size
+    return list(RECORD.iter_unpack(data[:usable]))
+
+
+def _apply_batch(records):
+    # Skip plays of users and tracks deleted since they were buffered
+    live_users = set(get_user_model().objects.filter(
+        pk__in={record[0] for record in records}
+    ).values_list('pk', flat=True))
+    live_music = set(Music.objects.filter(
+        pk__in={record[1] for record in records}
+    ).values_list('pk', flat=True))
+    records = [record for record in records if record[0] in live_users and record[1] in live_music]
+    if not records:
+        return
+
+    histories = []
+    pair_plays = defaultdict(int)
+    pair_last_played = {}
+    for user_id, music_id, timestamp, seconds in records:
+        listened_at = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+        histories.append(ListeningHistory(
+            user_id=user_id,
+            music_id=music_id,
+            listened_at=listened_at,
+            listened_duration=None if math.isnan(seconds) else timedelta(seconds=seconds)
+        ))
+        pair = (user_id, music_id)
+        pair_plays[pair] += 1
+        pair_last_played[pair] = max(listened_at, pair_last_played.get(pair, listened_at))
+
+    user_ids = {user_id for user_id, _ in pair_plays}
+    music_ids = {music_id for _, music_id in pair_plays}
+
+    with transaction.atomic():
+        # Pairs that were already in the history do not add unique listeners
+        already_heard = ListeningHistory.heard_pairs(user_ids, music_ids)
+
+        ListeningHistory.objects.bulk_create(histories, batch_size=500)
+
+        _apply_preferences(pair_plays, pair_last_played, user_ids, music_ids)
+
+        # One statistics UPDATE per track in the batch
+        track_deltas = defaultdict(lambda: {'plays': 0, 'duration': timedelta(), 'listened_at': None, 'new_listeners': 0})
+        for history in histories:
+            delta = track_deltas[history.music_id]
+            delta['plays'] += 1
+            if history.listened_duration:
+                delta['duration'] += history.listened_duration
+            if delta['listened_at'] is None or history.listened_at > delta['listened_at']:
+                delta['listened_at'] = history.listened_at
+        newly_heard = defaultdict(list)
+        for user_id, music_id in pair_plays:
+            if (user_id, music_id) not in already_heard:
+                track_deltas[music_id]['new_listeners'] += 1
+                newly_heard[user_id].append(music_id)
+        for user_id, music_ids in newly_heard.items():
+            UserHeardSet.add(user_id, music_ids)
+
+        for music_id, delta in track_deltas.items():
+            MusicStatistics.apply_play_delta(music_id, **delta)
+
+        rollups.record_plays(
+            (history.music_id, history.listened_at, history.listened_duration) for history in histories
+        )
+        listeners.record_listeners(
+            (history.music_id, history.user_id, history.listened_at) for history in histories
+        )
+
+        recommendation_cache.invalidate(*user_ids)
+
+
+def _preferences(pair_plays, user_ids, music_ids):
+    return [
+        preference
+        for preference in UserMusicPreference.objects.filter(user_id__in=user_ids, music_id__in=music_ids)
+        if (preference.user_id, preference.music_id) in pair_plays
+    ]
+
+
+def _apply_preferences(pair_plays, pair_last_played, user_ids, music_ids):
+    preferences = _preferences(pair_plays, user_ids, music_ids)
+
+    # Missing preferences are created empty, then every count is added with
+    # F() like the existing ones: a preference created meanwhile, e.g. by a
+    # rating, conflicts and keeps its own count plus the batch's
+    existing = {(preference.user_id, preference.music_id) for preference in preferences}
+    missing = [pair for pair in pair_plays if pair not in existing]
+    if missing:
+        UserMusicPreference.objects.bulk_create(
+            [UserMusicPreference(user_id=user_id, music_id=music_id, listen_count=0) for user_id, music_id in missing],
+            batch_size=500,
+            ignore_conflicts=True
+        )
+        preferences = _preferences(pair_plays, user_ids, music_ids)
+
+    for preference in preferences:
+        pair = (preference.user_id, preference.music_id)
+        preference.listen_count = F('listen_count') + pair_plays[pair]
+        preference.last_listened = pair_last_played[pair]
+    UserMusicPreference.objects.bulk_update(preferences, ['listen_count', 'last_listened'], batch_size=500)
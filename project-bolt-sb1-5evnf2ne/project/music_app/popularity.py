@@ -0,0 +1,137 @@
+"""
+Most popular tracks overall and per genre, held in process memory.
+
+Popularity is the play count of the last POPULARITY_WINDOW_DAYS days, read
+from the daily and hourly rollups, where each play counts half as much every
+POPULARITY_HALF_LIFE_DAYS days. The top POPULARITY_TOP_N tracks of every
+genre and of the whole catalog are computed at once and kept in each worker
+process; reading a list is then a dict lookup and a slice. Lists are padded
+with the newest tracks, so a genre nobody listens to yet still has some.
+
+Lists older than POPULARITY_REFRESH_SECONDS are still served while one
+thread recomputes them.
+"""
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .models import Music, TrackPlayRollup
+
+
+def _half_life_days():
+    return getattr(settings, 'POPULARITY_HALF_LIFE_DAYS', 7)
+
+
+def _window_days():
+    return getattr(settings, 'POPULARITY_WINDOW_DAYS', 90)
+
+
+def _top_n():
+    return getattr(settings, 'POPULARITY_TOP_N', 50)
+
+
+def _refresh_seconds():
+    return getattr(settings, 'POPULARITY_REFRESH_SECONDS', 300)
+
+
+def compute_lists():
+    """Top music ids overall (key None) and per genre, best first."""
+    now = timezone.now()
+    decay = math.log(2) / _half_life_days()
+    scores = defaultdict(float)
+    genres = {}
+    days = TrackPlayRollup.objects.filter(
+        bucket_start__gte=now - timedelta(days=_window_days())
+    ).annotate(day=TruncDay('bucket_start')).values_list('music_id', 'music__genre', 'day').annotate(
+        total=Sum('plays')
+    ).order_by()
+    for music_id, genre, day, plays in days.iterator(chunk_size=5000):
+        age = max((now - day).total_seconds() / 86400, 0)
+        scores[music_id] += plays * math.exp(-decay * age)
+        genres[music_id] = genre
+
+    top_n = _top_n()
+    ranked = sorted(scores, key=lambda music_id: (-scores[music_id], -music_id))
+    lists = {None: ranked[:top_n]}
+    for music_id in ranked:
+        genre_list = lists.setdefault(genres[music_id], [])
+        if len(genre_list) < top_n:
+            genre_list.append(music_id)
+
+    # Newest tracks after the played ones
+    for genre in [None] + [code for code, _ in Music.GENRE_CHOICES]:
+        genre_list = lists.setdefault(genre, [])
+        if len(genre_list) >= top_n:
+            continue
+        newest = Music.objects.exclude(id__in=genre_list)
+        if genre is not None:
+            newest = newest.filter(genre=genre)
+        genre_list.extend(newest.order_by('-release_date', '-id').values_list('id', flat=True)[:top_n - len(genre_list)])
+    return lists
+
+
+_state = {'lists': None, 'computed_at': 0.0, 'refreshing': False}
+_lock = threading.Lock()
+
+
+def _refresh():
+    lists = compute_lists()
+    with _lock:
+        _state.update(lists=lists, computed_at=time.monotonic(), refreshing=False)
+
+
+def _refresh_in_background():
+    def refresh():
+        try:
+            _refresh()
+        finally:
+            with _lock:
+                _state['refreshing'] = False
+            # The thread has its own database connection
+            connection.close()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def get_lists():
+    """The lists of this process, computed on first use."""
+    with _lock:
+        lists = _state['lists']
+        stale = time.monotonic() - _state['computed_at'] > _refresh_seconds()
+        start_refresh = lists is not None and stale and not _state['refreshing']
+        if start_refresh:
+            _state['refreshing'] = True
+    if lists is None:
+        _refresh()
+    elif start_refresh:
+        _refresh_in_background()
+    return _state['lists']
+
+
+def reset():
+    """Forget the lists, so the next read computes them again."""
+    with _lock:
+        _state.update(lists=None, computed_at=0.0, refreshing=False)
+
+
+def popular_ids(genre=None, limit=10, exclude=()):
+    """Most popular music ids overall or in a genre, best first."""
+    lists = get_lists()
+    if not exclude:
+        return lists.get(genre, [])[:limit]
+    return [music_id for music_id in lists.get(genre, []) if music_id not in exclude][:limit]
+
+
+def popular_music(genre=None, limit=10, exclude=()):
+    """Most popular tracks overall or in a genre, loaded in one query."""
+    music_ids = popular_ids(genre, limit, exclude)
+    musics = Music.objects.select_related('artist').in_bulk(music_ids)
+    return [musics[music_id] for music_id in music_ids if music_id in musics]
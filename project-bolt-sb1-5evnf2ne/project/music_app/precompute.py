@@ -0,0 +1,85 @@
+"""
+Batch precomputation of every user's top recommendations.
+
+Users are split into batches computed by worker processes, each with its own
+database connection and its own mapping of the model files. The parent
+process writes the results as one PrecomputedRecommendations row per user.
+
+A user whose recommendations are invalidated while the batch is computed
+must not get the results computed before their activity: each result
+carries the user's recommendation cache version read before computing, and
+rows whose version changed meanwhile are dropped right after being written.
+Dropping after writing also covers an invalidation committed in between.
+"""
+from django.contrib.auth import get_user_model
+from django.db import connections
+
+from .models import ListeningHistory, UserMusicPreference, PrecomputedRecommendations
+from .recommendations import get_recommendations
+from . import recommendation_cache
+
+DEFAULT_LIMIT = 20
+
+
+def users_to_refresh(since=None):
+    """
+    Ids of the users to recompute: everyone, or since a date only those who
+    listened or rated since then and those without precomputed rows (new
+    users and users whose rows were dropped by their activity).
+    """
+    users = get_user_model().objects.order_by('pk')
+    if since is None:
+        return list(users.values_list('pk', flat=True))
+
+    active = set(ListeningHistory.objects.filter(listened_at__gte=since).values_list('user_id', flat=True).distinct())
+    active |= set(UserMusicPreference.objects.filter(last_listened__gte=since).values_list('user_id', flat=True).distinct())
+    missing = users.filter(precomputed_recommendations__isnull=True).values_list('pk', flat=True)
+    return sorted(active | set(missing))
+
+
+def last_run():
+    """When the previous run started, or None."""
+    latest = PrecomputedRecommendations.objects.order_by('-computed_at').first()
+    return latest.computed_at if latest else None
+
+
+def init_worker():
+    # Connections inherited from the parent process must not be shared
+    for connection in connections.all():
+        connection.close()
+
+
+def compute_batch(user_ids, limit):
+    """
+    Recommended music ids of each user with their cache version, as
+    (user_id, version, music_ids), run in a worker process.
+    """
+    versions = recommendation_cache.versions(user_ids)
+    users = get_user_model().objects.filter(pk__in=user_ids)
+    return [
+        (user.pk, versions[user.pk], [music.id for music in get_recommendations(user, limit=limit)])
+        for user in users
+    ]
+
+
+def store_batch(results, limit, computed_at):
+    """Write the results of a batch. Returns the number of users stored."""
+    PrecomputedRecommendations.objects.bulk_create(
+        [
+            PrecomputedRecommendations(
+                user_id=user_id,
+                packed_music_ids=PrecomputedRecommendations.pack(music_ids),
+                limit=limit,
+                computed_at=computed_at
+            )
+            for user_id, _, music_ids in results
+        ],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['packed_music_ids', 'limit', 'computed_at']
+    )
+
+    versions = recommendation_cache.versions([user_id for user_id, _, _ in results])
+    invalidated = [user_id for user_id, version, _ in results if versions[user_id] != version]
+    PrecomputedRecommendations.objects.filter(user_id__in=invalidated).delete()
+    return len(results) - len(invalidated)
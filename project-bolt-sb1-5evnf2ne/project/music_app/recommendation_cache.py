@@ -0,0 +1,104 @@
+"""
+Cache of the recommendations computed for each user.
+
+Entries are keyed by user and limit and hold the recommended track ids.
+They are fresh for RECOMMENDATION_CACHE_TTL seconds, then served stale for
+up to RECOMMENDATION_CACHE_STALE_TTL more seconds while one request
+recomputes them in the background. Every entry of a user is dropped at once
+by bumping the user's version, along with their precomputed recommendations,
+when they rate, favorite, listen or edit a playlist. The backend is the
+RECOMMENDATION_CACHE alias of CACHES, which must be shared by every worker
+process for a bump to reach them all.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from .models import PrecomputedRecommendations
+
+
+def _cache():
+    return caches[getattr(settings, 'RECOMMENDATION_CACHE', 'default')]
+
+
+def _fresh_ttl():
+    return getattr(settings, 'RECOMMENDATION_CACHE_TTL', 300)
+
+
+def _stale_ttl():
+    return getattr(settings, 'RECOMMENDATION_CACHE_STALE_TTL', 3600)
+
+
+def _version_key(user_id):
+    return f'recommendations-version:{user_id}'
+
+
+def _version(user_id):
+    cache = _cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # A version that was evicted never comes back with the same value
+        version = time.time_ns()
+        if not cache.add(_version_key(user_id), version, None):
+            version = cache.get(_version_key(user_id), version)
+    return version
+
+
+def versions(user_ids):
+    """The current version of each user, None for users without one yet."""
+    stored = _cache().get_many([_version_key(user_id) for user_id in user_ids])
+    return {user_id: stored.get(_version_key(user_id)) for user_id in user_ids}
+
+
+def lookup(user_id, limit):
+    """
+    The cache key of the user's recommendations and the cached entry, or
+    None. An entry is a dict with the music ids and whether they are stale.
+    """
+    key = f'recommendations:{user_id}:{_version(user_id)}:{limit}'
+    entry = _cache().get(key)
+    if entry is not None:
+        entry = dict(entry, stale=time.time() - entry['computed_at'] > _fresh_ttl())
+    return key, entry
+
+
+def store(key, music_ids):
+    _cache().set(
+        key,
+        {'music_ids': list(music_ids), 'computed_at': time.time()},
+        _fresh_ttl() + _stale_ttl()
+    )
+
+
+def revalidate(key, compute):
+    """Recompute a stale entry in a background thread, once across workers."""
+    if not _cache().add(f'{key}:refreshing', True, _fresh_ttl()):
+        return
+
+    def refresh():
+        try:
+            store(key, compute())
+        finally:
+            _cache().delete(f'{key}:refreshing')
+            # The thread has its own database connection
+            connection.close()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def invalidate(*user_ids):
+    """
+    Drop every cached recommendation of the users once the transaction
+    commits, and their precomputed ones: they are computed on demand until
+    the next precompute_recommendations run. Nothing is dropped if the
+    transaction rolls back.
+    """
+    def bump():
+        PrecomputedRecommendations.objects.filter(user_id__in=user_ids).delete()
+        version = time.time_ns()
+        _cache().set_many({_version_key(user_id): version for user_id in user_ids}, None)
+
+    transaction.on_commit(bump)
@@ -1,92 +1,279 @@
+import logging
+import time
+from collections import defaultdict
+
+from django.conf import settings
 from django.db.models import Q, Count
-from .models import Music, UserMusicPreference, ListeningHistory, Playlist
+from .models import Music, UserMusicPreference, ListeningHistory, Playlist, PrecomputedRecommendations, UserHeardSet
+from . import audio_features, factorization, playbuffer, popularity, recommendation_cache, similarity
+
+logger = logging.getLogger(__name__)
+
+
+# Blend weights of the strategies; a strategy with weight 0 is not run
+DEFAULT_WEIGHTS = {
+    'genre': 1.0,
+    'artist': 1.0,
+    'collaborative': 1.5,
+    'factors': 1.5,
+    'playlist': 0.5,
+    'content': 0.5,
+}
+
+# Candidates each strategy proposes, as a multiple of the requested limit
+CANDIDATES_PER_RESULT = 3
+
+
+def _weights():
+    return getattr(settings, 'RECOMMENDATION_WEIGHTS', DEFAULT_WEIGHTS)
+
+
+class RecommendationContext:
+    """What the strategies know about the user, loaded once per request."""
+
+    def __init__(self, user, limit):
+        self.user = user
+        self.candidates = limit * CANDIDATES_PER_RESULT
+        # Listened tracks are never recommended; they are filtered out here
+        # rather than with an anti-join in every candidate query
+        self.heard = UserHeardSet.for_user(user.pk)
+        # Rated and favorite tracks, with their genre and artist
+        self.liked = list(UserMusicPreference.objects.filter(
+            Q(rating__isnull=False) | Q(favorite=True),
+            user=user
+        ).values_list('music_id', 'music__genre', 'music__artist_id', 'rating', 'favorite'))
+
+    def preferred(self, position, limit=3):
+        """Best rated genres (position 1) or artists (position 2) with their rating out of 1."""
+        ratings = defaultdict(list)
+        for row in self.liked:
+            if row[3] is not None:
+                ratings[row[position]].append(row[3])
+        averages = {value: sum(values) / len(values) / 5 for value, values in ratings.items()}
+        return dict(sorted(averages.items(), key=lambda item: -item[1])[:limit])
+
+    def unheard(self, rows):
+        """The first candidate rows, whose first value is a music id, the user has not heard."""
+        candidates = []
+        for row in rows.iterator(chunk_size=self.candidates * 2):
+            if row[0] not in self.heard:
+                candidates.append(row)
+                if len(candidates) == self.candidates:
+                    break
+        return candidates
+
+
+def genre_candidates(context):
+    genres = context.preferred(1)
+    rows = Music.objects.filter(genre__in=genres).values_list('id', 'genre')
+    return [(music_id, genres[genre]) for music_id, genre in context.unheard(rows)]
 
 
-def get_recommendations(user, limit=10):
+def artist_candidates(context):
+    artists = context.preferred(2)
+    rows = Music.objects.filter(artist__in=artists).values_list('id', 'artist_id')
+    return [(music_id, artists[artist_id]) for music_id, artist_id in context.unheard(rows)]
+
+
+def collaborative_candidates(context):
     """
-    Get personalized music recommendations for a user based on:
-    1. Their preferred genres
-    2. Their preferred artists
-    3. Similar users' preferences
-    4. Popular songs in their playlists' genres
+    Tracks close to the ones the user liked in the item-item similarity
+    model, or liked by users with the same taste while no model is built.
     """
-    recommendations = []
-    
-    # Get user's listening history to exclude already listened songs
-    listened_music_ids = ListeningHistory.objects.filter(user=user).values_list('music_id', flat=True)
-    
-    # 1. Get recommendations based on preferred genres
-    preferred_genres = UserMusicPreference.get_user_preferred_genres(user)
-    genre_recommendations = Music.objects.filter(
-        genre__in=[g['music__genre'] for g in preferred_genres]
-    ).exclude(
-        id__in=listened_music_ids
-    )[:limit]
-    recommendations.extend(list(genre_recommendations))
-
-    # 2. Get recommendations based on preferred artists
-    preferred_artists = UserMusicPreference.get_user_preferred_artists(user)
-    artist_recommendations = Music.objects.filter(
-        artist__in=[a['music__artist'] for a in preferred_artists]
-    ).exclude(
-        id__in=listened_music_ids
-    ).exclude(
-        id__in=[m.id for m in recommendations]
-    )[:limit]
-    recommendations.extend(list(artist_recommendations))
-
-    # 3. Get recommendations based on similar users
-    similar_users = UserMusicPreference.objects.filter(
-        music__in=UserMusicPreference.objects.filter(
-            user=user, rating__isnull=False
-        ).values_list('music', flat=True)
-    ).exclude(
-        user=user
-    ).values_list('user', flat=True).distinct()
-
-    similar_users_recommendations = Music.objects.filter(
-        usermusicpreference__user__in=similar_users,
-        usermusicpreference__rating__gte=4
-    ).exclude(
-        id__in=listened_music_ids
-    ).exclude(
-        id__in=[m.id for m in recommendations]
-    ).annotate(
-        recommendation_count=Count('id')
-    ).order_by('-recommendation_count')[:limit]
-    recommendations.extend(list(similar_users_recommendations))
+    model = similarity.get_model()
+    if model is None:
+        similar_users = UserMusicPreference.objects.filter(
+            music__in=[row[0] for row in context.liked if row[3] is not None]
+        ).exclude(
+            user=context.user
+        ).values_list('user', flat=True).distinct()
+
+        ranked = context.unheard(Music.objects.filter(
+            usermusicpreference__user__in=similar_users,
+            usermusicpreference__rating__gte=4
+        ).annotate(
+            recommendation_count=Count('id')
+        ).order_by('-recommendation_count').values_list('id', 'recommendation_count'))
+    else:
+        seeds = {}
+        for music_id, _, _, rating, favorite in context.liked:
+            weight = max(
+                similarity.FAVORITE_WEIGHT if favorite else 0,
+                similarity.rating_weight(rating) if rating is not None else 0
+            )
+            if weight:
+                seeds[music_id] = weight
+        ranked = model.similar_to(seeds, exclude=context.heard, limit=context.candidates)
+
+    if not ranked:
+        return []
+    best = ranked[0][1]
+    return [(music_id, score / best) for music_id, score in ranked]
+
+
+def factor_candidates(context):
+    """Best scored tracks in the trained matrix factorization model."""
+    model = factorization.get_model()
+    if model is None:
+        return []
+    ranked = [
+        (music_id, score)
+        for music_id, score in model.recommend(context.user.pk, exclude=context.heard, limit=context.candidates)
+        if score > 0
+    ]
+    if not ranked:
+        return []
+    best = ranked[0][1]
+    return [(music_id, score / best) for music_id, score in ranked]
+
 
-    # 4. Get popular songs from user's playlists' genres
+def playlist_candidates(context):
+    """Tracks most often added to playlists, in the genres of the user's playlists."""
     playlist_genres = Music.objects.filter(
-        playlists__creator=user
+        playlists__creator=context.user
     ).values_list('genre', flat=True).distinct()
 
-    playlist_recommendations = Music.objects.filter(
+    ranked = context.unheard(Music.objects.filter(
         genre__in=playlist_genres
-    ).exclude(
-        id__in=listened_music_ids
-    ).exclude(
-        id__in=[m.id for m in recommendations]
     ).annotate(
         playlist_count=Count('playlists')
-    ).order_by('-playlist_count')[:limit]
-    recommendations.extend(list(playlist_recommendations))
+    ).order_by('-playlist_count').values_list('id', 'playlist_count'))
 
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_recommendations = []
-    for item in recommendations:
-        if item.id not in seen:
-            seen.add(item.id)
-            unique_recommendations.append(item)
+    if not ranked:
+        return []
+    best = ranked[0][1] + 1
+    return [(music_id, (count + 1) / best) for music_id, count in ranked]
 
-    return unique_recommendations[:limit]
+
+def content_candidates(context):
+    """
+    Tracks that sound like the ones the user liked, from the audio features
+    extracted at upload, so tracks without any listens can be recommended.
+    """
+    store = audio_features.get_store()
+    if store is None or not context.liked:
+        return []
+    seeds = {
+        music_id: (1 if favorite else 0) + (rating / 5 if rating is not None else 0)
+        for music_id, _, _, rating, favorite in context.liked
+    }
+    ranked = [
+        (music_id, score)
+        for music_id, score in store.similar_to(seeds, exclude=context.heard, limit=context.candidates)
+        if score > 0
+    ]
+    if not ranked:
+        return []
+    best = ranked[0][1]
+    return [(music_id, score / best) for music_id, score in ranked]
+
+
+STRATEGIES = {
+    'genre': genre_candidates,
+    'artist': artist_candidates,
+    'collaborative': collaborative_candidates,
+    'factors': factor_candidates,
+    'playlist': playlist_candidates,
+    'content': content_candidates,
+}
+
+
+def get_recommendations(user, limit=10, timings=None, fill=True):
+    """
+    Get personalized music recommendations for a user based on:
+    1. Their preferred genres
+    2. Their preferred artists
+    3. Similar users' preferences
+    4. Their taste in the trained matrix factorization model
+    5. Popular songs in their playlists' genres
+    6. Tracks that sound like the ones they liked
+
+    Each strategy scores its candidates between 0 and 1 and the scores are
+    blended with RECOMMENDATION_WEIGHTS, so a track proposed by several
+    strategies ranks higher. When they propose fewer tracks than the limit,
+    the popular tracks of the user's genres fill the rest, unless fill is
+    False (to evaluate the strategies on their own). Only the final tracks
+    are loaded. If a timings dict is given, it receives the seconds spent in
+    each step.
+    """
+    if timings is None:
+        timings = {}
+    started = time.perf_counter()
+    context = RecommendationContext(user, limit)
+    timings['context'] = time.perf_counter() - started
+
+    scores = defaultdict(float)
+    for name, weight in _weights().items():
+        if not weight:
+            continue
+        started = time.perf_counter()
+        for music_id, score in STRATEGIES[name](context):
+            scores[music_id] += weight * score
+        timings[name] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Ties go to the most recently added tracks, i.e. the highest ids
+    ranked = sorted(scores, key=lambda music_id: (-scores[music_id], -music_id))[:limit]
+    timings['blend'] = time.perf_counter() - started
+
+    if fill and len(ranked) < limit:
+        # Too little personal signal: popular tracks of the preferred genres, then overall
+        started = time.perf_counter()
+        for genre in list(context.preferred(1)) + [None]:
+            ranked += popularity.popular_ids(genre, limit - len(ranked), exclude=context.heard | set(ranked))
+            if len(ranked) == limit:
+                break
+        timings['popular'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    musics = Music.objects.select_related('artist').in_bulk(ranked)
+    recommendations = [musics[music_id] for music_id in ranked if music_id in musics]
+    timings['hydrate'] = time.perf_counter() - started
+
+    logger.debug(
+        'Recommendations for user %s: %s',
+        user.pk,
+        ', '.join(f'{step} {seconds * 1000:.1f}ms' for step, seconds in timings.items())
+    )
+    return recommendations
+
+
+def cached_recommendations(user, limit=10):
+    """
+    get_recommendations() through the per-user cache. Cached results are
+    read back with a single query; stale ones are served while they are
+    recomputed in the background. On a miss, the recommendations
+    precomputed for the user are used if they were computed for at least
+    that many.
+    """
+    key, entry = recommendation_cache.lookup(user.pk, limit)
+    if entry is None:
+        precomputed = PrecomputedRecommendations.objects.filter(user=user).first()
+        if precomputed is not None and precomputed.limit >= limit:
+            entry = {'music_ids': precomputed.music_ids[:limit], 'stale': False}
+            recommendation_cache.store(key, entry['music_ids'])
+        else:
+            recommendations = get_recommendations(user, limit=limit)
+            recommendation_cache.store(key, [music.id for music in recommendations])
+            return recommendations
+
+    if entry['stale']:
+        recommendation_cache.revalidate(
+            key, lambda: [music.id for music in get_recommendations(user, limit=limit)]
+        )
+    musics = Music.objects.select_related('artist').in_bulk(entry['music_ids'])
+    return [musics[music_id] for music_id in entry['music_ids'] if music_id in musics]
 
 
 def update_user_preferences(user, music, rating=None, listened_duration=None):
     """
     Update user preferences and listening history when a user interacts with a song
     """
+    if rating is None and playbuffer.buffer_enabled():
+        # Plain plays are buffered and written in batches
+        playbuffer.record_play(user, music, listened_duration)
+        return
+
     # Update or create user preference
     preference, created = UserMusicPreference.objects.get_or_create(
         user=user,
@@ -108,3 +295,5 @@ def update_user_preferences(user, music, rating=None, listened_duration=None):
         music=music,
         listened_duration=listened_duration
     )
+
+    recommendation_cache.invalidate(user.pk)
@@ -0,0 +1,188 @@
+"""
+Hourly and daily play rollups per track, artist and genre.
+
+Plays are added to hourly buckets as they arrive. The compact_play_rollups
+command folds the hourly buckets of past days into daily ones, so a time
+window is read from at most one row per hour of the last days and one row
+per day before that, whatever the number of plays.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate, TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import Music, ListeningHistory, PlayRollup, TrackPlayRollup, ArtistPlayRollup, GenrePlayRollup
+
+# Rollup model, its key field, the matching Music field and history lookup
+DIMENSIONS = [
+    (TrackPlayRollup, 'music_id', 'id', 'music'),
+    (ArtistPlayRollup, 'artist_id', 'artist_id', 'music__artist'),
+    (GenrePlayRollup, 'genre', 'genre', 'music__genre'),
+]
+
+# Hourly buckets are kept for the days that ended less than this ago
+DEFAULT_KEEP_HOURS = 48
+
+
+def hour_start(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def record_plays(plays):
+    """
+    Add plays to the hourly rollups.
+
+    plays is an iterable of (music_id, listened_at, listened_duration).
+    """
+    plays = list(plays)
+    if not plays:
+        return
+
+    tracks = {
+        track['id']: track
+        for track in Music.objects.filter(id__in={play[0] for play in plays}).values('id', 'artist_id', 'genre')
+    }
+
+    buckets = defaultdict(lambda: [0, timedelta()])
+    for music_id, listened_at, listened_duration in plays:
+        track = tracks.get(music_id)
+        if track is None:
+            continue
+        start = hour_start(listened_at)
+        for model, key_field, music_field, _ in DIMENSIONS:
+            bucket = buckets[(model, key_field, track[music_field], start)]
+            bucket[0] += 1
+            if listened_duration:
+                bucket[1] += listened_duration
+
+    for (model, key_field, key, start), (count, duration) in buckets.items():
+        _add_to_bucket(model, {key_field: key, 'period': PlayRollup.HOUR, 'bucket_start': start}, count, duration)
+
+
+def _add_to_bucket(model, lookup, plays, duration):
+    changes = {'plays': F('plays') + plays}
+    if duration:
+        changes['duration_played'] = F('duration_played') + duration
+
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(plays=plays, duration_played=duration or timedelta(), **lookup)
+    except IntegrityError:
+        # The bucket was created concurrently
+        model.objects.filter(**lookup).update(**changes)
+
+
+def compact_rollups(keep_hours=DEFAULT_KEEP_HOURS):
+    """
+    Fold the hourly buckets of days that ended more than keep_hours ago into
+    daily buckets. Returns the number of hourly buckets folded.
+    """
+    cutoff = day_start(timezone.now() - timedelta(hours=keep_hours))
+    folded = 0
+
+    for model, key_field, _, _ in DIMENSIONS:
+        with transaction.atomic():
+            hourly = model.objects.filter(period=PlayRollup.HOUR, bucket_start__lt=cutoff)
+            days = hourly.annotate(day=TruncDay('bucket_start')).values(key_field, 'day').annotate(
+                day_plays=Sum('plays'),
+                day_duration=Sum('duration_played')
+            ).order_by()
+            for row in days:
+                _add_to_bucket(
+                    model,
+                    {key_field: row[key_field], 'period': PlayRollup.DAY, 'bucket_start': row['day']},
+                    row['day_plays'],
+                    row['day_duration']
+                )
+            folded += hourly.delete()[0]
+
+    return folded
+
+
+def backfill_rollups(keep_hours=DEFAULT_KEEP_HOURS):
+    """
+    Rebuild the rollups from the listening history: daily buckets up to the
+    compaction cutoff and hourly buckets after it. Days older than the
+    oldest history row only hold archived plays and are kept as they are.
+    Returns the number of buckets created.
+    """
+    cutoff = day_start(timezone.now() - timedelta(hours=keep_hours))
+    oldest = ListeningHistory.objects.order_by('listened_at').values_list('listened_at', flat=True).first()
+    if oldest is None:
+        return 0
+    created = 0
+
+    with transaction.atomic():
+        for model, key_field, _, history_field in DIMENSIONS:
+            model.objects.filter(bucket_start__gte=day_start(oldest)).delete()
+            for period, trunc, window in (
+                (PlayRollup.DAY, TruncDay, Q(listened_at__lt=cutoff)),
+                (PlayRollup.HOUR, TruncHour, Q(listened_at__gte=cutoff)),
+            ):
+                rows = ListeningHistory.objects.filter(window).annotate(
+                    bucket=trunc('listened_at')
+                ).values(history_field, 'bucket').annotate(
+                    bucket_plays=Count('id'),
+                    bucket_duration=Sum('listened_duration')
+                ).order_by()
+                buckets = model.objects.bulk_create(
+                    [
+                        model(
+                            period=period,
+                            bucket_start=row['bucket'],
+                            plays=row['bucket_plays'],
+                            duration_played=row['bucket_duration'] or timedelta(),
+                            **{key_field: row[history_field]}
+                        )
+                        for row in rows.iterator()
+                    ],
+                    batch_size=1000
+                )
+                created += len(buckets)
+
+    return created
+
+
+def daily_plays(model=TrackPlayRollup, days=30, **filters):
+    """Plays per day over the last days, oldest first, as (date, plays) pairs."""
+    today = timezone.localdate()
+    first_day = today - timedelta(days=days - 1)
+
+    rows = model.objects.filter(
+        bucket_start__gte=day_start(timezone.now()) - timedelta(days=days - 1),
+        **filters
+    ).annotate(day=TruncDate('bucket_start')).values('day').annotate(total=Sum('plays')).order_by('day')
+    totals = {row['day']: row['total'] for row in rows}
+
+    window = [first_day + timedelta(days=offset) for offset in range(days)]
+    return [(day, totals.get(day, 0)) for day in window]
+
+
+def plays_since(since, model=TrackPlayRollup, **filters):
+    """
+    Total plays in the buckets starting at or after the hour of since, so
+    the window has hourly resolution for recent plays and daily resolution
+    once they are compacted.
+    """
+    return model.objects.filter(
+        bucket_start__gte=hour_start(since),
+        **filters
+    ).aggregate(total=Sum('plays'))['total'] or 0
+
+
+def top_tracks(since, limit=10):
+    """Ids and play counts of the most played tracks since a moment."""
+    return list(
+        TrackPlayRollup.objects.filter(bucket_start__gte=hour_start(since)).values('music_id').annotate(
+            total=Sum('plays')
+        ).order_by('-total')[:limit]
+    )
@@ -0,0 +1,113 @@
+"""
+Full-text search of the catalog.
+
+On SQLite, the music_app_music_fts FTS5 table indexes the title, artist name
+and genre of every track. Triggers created by the migration keep it in sync
+with every insert, update and delete, including bulk ones and artist
+renames. A search matches every word of the query as a prefix and ranks the
+tracks with bm25, a title match weighing more than an artist match, which
+weighs more than a genre match. Only the SEARCH_MAX_RESULTS best tracks are
+returned, so a search costs an index lookup whatever the catalog size. A
+genre filter is applied in the index query, before that limit, so the best
+tracks of the genre are returned rather than those of the global top.
+
+Other databases, or a database where the table is missing, fall back to
+LIKE queries on the title and artist name.
+"""
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+FTS_TABLE = 'music_app_music_fts'
+
+# bm25 weights of the title, artist and genre columns
+COLUMN_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def _max_results():
+    return getattr(settings, 'SEARCH_MAX_RESULTS', 500)
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(text):
+    """FTS5 query matching every word of the text as a prefix, or None without words."""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def search_ids(text, limit=None, genre=None):
+    """Ids of the tracks matching the text, in the genre if given, best first."""
+    expression = match_expression(text)
+    if expression is None:
+        return []
+    genre_condition = ' AND genre = %s' if genre else ''
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s{genre_condition} '
+            f'ORDER BY bm25({FTS_TABLE}, %s, %s, %s) LIMIT %s',
+            [expression, *([genre] if genre else []), *COLUMN_WEIGHTS, limit or _max_results()]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def genre_counts(text):
+    """Number of tracks matching the text in each genre, grouped in the index."""
+    expression = match_expression(text)
+    if expression is None:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT genre, count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s GROUP BY genre',
+            [expression]
+        )
+        return dict(cursor.fetchall())
+
+
+def search(queryset, text, genre=None):
+    """
+    The tracks of the queryset matching the text, in the genre if given,
+    best first. Their search_rank, 0 for the best, can be used to paginate
+    them.
+    """
+    if genre:
+        queryset = queryset.filter(genre=genre)
+    if fts_enabled():
+        try:
+            music_ids = search_ids(text, genre=genre)
+        except DatabaseError:
+            # The index was not created: search without it
+            pass
+        else:
+            if not music_ids:
+                return queryset.annotate(search_rank=Value(0, output_field=IntegerField())).none()
+            return queryset.filter(id__in=music_ids).annotate(search_rank=Case(
+                *[When(id=music_id, then=Value(position)) for position, music_id in enumerate(music_ids)],
+                output_field=IntegerField()
+            )).order_by('search_rank')
+
+    return queryset.filter(
+        Q(title__icontains=text) |
+        Q(artist__full_name__icontains=text)
+    ).annotate(search_rank=Value(0, output_field=IntegerField())).order_by('-release_date', '-id')
+
+
+def rebuild_index():
+    """Reindex every track. Returns the number of tracks indexed."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, artist, genre) '
+            'SELECT music.id, music.title, artist.full_name, music.genre '
+            'FROM music_app_music music JOIN users_artist artist ON artist.id = music.artist_id'
+        )
+        indexed = cursor.rowcount
+        # Merge the index segments, for faster queries
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return indexed
@@ -0,0 +1,173 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from users.models import Artist
+from .models import FacetCount, Music, ListeningHistory, UserMusicPreference, MusicStatistics, UserHeardSet
+from . import audio_features, listeners, rollups, suggest, vector_index
+
+
+@receiver(post_save, sender=ListeningHistory)
+def update_statistics_on_history(sender, instance, created, **kwargs):
+    if created:
+        first_listen = not ListeningHistory.heard_pairs(
+            [instance.user_id],
+            [instance.music_id],
+            exclude_ids=[instance.pk]
+        )
+        MusicStatistics.apply_play_delta(
+            instance.music_id,
+            duration=instance.listened_duration,
+            listened_at=instance.listened_at,
+            new_listeners=int(first_listen)
+        )
+        if first_listen:
+            UserHeardSet.add(instance.user_id, [instance.music_id])
+        rollups.record_plays([(instance.music_id, instance.listened_at, instance.listened_duration)])
+        listeners.record_listeners([(instance.music_id, instance.user_id, instance.listened_at)])
+
+
+@receiver(post_save, sender=UserMusicPreference)
+def update_statistics_on_preference(sender, instance, created, update_fields=None, **kwargs):
+    if not UserMusicPreference.changes_statistics(update_fields):
+        return
+    stored_state = (None, False) if created else instance._stored_state
+
+    if stored_state is None:
+        # Loaded with deferred fields: the previous values are unknown
+        instance.music.get_statistics().update_statistics()
+        UserMusicPreference.change_favorite_count(instance.user_id, None)
+    else:
+        old_rating, old_favorite = stored_state
+        MusicStatistics.apply_preference_delta(
+            instance.music_id,
+            old_rating, instance.rating,
+            old_favorite, instance.favorite
+        )
+        if instance.favorite != old_favorite:
+            UserMusicPreference.change_favorite_count(instance.user_id, 1 if instance.favorite else -1)
+    instance.remember_stored_state()
+
+
+@receiver(post_delete, sender=UserMusicPreference)
+def update_statistics_on_preference_delete(sender, instance, **kwargs):
+    # The statistics of a track being deleted with its preferences are not
+    # created again
+    if instance._stored_state is None:
+        MusicStatistics.rebuild([instance.music_id])
+        UserMusicPreference.change_favorite_count(instance.user_id, None)
+    else:
+        old_rating, old_favorite = instance._stored_state
+        MusicStatistics.apply_preference_delta(
+            instance.music_id,
+            old_rating, None,
+            old_favorite, False,
+            create_missing=False
+        )
+        if old_favorite:
+            UserMusicPreference.change_favorite_count(instance.user_id, -1)
+
+
+@receiver(post_save, sender=Music)
+def create_music_statistics(sender, instance, created, **kwargs):
+    if created:
+        MusicStatistics.objects.create(music=instance)
+
+
+def _saves_facets(update_fields):
+    return update_fields is None or bool({'genre', 'artist', 'artist_id'} & set(update_fields))
+
+
+@receiver(pre_save, sender=Music)
+def load_stored_facets_on_save(sender, instance, update_fields=None, **kwargs):
+    if not instance._state.adding and _saves_facets(update_fields):
+        instance.load_stored_facets()
+
+
+@receiver(post_save, sender=Music)
+def update_facet_counts_on_save(sender, instance, created, update_fields=None, **kwargs):
+    if not _saves_facets(update_fields):
+        return
+    FacetCount.move(None if created else instance._stored_facets, (instance.genre, instance.artist_id))
+    instance.remember_stored_facets()
+
+
+@receiver(pre_delete, sender=Music)
+def load_stored_facets_on_delete(sender, instance, **kwargs):
+    instance.load_stored_facets()
+
+
+@receiver(post_delete, sender=Music)
+def update_facet_counts_on_delete(sender, instance, **kwargs):
+    FacetCount.move(instance._stored_facets, None)
+
+
+@receiver(post_delete, sender=Artist)
+def delete_artist_facet_count(sender, instance, **kwargs):
+    FacetCount.objects.filter(facet=FacetCount.ARTIST, value=str(instance.pk)).delete()
+
+
+@receiver(post_save, sender=Music)
+def index_saved_music(sender, instance, created, update_fields=None, **kwargs):
+    if created or _saves_facets(update_fields):
+        # Only once the track is committed, so the index never lists a track
+        # or a genre that was rolled back
+        transaction.on_commit(lambda: vector_index.add_track(instance))
+
+
+@receiver(post_delete, sender=Music)
+def unindex_deleted_music(sender, instance, **kwargs):
+    music_id = instance.pk
+    transaction.on_commit(lambda: vector_index.remove_track(music_id))
+
+
+@receiver(post_save, sender=Music)
+def extract_new_music_features(sender, instance, created, **kwargs):
+    if created and instance.audio_file:
+        transaction.on_commit(lambda: audio_features.ingest(instance))
+
+
+@receiver(post_delete, sender=Music)
+def remove_deleted_music_features(sender, instance, **kwargs):
+    music_id = instance.pk
+    transaction.on_commit(lambda: audio_features.remove_track(music_id))
+
+
+@receiver(post_save, sender=Music)
+def suggest_saved_music(sender, instance, **kwargs):
+    def update():
+        index = suggest.loaded_index()
+        if index is not None:
+            index.add_track(instance.pk, instance.title, instance.artist_id)
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Music)
+def suggest_deleted_music(sender, instance, **kwargs):
+    # The primary key is cleared once the delete is done
+    music_id = instance.pk
+
+    def update():
+        index = suggest.loaded_index()
+        if index is not None:
+            index.remove_track(music_id)
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Artist)
+def suggest_saved_artist(sender, instance, **kwargs):
+    def update():
+        index = suggest.loaded_index()
+        if index is not None:
+            index.add_artist(instance.pk, instance.full_name)
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Artist)
+def suggest_deleted_artist(sender, instance, **kwargs):
+    artist_id = instance.pk
+
+    def update():
+        index = suggest.loaded_index()
+        if index is not None:
+            index.remove_artist(artist_id)
+    transaction.on_commit(update)
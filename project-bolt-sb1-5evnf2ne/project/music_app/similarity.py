@@ -0,0 +1,201 @@
+"""
+Offline item-item similarity model for collaborative recommendations.
+
+build_similarity_model() reads every user's interactions with the tracks
+(plays, archived plays, favorites and ratings), computes the cosine
+similarity between tracks over their listeners and keeps the closest
+neighbours of each track. The result is saved as a compact NumPy archive
+in CSR layout and loaded once per worker process; recommendations are then
+a lookup in memory instead of a join over all the preferences.
+"""
+import os
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .models import Music, UserMusicPreference, ListeningHistory, ArchivedListeningSummary
+
+DEFAULT_NEIGHBOURS = 50
+
+# Interaction weights: a play counts once, a favorite or a good rating counts
+# more and a rating of 2 or less is not a positive signal at all
+PLAY_WEIGHT = 1.0
+FAVORITE_WEIGHT = 2.0
+
+
+def rating_weight(rating):
+    return max(rating - 2, 0)
+
+
+def _model_path():
+    return Path(getattr(settings, 'SIMILARITY_MODEL_PATH', Path(settings.BASE_DIR) / 'var' / 'models' / 'item_similarity.npz'))
+
+
+def _interactions():
+    """Strongest weight of every (user, track) pair with a positive signal."""
+    weights = {}
+
+    def add(user_id, music_id, weight):
+        if weight > weights.get((user_id, music_id), 0):
+            weights[(user_id, music_id)] = weight
+
+    played = ListeningHistory.objects.order_by().values_list('user_id', 'music_id').distinct()
+    for user_id, music_id in played.iterator(chunk_size=5000):
+        add(user_id, music_id, PLAY_WEIGHT)
+    archived = ArchivedListeningSummary.objects.order_by().values_list('user_id', 'music_id')
+    for user_id, music_id in archived.iterator(chunk_size=5000):
+        add(user_id, music_id, PLAY_WEIGHT)
+
+    preferences = UserMusicPreference.objects.order_by().values_list('user_id', 'music_id', 'rating', 'favorite')
+    for user_id, music_id, rating, favorite in preferences.iterator(chunk_size=5000):
+        if favorite:
+            add(user_id, music_id, FAVORITE_WEIGHT)
+        if rating is not None:
+            add(user_id, music_id, rating_weight(rating))
+    return weights
+
+
+def build_similarity_model(neighbours=DEFAULT_NEIGHBOURS, path=None):
+    """
+    Compute the item-item model and save it. Returns the number of tracks
+    with at least one neighbour.
+    """
+    music_ids = np.array(sorted(Music.objects.values_list('id', flat=True)), dtype=np.int64)
+    item_count = len(music_ids)
+    interactions = _interactions()
+
+    user_index = {}
+    rows = np.empty(len(interactions), dtype=np.int64)
+    interaction_ids = np.empty(len(interactions), dtype=np.int64)
+    values = np.empty(len(interactions), dtype=np.float64)
+    for position, ((user_id, music_id), weight) in enumerate(interactions.items()):
+        rows[position] = user_index.setdefault(user_id, len(user_index))
+        interaction_ids[position] = music_id
+        values[position] = weight
+
+    # Tracks created or deleted since the ids were read are left out
+    columns = np.searchsorted(music_ids, interaction_ids)
+    known = columns < item_count
+    known[known] = music_ids[columns[known]] == interaction_ids[known]
+    rows, columns, values = rows[known], columns[known], values[known]
+
+    # Interactions grouped by user (CSR) and by track (CSC)
+    by_user = np.argsort(rows, kind='stable')
+    user_items, user_weights = columns[by_user], values[by_user]
+    user_ptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=len(user_index)))))
+    by_item = np.argsort(columns, kind='stable')
+    item_users, item_weights = rows[by_item], values[by_item]
+    item_ptr = np.concatenate(([0], np.cumsum(np.bincount(columns, minlength=item_count))))
+
+    norms = np.sqrt(np.bincount(columns, weights=values ** 2, minlength=item_count))
+
+    indptr = [0]
+    neighbour_items, neighbour_scores = [], []
+    for item in range(item_count):
+        users = item_users[item_ptr[item]:item_ptr[item + 1]]
+        if not len(users):
+            indptr.append(indptr[-1])
+            continue
+
+        # Every interaction of the listeners of this track, weighted by
+        # how much they like it, summed per track: the non-zero part of one
+        # row of the co-occurrence matrix, without a catalog-sized array
+        starts, lengths = user_ptr[users], user_ptr[users + 1] - user_ptr[users]
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        co_weights = user_weights[offsets] * np.repeat(item_weights[item_ptr[item]:item_ptr[item + 1]], lengths)
+        candidates, inverse = np.unique(user_items[offsets], return_inverse=True)
+        row = np.bincount(inverse, weights=co_weights)
+        other = candidates != item
+        candidates, row = candidates[other], row[other]
+
+        scores = row / (norms[item] * norms[candidates])
+        if len(candidates) > neighbours:
+            keep = np.argpartition(-scores, neighbours)[:neighbours]
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.argsort(-scores, kind='stable')
+
+        neighbour_items.append(candidates[order])
+        neighbour_scores.append(scores[order])
+        indptr.append(indptr[-1] + len(candidates))
+
+    model_path = Path(path) if path else _model_path()
+    model_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = model_path.with_suffix('.tmp')
+    with open(temporary, 'wb') as model_file:
+        np.savez(
+            model_file,
+            music_ids=music_ids,
+            indptr=np.array(indptr, dtype=np.int64),
+            neighbours=np.concatenate(neighbour_items or [np.empty(0)]).astype(np.int32),
+            scores=np.concatenate(neighbour_scores or [np.empty(0)]).astype(np.float32),
+        )
+    os.replace(temporary, model_path)
+    return int(np.count_nonzero(np.diff(indptr)))
+
+
+class SimilarityModel:
+    def __init__(self, music_ids, indptr, neighbours, scores):
+        self.music_ids = music_ids
+        self.indptr = indptr
+        self.neighbours = neighbours
+        self.scores = scores
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['music_ids'], data['indptr'], data['neighbours'], data['scores'])
+
+    def _positions(self, music_ids):
+        music_ids = np.asarray(music_ids, dtype=np.int64)
+        positions = np.searchsorted(self.music_ids, music_ids)
+        known = positions < len(self.music_ids)
+        known[known] = self.music_ids[positions[known]] == music_ids[known]
+        return positions, known
+
+    def similar_to(self, seeds, exclude=(), limit=10):
+        """
+        Tracks closest to the seeds, best first, as (music_id, score) pairs.
+        seeds maps music ids to the weight of each seed.
+        """
+        if not seeds:
+            return []
+        positions, known = self._positions(list(seeds))
+        weights = np.fromiter(seeds.values(), dtype=np.float64, count=len(seeds))
+        positions, weights = positions[known], weights[known]
+        if not len(positions):
+            return []
+
+        starts, lengths = self.indptr[positions], self.indptr[positions + 1] - self.indptr[positions]
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        candidates, inverse = np.unique(self.neighbours[offsets], return_inverse=True)
+        totals = np.bincount(inverse, weights=self.scores[offsets] * np.repeat(weights, lengths))
+
+        kept = totals > 0
+        excluded = set(seeds) | set(exclude)
+        if excluded:
+            excluded_positions, excluded_known = self._positions(list(excluded))
+            kept &= ~np.isin(candidates, excluded_positions[excluded_known])
+        candidates, totals = candidates[kept], totals[kept]
+
+        order = np.argsort(-totals, kind='stable')[:limit]
+        return [(int(self.music_ids[candidates[index]]), float(totals[index])) for index in order]
+
+
+_loaded = {'model': None, 'mtime': None}
+
+
+def get_model():
+    """
+    The model of this worker process, or None before the first build. It is
+    read from disk once and again only when a newer build replaces it.
+    """
+    path = _model_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _loaded['mtime'] != mtime:
+        _loaded['model'] = SimilarityModel.load(path)
+        _loaded['mtime'] = mtime
+    return _loaded['model']
@@ -0,0 +1,242 @@
+"""
+In-process prefix index of track titles and artist names, for typeahead.
+
+Titles and names are normalized (accents removed, case folded) and split in
+words. The sorted list of distinct words is searched with bisect for the
+words starting with the last word typed; each word points to an array of the
+tracks (positive ids) and artists (negative ids) containing it. Earlier
+words of the query must start words of the same title or name. Answering a
+suggestion request never touches the database.
+
+The index stays compact for large catalogs: titles and names are kept in
+lists indexed by id, so there is no per-entry dict, and the word list grows
+with the vocabulary rather than with the catalog. For a million tracks it
+takes in the order of 150 MB per process.
+
+Each process builds its index on first use. Saves and deletes update the
+index of the process that made them as soon as they are committed; the
+other processes rebuild theirs in the background every
+SUGGEST_REFRESH_SECONDS.
+"""
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+
+from users.models import Artist
+from .models import Music
+
+# Longer words are indexed by their start only
+MAX_WORD_LENGTH = 20
+
+# Candidates checked against a multi-word query before giving up
+MAX_CANDIDATES = 200
+
+
+def _refresh_seconds():
+    return getattr(settings, 'SUGGEST_REFRESH_SECONDS', 600)
+
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Lower-case words of a text, without accents."""
+    if text.isascii():
+        return _WORD.findall(text.lower())
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(character for character in decomposed if not unicodedata.combining(character))
+    return _WORD.findall(stripped.casefold())
+
+
+def _index_words(text):
+    return {word[:MAX_WORD_LENGTH] for word in normalize(text or '')}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self.words = []
+        self.postings = {}
+        self.titles = []
+        self.track_artists = array('q')
+        self.names = []
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _put(values, position, value, empty):
+        if position >= len(values):
+            values.extend([empty] * (position + 1 - len(values)))
+        values[position] = value
+
+    def _link(self, entry, text, keep_sorted=True):
+        for word in _index_words(text):
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = array('q')
+                if keep_sorted:
+                    insort(self.words, word)
+            posting.append(entry)
+
+    def load(self, artists, tracks):
+        """
+        Fill an empty index from (artist_id, name) and (music_id, title,
+        artist_id) rows, sorting the words once at the end.
+        """
+        with self.lock:
+            for artist_id, name in artists:
+                self._put(self.names, artist_id, name, None)
+                self._link(-artist_id, name, keep_sorted=False)
+            for music_id, title, artist_id in tracks:
+                self._put(self.titles, music_id, title, None)
+                self._put(self.track_artists, music_id, artist_id, 0)
+                self._link(music_id, title, keep_sorted=False)
+            self.words = sorted(self.postings)
+
+    def _unlink(self, entry, text):
+        for word in _index_words(text):
+            posting = self.postings.get(word)
+            if posting is None or entry not in posting:
+                continue
+            posting.remove(entry)
+            if not posting:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def add_track(self, music_id, title, artist_id):
+        with self.lock:
+            self.remove_track(music_id)
+            self._put(self.titles, music_id, title, None)
+            self._put(self.track_artists, music_id, artist_id, 0)
+            self._link(music_id, title)
+
+    def remove_track(self, music_id):
+        with self.lock:
+            if music_id < len(self.titles) and self.titles[music_id] is not None:
+                self._unlink(music_id, self.titles[music_id])
+                self.titles[music_id] = None
+
+    def add_artist(self, artist_id, name):
+        with self.lock:
+            self.remove_artist(artist_id)
+            self._put(self.names, artist_id, name, None)
+            self._link(-artist_id, name)
+
+    def remove_artist(self, artist_id):
+        with self.lock:
+            if artist_id < len(self.names) and self.names[artist_id] is not None:
+                self._unlink(-artist_id, self.names[artist_id])
+                self.names[artist_id] = None
+
+    def _text(self, entry):
+        return self.titles[entry] if entry > 0 else self.names[-entry]
+
+    def _artist_name(self, artist_id):
+        return self.names[artist_id] if artist_id < len(self.names) else None
+
+    def suggest(self, query, limit=8):
+        """
+        Tracks and artists whose title or name has words starting with the
+        words of the query, as dicts, the closest word matches first.
+        """
+        words = normalize(query or '')
+        if not words:
+            return []
+        last = words[-1][:MAX_WORD_LENGTH]
+        others = words[:-1]
+
+        suggestions = []
+        seen = set()
+        checked = 0
+        with self.lock:
+            position = bisect_left(self.words, last)
+            while position < len(self.words) and self.words[position].startswith(last):
+                for entry in self.postings[self.words[position]]:
+                    if entry in seen:
+                        continue
+                    seen.add(entry)
+                    checked += 1
+                    if others:
+                        entry_words = normalize(self._text(entry) or '')
+                        if not all(any(word.startswith(other) for word in entry_words) for other in others):
+                            if checked >= MAX_CANDIDATES:
+                                return suggestions
+                            continue
+                    suggestions.append(self._suggestion(entry))
+                    if len(suggestions) == limit or checked >= MAX_CANDIDATES:
+                        return suggestions
+                position += 1
+        return suggestions
+
+    def _suggestion(self, entry):
+        if entry > 0:
+            return {
+                'type': 'music',
+                'id': entry,
+                'title': self.titles[entry],
+                'artist': self._artist_name(self.track_artists[entry]),
+            }
+        return {'type': 'artist', 'id': -entry, 'name': self.names[-entry]}
+
+
+def build_index():
+    index = PrefixIndex()
+    index.load(
+        Artist.objects.values_list('id', 'full_name').iterator(chunk_size=5000),
+        Music.objects.order_by().values_list('id', 'title', 'artist_id').iterator(chunk_size=5000)
+    )
+    return index
+
+
+_state = {'index': None, 'built_at': 0.0, 'refreshing': False}
+_lock = threading.Lock()
+
+
+def _rebuild_in_background():
+    def rebuild():
+        try:
+            index = build_index()
+            with _lock:
+                _state.update(index=index, built_at=time.monotonic())
+        finally:
+            with _lock:
+                _state['refreshing'] = False
+            # The thread has its own database connection
+            connection.close()
+
+    threading.Thread(target=rebuild, daemon=True).start()
+
+
+def get_index():
+    """The index of this process, built on first use."""
+    with _lock:
+        index = _state['index']
+        stale = time.monotonic() - _state['built_at'] > _refresh_seconds()
+        start_rebuild = index is not None and stale and not _state['refreshing']
+        if start_rebuild:
+            _state['refreshing'] = True
+    if index is None:
+        index = build_index()
+        with _lock:
+            _state.update(index=index, built_at=time.monotonic())
+    elif start_rebuild:
+        _rebuild_in_background()
+    return index
+
+
+def loaded_index():
+    """The index of this process if it was built, without building it."""
+    return _state['index']
+
+
+def reset():
+    with _lock:
+        _state.update(index=None, built_at=0.0, refreshing=False)
+
+
+def suggest(query, limit=8):
+    return get_index().suggest(query, limit)
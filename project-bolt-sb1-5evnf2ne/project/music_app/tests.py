@@ -1,3 +1,1260 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import math
+import os
+import tempfile
+import time
+import wave
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlencode
 
-# Create your tests here.
\ No newline at end of file
+import numpy as np
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.template import RequestContext, Template
+from django.urls import reverse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from users.models import CustomUser
+from .hyperloglog import HyperLogLog
+from .models import (
+    ArchivedListeningSummary, FacetCount, GenrePlayRollup, ListenerSketch, ListeningHistory, Music, MusicStatistics,
+    OpenPlaybackSession, Playlist, PlayRollup, PrecomputedRecommendations, TrackPlayRollup, UserMusicPreference
+)
+from . import (
+    archive, audio_features, facets, listeners, pagination, playback, playbuffer, popularity, precompute,
+    recommendation_cache, rollups, search, similarity, suggest, vector_index
+)
+from .recommendations import get_recommendations
+
+
+class HyperLogLogTests(SimpleTestCase):
+    # Three standard errors of a sketch with the default precision
+    TOLERANCE = 3 * 1.04 / math.sqrt(2 ** 11)
+
+    def test_estimate_is_close_to_exact_count(self):
+        for exact in (10, 1000, 50000):
+            sketch = HyperLogLog()
+            for value in range(exact):
+                sketch.add(value)
+            self.assertAlmostEqual(sketch.count(), exact, delta=exact * self.TOLERANCE)
+
+    def test_duplicates_do_not_change_the_sketch(self):
+        sketch = HyperLogLog()
+        self.assertTrue(sketch.add('user-1'))
+        self.assertFalse(sketch.add('user-1'))
+        self.assertEqual(sketch.count(), 1)
+
+    def test_merge_counts_the_union(self):
+        first, second = HyperLogLog(), HyperLogLog()
+        for value in range(0, 3000):
+            first.add(value)
+        for value in range(2000, 5000):
+            second.add(value)
+        self.assertAlmostEqual(first.merge(second).count(), 5000, delta=5000 * self.TOLERANCE)
+
+    def test_serialization_round_trip(self):
+        small, large = HyperLogLog(), HyperLogLog()
+        for value in range(5):
+            small.add(value)
+        for value in range(10000):
+            large.add(value)
+
+        # Few registers in use are stored sparsely
+        self.assertLess(len(small.to_bytes()), 20)
+        self.assertEqual(len(large.to_bytes()), 2 ** 11 + 1)
+        for sketch in (small, large):
+            self.assertEqual(HyperLogLog.from_bytes(sketch.to_bytes()).registers, sketch.registers)
+        self.assertEqual(HyperLogLog.from_bytes(b'').count(), 0)
+
+
+class UniqueListenersTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.music = Music.objects.create(title='Track', artist=artist.artist_profile, release_date=date.today())
+        users = CustomUser.objects.bulk_create(
+            CustomUser(username=f'listener{index}') for index in range(600)
+        )
+
+        # Every user listens on a few of the last 60 days
+        now = timezone.now()
+        ListeningHistory.objects.bulk_create(
+            ListeningHistory(user=user, music=self.music, listened_at=now - timedelta(days=(index * 7 + play * 13) % 60))
+            for index, user in enumerate(users)
+            for play in range(index % 4 + 1)
+        )
+
+    def exact_listeners(self, start, end):
+        return ListeningHistory.objects.filter(
+            music=self.music,
+            listened_at__date__gte=start,
+            listened_at__date__lte=end
+        ).values('user').distinct().count()
+
+    def assert_matches_exact_counts(self):
+        today = timezone.localdate()
+        for days in (1, 7, 30, 60):
+            start = today - timedelta(days=days - 1)
+            exact = self.exact_listeners(start, today)
+            self.assertAlmostEqual(
+                listeners.unique_listeners(self.music, start, today),
+                exact,
+                delta=max(1, exact * HyperLogLogTests.TOLERANCE)
+            )
+
+    def test_incremental_sketches_match_count_distinct(self):
+        listeners.record_listeners(
+            ListeningHistory.objects.values_list('music_id', 'user_id', 'listened_at')
+        )
+        self.assert_matches_exact_counts()
+
+    def test_backfilled_sketches_match_count_distinct(self):
+        listeners.backfill_sketches()
+        self.assertEqual(ListenerSketch.objects.count(), 60)
+        self.assert_matches_exact_counts()
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.musics = [
+            Music.objects.create(
+                title=f'Track {index}', artist=artist.artist_profile, genre=genre, release_date=date.today()
+            )
+            for index, genre in enumerate(('rock', 'rock', 'jazz'))
+        ]
+        user = CustomUser.objects.create_user('listener')
+
+        # Plays over the last ten days, a few of them within the same hours
+        now = timezone.now()
+        history = ListeningHistory.objects.bulk_create(
+            ListeningHistory(
+                user=user,
+                music=self.musics[index % 3],
+                listened_at=now - timedelta(hours=(index * 7) % 240, minutes=index % 50),
+                listened_duration=timedelta(seconds=30 + index)
+            )
+            for index in range(120)
+        )
+        self.plays = [(play.music_id, play.listened_at, play.listened_duration) for play in history]
+
+    def buckets(self, model, key_field):
+        return sorted(model.objects.values_list(key_field, 'period', 'bucket_start', 'plays', 'duration_played'))
+
+    def all_buckets(self):
+        return [self.buckets(model, key_field) for model, key_field, _, _ in rollups.DIMENSIONS]
+
+    def test_compaction_folds_past_days_into_daily_buckets(self):
+        rollups.record_plays(self.plays)
+        since = timezone.now() - timedelta(days=11)
+        totals = [rollups.plays_since(since, music_id=music.pk) for music in self.musics]
+        self.assertEqual(totals, [40, 40, 40])
+        cutoff = rollups.day_start(timezone.now() - timedelta(hours=rollups.DEFAULT_KEEP_HOURS))
+        past_hours = sum(
+            model.objects.filter(period=PlayRollup.HOUR, bucket_start__lt=cutoff).count()
+            for model, _, _, _ in rollups.DIMENSIONS
+        )
+
+        self.assertEqual(rollups.compact_rollups(), past_hours)
+        self.assertFalse(TrackPlayRollup.objects.filter(period=PlayRollup.HOUR, bucket_start__lt=cutoff).exists())
+        self.assertFalse(TrackPlayRollup.objects.filter(period=PlayRollup.DAY, bucket_start__gte=cutoff).exists())
+        self.assertEqual([rollups.plays_since(since, music_id=music.pk) for music in self.musics], totals)
+        self.assertEqual(rollups.plays_since(since, model=GenrePlayRollup, genre='rock'), 80)
+        self.assertEqual(sum(plays for _, plays in rollups.daily_plays(days=11, music_id=self.musics[0].pk)), 40)
+
+        # Compacting again has nothing left to fold
+        before = self.all_buckets()
+        self.assertEqual(rollups.compact_rollups(), 0)
+        self.assertEqual(self.all_buckets(), before)
+
+    def test_backfill_matches_incremental_rollups(self):
+        rollups.record_plays(self.plays)
+        rollups.compact_rollups()
+        incremental = self.all_buckets()
+
+        for model, _, _, _ in rollups.DIMENSIONS:
+            model.objects.all().delete()
+        self.assertEqual(rollups.backfill_rollups(), sum(len(buckets) for buckets in incremental))
+        self.assertEqual(self.all_buckets(), incremental)
+
+        # Backfilling again replaces the buckets instead of adding to them
+        rollups.backfill_rollups()
+        self.assertEqual(self.all_buckets(), incremental)
+
+
+class PreferenceStatisticsTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.music = Music.objects.create(title='Track', artist=artist.artist_profile, release_date=date.today())
+        self.users = [CustomUser.objects.create_user(f'listener{index}') for index in range(3)]
+
+    def assert_statistics_match_recompute(self):
+        statistics = MusicStatistics.objects.get(music=self.music)
+        expected = MusicStatistics(music=self.music)
+        expected._set_recomputed_values(MusicStatistics.recompute([self.music.pk]).get(self.music.pk, {}))
+        for field in ('rating_sum', 'rating_count', 'average_rating', 'total_favorites'):
+            self.assertEqual(getattr(statistics, field), getattr(expected, field), field)
+
+    def test_rate_favorite_and_unfavorite_sequences(self):
+        for user in self.users:
+            self.client.force_login(user)
+            for rating in (4, 2, 5):
+                self.client.post(f'/music/{self.music.pk}/rate/', {'rating': rating})
+                self.assert_statistics_match_recompute()
+            for _ in range(3):
+                self.client.post(f'/music/{self.music.pk}/favorite/')
+                self.assert_statistics_match_recompute()
+
+        UserMusicPreference.objects.get(user=self.users[0]).delete()
+        self.assert_statistics_match_recompute()
+        statistics = MusicStatistics.objects.get(music=self.music)
+        self.assertEqual((statistics.rating_count, statistics.total_favorites), (2, 2))
+
+    def test_stale_instances_do_not_apply_a_delta_twice(self):
+        UserMusicPreference.objects.create(user=self.users[0], music=self.music)
+        first = UserMusicPreference.objects.get(user=self.users[0])
+        second = UserMusicPreference.objects.get(user=self.users[0])
+
+        first.rating, first.favorite = 4, True
+        first.save()
+        second.rating, second.favorite = 4, True
+        second.save()
+        second.rating = 2
+        second.save()
+        self.assert_statistics_match_recompute()
+
+        first.refresh_from_db()
+        self.assertEqual(first._stored_state, (2, True))
+
+    def test_saves_of_other_fields_keep_the_statistics(self):
+        preference = UserMusicPreference.objects.create(user=self.users[0], music=self.music, rating=3)
+        preference.rating = 5
+        preference.listen_count = 2
+        preference.save(update_fields=['listen_count'])
+        self.assert_statistics_match_recompute()
+
+
+class StatisticsRebuildTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.musics = [
+            Music.objects.create(title=f'Track {index}', artist=artist.artist_profile, release_date=date.today())
+            for index in range(2)
+        ]
+        self.users = [CustomUser.objects.create_user(f'listener{index}') for index in range(3)]
+        self.now = timezone.now()
+        music = self.musics[0]
+
+        # The first listener has plays both in the history and in the archive
+        ListeningHistory.objects.bulk_create([
+            ListeningHistory(user=self.users[0], music=music, listened_at=self.now - timedelta(hours=2),
+                             listened_duration=timedelta(seconds=60)),
+            ListeningHistory(user=self.users[0], music=music, listened_at=self.now - timedelta(hours=1),
+                             listened_duration=timedelta(seconds=60)),
+            ListeningHistory(user=self.users[1], music=music, listened_at=self.now,
+                             listened_duration=timedelta(seconds=30)),
+        ])
+        ArchivedListeningSummary.objects.bulk_create([
+            ArchivedListeningSummary(user=self.users[0], music=music, plays=3,
+                                     duration_played=timedelta(seconds=90), last_played=self.now - timedelta(days=200)),
+            ArchivedListeningSummary(user=self.users[2], music=music, plays=1,
+                                     duration_played=timedelta(seconds=10), last_played=self.now - timedelta(days=300)),
+        ])
+        UserMusicPreference.objects.create(user=self.users[0], music=music, rating=4)
+        UserMusicPreference.objects.create(user=self.users[1], music=music, rating=2, favorite=True)
+        UserMusicPreference.objects.create(user=self.users[2], music=music)
+
+    def test_recompute_counts_history_archive_and_preferences(self):
+        values = MusicStatistics.recompute([music.pk for music in self.musics])
+        self.assertEqual(values[self.musics[0].pk], {
+            'total_plays': 7,
+            'unique_listeners': 3,
+            'total_duration_played': timedelta(seconds=250),
+            'last_played': self.now,
+            'rating_sum': 6,
+            'rating_count': 2,
+            'total_favorites': 1,
+        })
+        self.assertNotIn(self.musics[1].pk, values)
+
+    def test_rebuild_repairs_drifted_statistics(self):
+        MusicStatistics.objects.filter(music__in=self.musics).update(
+            total_plays=99, unique_listeners=99, rating_sum=99, rating_count=1, average_rating=99, total_favorites=9
+        )
+        self.assertEqual(MusicStatistics.rebuild([music.pk for music in self.musics]), 2)
+
+        statistics = MusicStatistics.objects.get(music=self.musics[0])
+        self.assertEqual((statistics.total_plays, statistics.unique_listeners), (7, 3))
+        self.assertEqual((statistics.rating_sum, statistics.rating_count, statistics.average_rating), (6, 2, 3.0))
+        self.assertEqual(statistics.total_favorites, 1)
+        empty = MusicStatistics.objects.get(music=self.musics[1])
+        self.assertEqual((empty.total_plays, empty.rating_count, empty.last_played), (0, 0, None))
+
+    def test_rebuild_recomputes_tracks_changed_since_their_values(self):
+        music_ids = [music.pk for music in self.musics]
+        MusicStatistics.objects.filter(music__in=self.musics).update(updated_at=self.now - timedelta(minutes=1))
+        computed_at = timezone.now()
+        values = MusicStatistics.recompute(music_ids)
+
+        # A play is recorded while the values are written
+        play = ListeningHistory.objects.create(
+            user=self.users[2], music=self.musics[1], listened_at=timezone.now(),
+            listened_duration=timedelta(seconds=20)
+        )
+        MusicStatistics.objects.filter(music=self.musics[0]).update(total_plays=0)
+
+        self.assertEqual(MusicStatistics.rebuild(music_ids, values, computed_at), 2)
+        # Unchanged since computed_at: the values are written as they are
+        self.assertEqual(MusicStatistics.objects.get(music=self.musics[0]).total_plays, 7)
+        # Changed meanwhile: recomputed instead of losing the play
+        statistics = MusicStatistics.objects.get(music=self.musics[1])
+        self.assertEqual((statistics.total_plays, statistics.last_played), (1, play.listened_at))
+
+
+class FavoriteCountTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.musics = [
+            Music.objects.create(title=f'Track {index}', artist=artist.artist_profile, release_date=date.today())
+            for index in range(3)
+        ]
+        self.user = CustomUser.objects.create_user('listener', password='secret')
+        UserMusicPreference.objects.create(user=self.user, music=self.musics[0], favorite=True)
+
+    def render(self, source):
+        request = RequestFactory().get('/')
+        request.user = CustomUser.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            return Template(source).render(RequestContext(request))
+
+    def test_templates_without_badge_do_not_count_favorites(self):
+        self.assertEqual(self.render('{{ user.username }}'), 'listener')
+
+    def test_badge_reads_the_user_column(self):
+        self.assertEqual(self.render('{{ favorite_count }}'), '1')
+
+    def test_toggle_favorite_updates_the_counter(self):
+        self.client.force_login(self.user)
+
+        self.client.post(f'/music/{self.musics[1].pk}/favorite/')
+        self.assertEqual(self.render('{{ favorite_count }}'), '2')
+
+        self.client.post(f'/music/{self.musics[0].pk}/favorite/')
+        UserMusicPreference.objects.filter(music=self.musics[1]).delete()
+        self.assertEqual(self.render('{{ favorite_count }}'), '0')
+
+    def test_rolled_back_favorite_leaves_the_counter(self):
+        try:
+            with transaction.atomic():
+                UserMusicPreference.objects.create(user=self.user, music=self.musics[2], favorite=True)
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(self.render('{{ favorite_count }}'), '1')
+
+
+class SimilarityModelTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.musics = [
+            Music.objects.create(title=f'Track {index}', artist=artist.artist_profile, release_date=date.today())
+            for index in range(5)
+        ]
+        users = [CustomUser.objects.create_user(f'listener{index}') for index in range(6)]
+        # Track 4 has no listener
+        ListeningHistory.objects.bulk_create(
+            ListeningHistory(user=user, music=self.musics[position])
+            for index, user in enumerate(users)
+            for position in range(4) if (index + position) % 3
+        )
+        UserMusicPreference.objects.create(user=users[0], music=self.musics[1], favorite=True)
+        self.path = Path(tempfile.mkdtemp()) / 'item_similarity.npz'
+
+    def test_scores_are_the_cosine_over_listeners(self):
+        interactions = similarity._interactions()
+        # A track deleted after the catalog was read
+        interactions[(self.musics[0].artist.user_id, 10 ** 9)] = 1.0
+        with mock.patch.object(similarity, '_interactions', return_value=interactions):
+            self.assertEqual(similarity.build_similarity_model(path=self.path), 4)
+
+        music_ids = [music.pk for music in self.musics]
+        vectors = np.zeros((len(music_ids), max(user_id for user_id, _ in interactions) + 1))
+        for (user_id, music_id), weight in interactions.items():
+            if music_id in music_ids:
+                vectors[music_ids.index(music_id), user_id] = weight
+        unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        cosine = unit @ unit.T
+
+        model = similarity.SimilarityModel.load(self.path)
+        for position, music_id in enumerate(music_ids[:4]):
+            expected = {music_ids[other] for other in range(4) if other != position and cosine[position, other] > 0}
+            ranked = model.similar_to({music_id: 1.0})
+            self.assertEqual({neighbour for neighbour, _ in ranked}, expected)
+            for neighbour, score in ranked:
+                self.assertAlmostEqual(score, cosine[position, music_ids.index(neighbour)], places=5)
+        self.assertEqual(model.similar_to({music_ids[4]: 1.0}), [])
+        ranked = model.similar_to({music_ids[0]: 1.0}, exclude={music_ids[2]})
+        self.assertNotIn(music_ids[2], [music_id for music_id, _ in ranked])
+
+
+class VectorIndexTests(TestCase):
+    def setUp(self):
+        directory = Path(tempfile.mkdtemp())
+        settings = override_settings(
+            SIMILAR_MUSIC_INDEX_PATH=directory / 'similar_music.npz',
+            RECOMMENDER_MODEL_DIR=directory / 'als',
+            AUDIO_FEATURES_PATH=directory / 'audio_features.npz'
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        vector_index._loaded.update(index=None, mtime=None)
+        self.artists = [
+            CustomUser.objects.create_user(f'artist{index}', user_type=CustomUser.ARTIST).artist_profile
+            for index in range(3)
+        ]
+
+    def create_track(self, artist, genre):
+        return Music.objects.create(title='Track', artist=artist, genre=genre, release_date=date.today())
+
+    def similar(self, music):
+        return [music_id for music_id, _ in vector_index.get_index().similar(music.pk, limit=10)]
+
+    def test_same_artist_and_genre_rank_first(self):
+        seed = self.create_track(self.artists[0], 'rock')
+        same_artist = self.create_track(self.artists[0], 'rock')
+        same_genre = self.create_track(self.artists[1], 'rock')
+        other_genre = self.create_track(self.artists[0], 'jazz')
+        unrelated = self.create_track(self.artists[2], 'jazz')
+        vector_index.build_index()
+
+        self.assertEqual(self.similar(seed)[:2], [same_artist.pk, same_genre.pk])
+        self.assertEqual(set(self.similar(seed)[2:]), {other_genre.pk, unrelated.pk})
+        # Only the exact artist counts, whatever the artist ids
+        ranked = vector_index.get_index().similar(unrelated.pk, limit=10)
+        self.assertEqual(ranked[0][0], other_genre.pk)
+        self.assertAlmostEqual(ranked[0][1], 1.0, places=5)
+        self.assertAlmostEqual(ranked[1][1], 0.0, places=5)
+
+    def test_changes_go_through_the_change_log(self):
+        seed = self.create_track(self.artists[0], 'rock')
+        edited = self.create_track(self.artists[1], 'jazz')
+        deleted = self.create_track(self.artists[1], 'rock')
+        vector_index.build_index()
+        index_mtime = vector_index._index_path().stat().st_mtime_ns
+
+        with self.captureOnCommitCallbacks(execute=True):
+            uploaded = self.create_track(self.artists[0], 'rock')
+            edited.genre = 'rock'
+            edited.save()
+            deleted.delete()
+        self.assertEqual(vector_index._index_path().stat().st_mtime_ns, index_mtime)
+        self.assert_ranked(seed, [(uploaded.pk, 1 + vector_index.SAME_ARTIST_BONUS), (edited.pk, 1)])
+
+        # The next build folds the log in
+        vector_index.build_index()
+        self.assertEqual(vector_index._log_path().stat().st_size, 0)
+        self.assert_ranked(seed, [(uploaded.pk, 1 + vector_index.SAME_ARTIST_BONUS), (edited.pk, 1)])
+
+    def assert_ranked(self, music, expected):
+        ranked = vector_index.get_index().similar(music.pk, limit=10)
+        self.assertEqual([music_id for music_id, _ in ranked], [music_id for music_id, _ in expected])
+        for (_, score), (_, expected_score) in zip(ranked, expected):
+            self.assertAlmostEqual(score, expected_score, places=5)
+
+
+class AudioFeatureStoreTests(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        settings = override_settings(
+            MEDIA_ROOT=self.directory,
+            AUDIO_FEATURES_PATH=self.directory / 'models' / 'audio_features.npz',
+            SIMILAR_MUSIC_INDEX_PATH=self.directory / 'models' / 'similar_music.npz'
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        audio_features._loaded.update(store=None, mtime=None)
+        self.artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST).artist_profile
+
+    def create_track(self, name, samples):
+        (self.directory / 'music').mkdir(exist_ok=True)
+        with wave.open(str(self.directory / 'music' / f'{name}.wav'), 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(8000)
+            wav.writeframes((samples * 2 ** 14).astype('<i2').tobytes())
+        return Music.objects.create(
+            title=name, artist=self.artist, release_date=date.today(),
+            duration=timedelta(seconds=1), audio_file=f'music/{name}.wav'
+        )
+
+    def tone(self, frequency):
+        return np.sin(2 * np.pi * frequency * np.arange(8000) / 8000)
+
+    def test_uploads_and_deletes_go_through_the_change_log(self):
+        low = self.create_track('low', self.tone(220))
+        noise = self.create_track('noise', np.random.default_rng(0).uniform(-1, 1, 8000))
+        self.assertEqual(audio_features.rebuild_store(), 2)
+        store_mtime = audio_features._store_path().stat().st_mtime_ns
+
+        with self.captureOnCommitCallbacks(execute=True):
+            upload = self.create_track('upload', self.tone(230))
+        self.assertEqual(audio_features._store_path().stat().st_mtime_ns, store_mtime)
+        ranked = audio_features.get_store().similar_to({low.pk: 1})
+        self.assertEqual([music_id for music_id, _ in ranked], [upload.pk, noise.pk])
+
+        upload_id = upload.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            upload.delete()
+        ranked = audio_features.get_store().similar_to({low.pk: 1})
+        self.assertEqual([music_id for music_id, _ in ranked], [noise.pk])
+        self.assertEqual(audio_features.get_store().similar_to({upload_id: 1}), [])
+
+        # The next extraction folds the log into the store
+        self.assertEqual(audio_features.rebuild_store(only_missing=True), 0)
+        self.assertFalse(audio_features._log_path().exists())
+        self.assertEqual(sorted(audio_features.get_store().music_ids.tolist()), [low.pk, noise.pk])
+
+
+@override_settings(
+    PLAY_BUFFER_ENABLED=False,
+    PLAYBACK_HEARTBEAT_INTERVAL=15,
+    PLAYBACK_SESSION_TIMEOUT=60,
+    PLAYBACK_MIN_LISTEN_SECONDS=5
+)
+class PlaybackTests(TestCase):
+    def setUp(self):
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.music = Music.objects.create(title='Track', artist=artist.artist_profile, release_date=date.today())
+        self.user = CustomUser.objects.create_user('listener')
+        self.start = timezone.now()
+
+    def at(self, seconds):
+        # The clock of the playback module only
+        return mock.patch.object(playback, 'timezone', mock.Mock(now=lambda: self.start + timedelta(seconds=seconds)))
+
+    def ping(self, seconds, event='progress', session='a'):
+        with self.at(seconds):
+            return playback.heartbeat(self.user, self.music.pk, session, event)
+
+    def test_time_between_playing_pings_is_counted(self):
+        self.ping(0, 'play')
+        self.ping(15)
+        self.assertEqual(self.ping(30, 'pause'), 30)
+        # Paused: the time until the next ping is not listened
+        self.assertEqual(self.ping(100, 'play'), 30)
+        # A stalled tab counts two intervals at most
+        self.assertEqual(self.ping(1000), 60)
+
+    def test_ended_session_becomes_one_play(self):
+        self.ping(0, 'play')
+        self.ping(15)
+        self.ping(20, 'ended')
+        self.assertFalse(OpenPlaybackSession.objects.exists())
+        self.assertEqual(
+            list(ListeningHistory.objects.values_list('listened_duration', flat=True)),
+            [timedelta(seconds=20)]
+        )
+
+    def test_short_session_is_not_a_play(self):
+        self.ping(0, 'play')
+        self.ping(3, 'ended')
+        self.assertFalse(OpenPlaybackSession.objects.exists())
+        self.assertFalse(ListeningHistory.objects.exists())
+
+    def test_overlapping_pings_count_the_interval_once(self):
+        self.ping(0, 'play')
+        self.ping(15)
+        stale = OpenPlaybackSession.objects.get()
+        self.ping(30, 'pause')
+
+        # A ping that read the session before the pause was written loses its
+        # update and counts from the pause instead
+        sessions = mock.Mock(wraps=OpenPlaybackSession.objects.filter(pk=stale.pk))
+        sessions.first.side_effect = [stale, OpenPlaybackSession.objects.get()]
+        with mock.patch.object(OpenPlaybackSession.objects, 'filter', side_effect=[sessions]):
+            with self.at(100):
+                listened = playback.heartbeat(self.user, self.music.pk, 'a', 'play')
+        self.assertEqual(listened, 30)
+        self.assertEqual(OpenPlaybackSession.objects.get().listened, timedelta(seconds=30))
+
+    def test_stale_sessions_are_finalized_for_every_user(self):
+        other = CustomUser.objects.create_user('other')
+        self.ping(0, 'play')
+        self.ping(10)
+        with self.at(10):
+            playback.heartbeat(other, self.music.pk, 'b', 'play')
+        self.ping(50, session='c')
+
+        with self.at(80):
+            self.assertEqual(playback.finalize_stale_sessions(), 1)
+        # The other user's session was too short, the third one is still live
+        self.assertEqual(list(OpenPlaybackSession.objects.values_list('session_id', flat=True)), ['c'])
+        self.assertEqual(ListeningHistory.objects.get().user, self.user)
+
+
+class PlayBufferTests(TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        settings = override_settings(PLAY_BUFFER_ENABLED=True, PLAY_BUFFER_DIR=self.directory, PLAY_BUFFER_BATCH_SIZE=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.music = Music.objects.create(title='Track', artist=artist.artist_profile, release_date=date.today())
+        self.user = CustomUser.objects.create_user('listener')
+
+    def record(self, plays=1):
+        for _ in range(plays):
+            playbuffer.record_play(self.user, self.music, timedelta(seconds=30))
+
+    def claimed_files(self):
+        return list(self.directory.glob(f'*{playbuffer.CLAIMED_SUFFIX}'))
+
+    def test_plays_are_appended_without_queries(self):
+        with self.assertNumQueries(0):
+            self.record(3)
+        # A full buffer waits for the flush command
+        self.assertEqual(playbuffer.pending_events(), 3)
+        self.assertTrue(playbuffer.should_flush())
+        self.assertFalse(ListeningHistory.objects.exists())
+
+    def test_flush_writes_the_batch(self):
+        self.record(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(playbuffer.flush_play_buffer(), 3)
+
+        self.assertEqual(playbuffer.pending_events(), 0)
+        self.assertEqual(self.claimed_files(), [])
+        self.assertEqual(ListeningHistory.objects.filter(user=self.user, music=self.music).count(), 3)
+        self.assertEqual(UserMusicPreference.objects.get(user=self.user, music=self.music).listen_count, 3)
+        statistics = MusicStatistics.objects.get(music=self.music)
+        self.assertEqual((statistics.total_plays, statistics.unique_listeners), (3, 1))
+        self.assertEqual(statistics.total_duration_played, timedelta(seconds=90))
+
+    def test_partial_record_is_left_out(self):
+        self.record(2)
+        with open(self.directory / playbuffer.SPOOL_NAME, 'ab') as spool:
+            spool.write(b'\0' * (playbuffer.RECORD.size - 1))
+        self.assertEqual(playbuffer.flush_play_buffer(), 2)
+        self.assertEqual(ListeningHistory.objects.count(), 2)
+
+    def test_batch_of_a_failed_flush_is_replayed_once_stale(self):
+        self.record(2)
+        with mock.patch.object(playbuffer, '_apply_batch', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                playbuffer.flush_play_buffer()
+        [claimed] = self.claimed_files()
+        self.record()
+
+        # A recent claim may belong to a flush that is still running
+        self.assertEqual(playbuffer.flush_play_buffer(include_stale=True), 1)
+        self.assertEqual(self.claimed_files(), [claimed])
+
+        stale = time.time() - playbuffer.STALE_CLAIM_AGE
+        os.utime(claimed, (stale, stale))
+        self.assertEqual(playbuffer.flush_play_buffer(include_stale=True), 2)
+        self.assertEqual(self.claimed_files(), [])
+        self.assertEqual(ListeningHistory.objects.count(), 3)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        settings = override_settings(LISTENING_ARCHIVE_DIR=Path(tempfile.mkdtemp()))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        self.musics = [
+            Music.objects.create(title=f'Track {index}', artist=artist.artist_profile, release_date=date.today())
+            for index in range(2)
+        ]
+        self.users = [CustomUser.objects.create_user(f'listener{index}') for index in range(2)]
+        self.now = timezone.now()
+
+    def listen(self, days_ago, users=None, musics=None):
+        ListeningHistory.objects.bulk_create(
+            ListeningHistory(
+                user=user,
+                music=music,
+                listened_at=self.now - timedelta(days=days_ago),
+                listened_duration=timedelta(seconds=60)
+            )
+            for user in users or self.users
+            for music in musics or self.musics
+        )
+
+    def test_old_history_moves_to_the_archive_and_summaries(self):
+        self.listen(40)
+        self.listen(45, users=self.users[:1], musics=self.musics[:1])
+        self.listen(5)
+
+        self.assertEqual(archive.archive_listening_history(older_than_days=30, batch_size=3), 5)
+        self.assertEqual(ListeningHistory.objects.count(), 4)
+        self.assertFalse(ListeningHistory.objects.filter(listened_at__lt=self.now - timedelta(days=30)).exists())
+
+        summary = ArchivedListeningSummary.objects.get(user=self.users[0], music=self.musics[0])
+        self.assertEqual(summary.plays, 2)
+        self.assertEqual(summary.duration_played, timedelta(seconds=120))
+        self.assertEqual(summary.last_played, self.now - timedelta(days=40))
+        self.assertEqual(ArchivedListeningSummary.objects.count(), 4)
+
+        # A later run adds to the summaries of the pairs already archived
+        self.listen(50, users=self.users[:1])
+        self.assertEqual(archive.archive_listening_history(older_than_days=30), 2)
+        summary.refresh_from_db()
+        self.assertEqual((summary.plays, summary.last_played), (3, self.now - timedelta(days=40)))
+        self.assertEqual(sum(ArchivedListeningSummary.objects.values_list('plays', flat=True)), 7)
+
+    def test_summaries_are_written_in_bulk(self):
+        def add_history_to_summaries():
+            with CaptureQueriesContext(connection) as queries:
+                archive._add_to_summaries(ListeningHistory.objects.values_list(
+                    'id', 'user_id', 'music_id', 'listened_at', 'listened_duration'
+                ))
+            return len(queries)
+
+        self.listen(40)
+        add_history_to_summaries()
+
+        # Each run updates the pairs summarized so far and creates new ones
+        artist = self.musics[0].artist
+        self.listen(40, musics=[Music.objects.create(title='Other', artist=artist, release_date=date.today())])
+        few_pairs = add_history_to_summaries()
+        self.listen(40, musics=Music.objects.bulk_create(
+            Music(title=f'Other {index}', artist=artist, release_date=date.today()) for index in range(20)
+        ))
+        self.assertEqual(add_history_to_summaries(), few_pairs)
+
+        self.assertEqual(ArchivedListeningSummary.objects.count(), 46)
+        self.assertEqual(ArchivedListeningSummary.objects.get(user=self.users[1], music=self.musics[1]).plays, 3)
+
+    def test_archived_rows_are_read_back(self):
+        self.listen(40, users=self.users[:1])
+        self.listen(100)
+        rows = ListeningHistory.objects.order_by('id').values('id', 'user_id', 'music_id', 'listened_at')
+        expected = {row['id']: row for row in rows}
+        archive.archive_listening_history(older_than_days=30)
+
+        archived = list(archive.iter_archived_history())
+        self.assertEqual(sorted(row['id'] for row in archived), sorted(expected))
+        for row in archived:
+            self.assertEqual(row['listened_at'], expected[row['id']]['listened_at'])
+            self.assertEqual(row['listened_duration'], timedelta(seconds=60))
+
+        recent = archive.iter_archived_history(start=self.now - timedelta(days=60), user_id=self.users[0].pk)
+        self.assertEqual(
+            sorted(row['id'] for row in recent),
+            sorted(row_id for row_id, row in expected.items() if row['listened_at'] > self.now - timedelta(days=60))
+        )
+        self.assertEqual(
+            len(list(archive.iter_archived_history(end=self.now - timedelta(days=60), music_id=self.musics[0].pk))),
+            2
+        )
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user('admin', user_type=CustomUser.ADMIN)
+        self.listener = CustomUser.objects.create_user('listener')
+        artists = [
+            CustomUser.objects.create_user(f'artist{index}', user_type=CustomUser.ARTIST).artist_profile
+            for index in range(2)
+        ]
+        self.musics = [
+            Music.objects.create(title=f'Track {index}', artist=artist, release_date=date.today())
+            for index, artist in enumerate(artists)
+        ]
+        self.artist = artists[0]
+        self.history = ListeningHistory.objects.bulk_create(
+            ListeningHistory(
+                user=self.listener,
+                music=self.musics[index % 2],
+                listened_at=timezone.make_aware(datetime(2024, 3, 1 + index, 12)),
+                listened_duration=timedelta(seconds=30)
+            )
+            for index in range(6)
+        )
+
+    def export(self, dataset, **params):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('export_data', args=[dataset]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_history_is_streamed_as_csv(self):
+        lines = list(csv.reader(io.StringIO(self.export('history'))))
+        self.assertEqual(lines[0], ['id', 'user_id', 'music_id', 'artist_id', 'listened_at', 'listened_duration'])
+        self.assertEqual(sorted(int(line[0]) for line in lines[1:]), sorted(play.pk for play in self.history))
+        first = next(line for line in lines[1:] if int(line[0]) == self.history[0].pk)
+        self.assertEqual(first[3:], [str(self.artist.pk), '2024-03-01T12:00:00+00:00', '30.0'])
+
+    def test_date_range_and_artist_filters(self):
+        rows = [
+            json.loads(line)
+            for line in self.export('history', format='ndjson', start='2024-03-02', end='2024-03-05',
+                                    artist=self.artist.pk).splitlines()
+        ]
+        # March 2 to 5 included, tracks of the first artist only
+        self.assertEqual([row['id'] for row in rows], [self.history[2].pk, self.history[4].pk])
+        self.assertEqual({row['artist_id'] for row in rows}, {self.artist.pk})
+
+    def test_statistics_and_preferences_datasets(self):
+        UserMusicPreference.objects.create(user=self.listener, music=self.musics[1], rating=4, favorite=True)
+        [preference] = [json.loads(line) for line in self.export('preferences', format='ndjson').splitlines()]
+        self.assertEqual(
+            (preference['music_id'], preference['rating'], preference['favorite']),
+            (self.musics[1].pk, 4, True)
+        )
+
+        lines = list(csv.reader(io.StringIO(self.export('statistics'))))
+        self.assertEqual(sorted(int(line[0]) for line in lines[1:]), sorted(music.pk for music in self.musics))
+
+    def test_invalid_requests(self):
+        self.client.force_login(self.listener)
+        self.assertEqual(self.client.get(reverse('export_data', args=['history'])).status_code, 403)
+
+        self.client.force_login(self.admin)
+        url = reverse('export_data', args=['history'])
+        self.assertEqual(self.client.get(reverse('export_data', args=['users'])).status_code, 404)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+        self.assertEqual(self.client.get(url, {'start': '03/2024'}).status_code, 400)
+
+    def test_command_writes_the_export_to_a_file(self):
+        output = Path(tempfile.mkdtemp()) / 'history.ndjson'
+        call_command('export_data', 'history', format='ndjson', start='2024-03-06', output=str(output))
+        [row] = [json.loads(line) for line in output.read_text().splitlines()]
+        self.assertEqual(row['id'], self.history[5].pk)
+
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'history', end='yesterday', output=str(output))
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.artist = self.create_artist('artist', 'Zed')
+
+    def create_artist(self, username, full_name):
+        artist = CustomUser.objects.create_user(username, user_type=CustomUser.ARTIST).artist_profile
+        artist.full_name = full_name
+        artist.save()
+        return artist
+
+    def create(self, title, genre='other', artist=None):
+        return Music.objects.create(
+            title=title, artist=artist or self.artist, genre=genre, release_date=date.today()
+        )
+
+    def test_title_matches_rank_above_artist_and_genre_matches(self):
+        by_genre = self.create('Tune', genre='rock')
+        by_artist = self.create('Song', artist=self.create_artist('band', 'Rocky Band'))
+        by_title = self.create('Rock Anthem')
+        self.create('Ballad', genre='jazz')
+
+        self.assertEqual(search.search_ids('rock'), [by_title.pk, by_artist.pk, by_genre.pk])
+        self.assertEqual(search.search_ids('rock', limit=2), [by_title.pk, by_artist.pk])
+        self.assertEqual(search.search_ids('rock', genre='rock'), [by_genre.pk])
+        self.assertEqual(search.genre_counts('rock'), {'rock': 1, 'other': 2})
+        self.assertEqual(
+            list(search.search(Music.objects.all(), 'rock').values_list('id', 'search_rank')),
+            [(by_title.pk, 0), (by_artist.pk, 1), (by_genre.pk, 2)]
+        )
+
+    def test_every_word_matches_as_a_prefix_without_diacritics(self):
+        music = self.create('Café de Flore')
+        self.create('Café Noir')
+        self.assertEqual(search.search_ids('cafe flo'), [music.pk])
+        self.assertEqual(search.search_ids('?!'), [])
+
+    def test_triggers_follow_inserts_updates_and_deletes(self):
+        music = self.create('First Title')
+        bulk = Music.objects.bulk_create([
+            Music(title='Bulk Title', artist=self.artist, release_date=date.today())
+        ])[0]
+        self.assertEqual(sorted(search.search_ids('title')), sorted([music.pk, bulk.pk]))
+
+        Music.objects.filter(pk=bulk.pk).update(title='Renamed')
+        self.assertEqual(search.search_ids('title'), [music.pk])
+        self.assertEqual(search.search_ids('renamed'), [bulk.pk])
+
+        other = self.create_artist('other', 'Other Name')
+        Music.objects.filter(pk=music.pk).update(artist=other)
+        self.assertEqual(search.search_ids('other name'), [music.pk])
+
+        self.artist.full_name = 'New Name'
+        self.artist.save()
+        self.assertEqual(search.search_ids('zed'), [])
+        self.assertEqual(search.search_ids('new name'), [bulk.pk])
+
+        music.delete()
+        self.assertEqual(search.search_ids('first'), [])
+        self.assertEqual(search.rebuild_index(), 1)
+        self.assertEqual(search.search_ids('renamed'), [bulk.pk])
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = suggest.PrefixIndex()
+        self.index.load(
+            [(1, 'Zed'), (2, 'Élodie Rock')],
+            [(10, 'Rock Anthem', 1), (11, 'Rocking Chair', 2), (12, 'Slow Song', 1)]
+        )
+
+    def suggested(self, query, limit=8):
+        return sorted((entry['type'], entry['id']) for entry in self.index.suggest(query, limit))
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self.suggested('roc'), [('artist', 2), ('music', 10), ('music', 11)])
+        self.assertEqual(self.suggested('eLoDi'), [('artist', 2)])
+        # Earlier words start words of the same title
+        self.assertEqual(self.suggested('rock ch'), [('music', 11)])
+        self.assertEqual(self.suggested('slow ch'), [])
+        self.assertEqual(len(self.index.suggest('roc', limit=2)), 2)
+        self.assertEqual(self.index.suggest('?'), [])
+        self.assertEqual(
+            self.index.suggest('anthem'),
+            [{'type': 'music', 'id': 10, 'title': 'Rock Anthem', 'artist': 'Zed'}]
+        )
+
+    def test_edits_replace_the_words_of_an_entry(self):
+        self.index.add_track(10, 'Quiet Anthem', 1)
+        self.assertEqual(self.suggested('roc'), [('artist', 2), ('music', 11)])
+        self.assertEqual(self.suggested('quiet'), [('music', 10)])
+
+        self.index.add_track(13, 'Chair Dance', 2)
+        self.index.remove_track(11)
+        self.assertEqual(self.suggested('chair'), [('music', 13)])
+        self.assertNotIn('rocking', self.index.words)
+
+        self.index.add_artist(2, 'Elodie')
+        self.assertEqual(self.suggested('roc'), [])
+        self.assertEqual(self.index.suggest('dance')[0]['artist'], 'Elodie')
+        self.index.remove_artist(1)
+        self.assertEqual(self.suggested('zed'), [])
+        self.assertEqual(self.index.words, sorted(self.index.postings))
+
+
+class SuggestTests(TestCase):
+    def setUp(self):
+        # The commit hooks of track saves also update these files
+        directory = Path(tempfile.mkdtemp())
+        settings = override_settings(
+            SIMILAR_MUSIC_INDEX_PATH=directory / 'similar_music.npz',
+            AUDIO_FEATURES_PATH=directory / 'audio_features.npz'
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        suggest.reset()
+        self.addCleanup(suggest.reset)
+        self.artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST).artist_profile
+        self.music = Music.objects.create(title='Rock Anthem', artist=self.artist, release_date=date.today())
+
+    def suggested_ids(self, query):
+        response = self.client.get(reverse('music_suggest'), {'q': query})
+        return [entry['id'] for entry in response.json()['suggestions'] if entry['type'] == 'music']
+
+    def test_committed_changes_update_the_loaded_index(self):
+        self.assertEqual(self.suggested_ids('anth'), [self.music.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Music.objects.create(title='Anthology', artist=self.artist, release_date=date.today())
+        self.assertEqual(sorted(self.suggested_ids('anth')), sorted([self.music.pk, other.pk]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.music.title = 'Ballad'
+            self.music.save()
+        self.assertEqual(self.suggested_ids('anth'), [other.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.suggested_ids('anth'), [])
+        self.assertEqual(self.suggested_ids('ball'), [self.music.pk])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST).artist_profile
+        # Several tracks per release date, so pages split rows with equal dates
+        self.musics = [
+            Music.objects.create(
+                title=f'Track {index}', artist=self.artist, genre='rock' if index % 2 else 'jazz',
+                release_date=date(2024, 1, 1) + timedelta(days=index // 3)
+            )
+            for index in range(10)
+        ]
+
+    def walk(self, **params):
+        """Ids of every page of the catalog API, and the number of pages."""
+        music_ids, pages = [], 0
+        url = reverse('music_list_api') + '?' + urlencode({'limit': 3, **params})
+        while url:
+            response = self.client.get(url).json()
+            music_ids += [result['id'] for result in response['results']]
+            pages += 1
+            url = response['next']
+        return music_ids, pages
+
+    def test_pages_follow_the_release_date_then_id_order(self):
+        music_ids, pages = self.walk()
+        expected = sorted(self.musics, key=lambda music: (music.release_date, music.pk), reverse=True)
+        self.assertEqual(music_ids, [music.pk for music in expected])
+        self.assertEqual(pages, 4)
+
+        # The genre filter is kept in the next page URLs
+        self.assertEqual(self.walk(genre='rock')[0], [music.pk for music in expected if music.genre == 'rock'])
+
+    def test_search_results_are_paged_by_rank(self):
+        music_ids, _ = self.walk(search='track')
+        self.assertEqual(sorted(music_ids), sorted(music.pk for music in self.musics))
+        self.assertEqual(music_ids, search.search_ids('track'))
+
+    def test_new_rows_do_not_shift_the_next_pages(self):
+        first = self.client.get(reverse('music_list_api'), {'limit': 3}).json()
+        Music.objects.create(title='Newest', artist=self.artist, release_date=date(2025, 1, 1))
+        second = self.client.get(reverse('music_list_api'), {'limit': 3, 'cursor': first['next_cursor']}).json()
+        expected = sorted(self.musics, key=lambda music: (music.release_date, music.pk), reverse=True)
+        self.assertEqual(
+            [result['id'] for result in first['results'] + second['results']],
+            [music.pk for music in expected[:6]]
+        )
+
+    def test_invalid_cursors_are_not_found(self):
+        valid = pagination.encode_cursor([date(2024, 1, 2), self.musics[4].pk])
+        self.assertEqual(self.client.get(reverse('music_list_api'), {'cursor': valid}).status_code, 200)
+        for cursor in (
+            'not a cursor',
+            pagination.encode_cursor([self.musics[4].pk]),
+            pagination.encode_cursor(['yesterday', self.musics[4].pk]),
+            pagination.encode_cursor({'id': 1}),
+        ):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.client.get(reverse('music_list_api'), {'cursor': cursor}).status_code, 404)
+
+    def test_page_size_is_bounded(self):
+        factory = RequestFactory()
+        for limit, size in (('0', 1), ('5', 5), ('1000', pagination.MAX_PAGE_SIZE), ('many', 24)):
+            with self.subTest(limit=limit):
+                self.assertEqual(pagination.page_size(factory.get('/', {'limit': limit})), size)
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        self.artists = [
+            CustomUser.objects.create_user(f'artist{index}', user_type=CustomUser.ARTIST).artist_profile
+            for index in range(2)
+        ]
+
+    def create(self, genre, artist):
+        return Music.objects.create(title='Track', artist=artist, genre=genre, release_date=date.today())
+
+    def assert_counts(self, genres, artists):
+        artist_counts = facets.artist_counts([artist.pk for artist in self.artists])
+        self.assertEqual({genre: count for genre, count in facets.genre_counts().items() if count}, genres)
+        self.assertEqual(
+            {artist_id: count for artist_id, count in artist_counts.items() if count},
+            {artist.pk: count for artist, count in artists.items()}
+        )
+
+    def test_counts_follow_creates_edits_and_deletes(self):
+        first, second = self.artists
+        rock = self.create('rock', first)
+        jazz = self.create('jazz', first)
+        self.create('rock', second)
+        self.assert_counts({'rock': 2, 'jazz': 1}, {first: 2, second: 1})
+
+        rock.genre = 'pop'
+        rock.artist = second
+        rock.save()
+        self.assert_counts({'rock': 1, 'jazz': 1, 'pop': 1}, {first: 1, second: 2})
+
+        # Saves of other fields leave the counts, also from a stale instance
+        stale = Music.objects.get(pk=jazz.pk)
+        jazz.genre = 'pop'
+        jazz.save()
+        stale.title = 'Renamed'
+        stale.save(update_fields=['title'])
+        self.assert_counts({'rock': 1, 'pop': 2}, {first: 1, second: 2})
+
+        rock.delete()
+        self.assert_counts({'rock': 1, 'pop': 1}, {first: 1, second: 1})
+
+        second.user.delete()
+        self.assert_counts({'pop': 1}, {first: 1})
+        self.assertFalse(FacetCount.objects.filter(facet=FacetCount.ARTIST, value=str(second.pk)).exists())
+
+    def test_rebuild_recounts_bulk_changes(self):
+        self.create('rock', self.artists[0])
+        Music.objects.bulk_create(
+            Music(title='Track', artist=self.artists[1], genre='jazz', release_date=date.today()) for _ in range(3)
+        )
+        Music.objects.filter(genre='rock').update(genre='pop')
+
+        call_command('rebuild_facet_counts', stdout=io.StringIO())
+        self.assert_counts({'pop': 1, 'jazz': 3}, {self.artists[0]: 1, self.artists[1]: 3})
+
+
+MISSING_MODELS = Path(tempfile.gettempdir()) / 'mziktak-tests-no-models'
+
+
+@override_settings(
+    SIMILARITY_MODEL_PATH=MISSING_MODELS / 'item_similarity.npz',
+    SIMILAR_MUSIC_INDEX_PATH=MISSING_MODELS / 'similar_music.npz',
+    AUDIO_FEATURES_PATH=MISSING_MODELS / 'audio_features.npz'
+)
+class PrecomputeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        popularity.reset()
+        artist = CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST)
+        for index in range(5):
+            Music.objects.create(title=f'Track {index}', artist=artist.artist_profile, release_date=date.today())
+        self.users = [CustomUser.objects.create_user(f'listener{index}') for index in range(2)]
+
+    def test_users_invalidated_during_the_run_are_not_stored(self):
+        results = precompute.compute_batch([user.pk for user in self.users], limit=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            recommendation_cache.invalidate(self.users[1].pk)
+
+        self.assertEqual(precompute.store_batch(results, 3, timezone.now()), 1)
+        self.assertEqual(
+            list(PrecomputedRecommendations.objects.values_list('user_id', flat=True)),
+            [self.users[0].pk]
+        )
+        self.assertEqual(len(PrecomputedRecommendations.objects.get().music_ids), 3)
+
+
+@override_settings(
+    RECOMMENDATION_WEIGHTS={'genre': 1.0, 'artist': 1.0},
+    SIMILARITY_MODEL_PATH=MISSING_MODELS / 'item_similarity.npz',
+    AUDIO_FEATURES_PATH=MISSING_MODELS / 'audio_features.npz'
+)
+class RecommendationRankingTests(TestCase):
+    def setUp(self):
+        popularity.reset()
+        self.addCleanup(popularity.reset)
+        artists = [
+            CustomUser.objects.create_user(f'artist{index}', user_type=CustomUser.ARTIST).artist_profile
+            for index in range(2)
+        ]
+        self.user = CustomUser.objects.create_user('listener')
+        liked = self.create(artists[0], 'rock')
+        UserMusicPreference.objects.create(user=self.user, music=liked, rating=5)
+        ListeningHistory.objects.create(user=self.user, music=liked)
+
+        # Same artist and genre, same genre only, same artist only, neither
+        self.both = self.create(artists[0], 'rock')
+        self.genre_only = [self.create(artists[1], 'rock') for _ in range(2)]
+        self.artist_only = [self.create(artists[0], 'jazz') for _ in range(2)]
+        self.other = self.create(artists[1], 'jazz')
+        self.tied = sorted(self.genre_only + self.artist_only, key=lambda music: -music.pk)
+
+    def create(self, artist, genre):
+        return Music.objects.create(title='Track', artist=artist, genre=genre, release_date=date.today())
+
+    def test_ties_go_to_the_highest_ids(self):
+        # The track proposed by both strategies first, then the ties newest first
+        self.assertEqual(get_recommendations(self.user, limit=10, fill=False), [self.both] + self.tied)
+        self.assertEqual(get_recommendations(self.user, limit=3, fill=False), [self.both] + self.tied[:2])
+
+    def test_popular_tracks_fill_the_rest(self):
+        self.assertEqual(get_recommendations(self.user, limit=7), [self.both] + self.tied + [self.other])
+
+
+@override_settings(
+    SIMILARITY_MODEL_PATH=MISSING_MODELS / 'item_similarity.npz',
+    SIMILAR_MUSIC_INDEX_PATH=MISSING_MODELS / 'similar_music.npz',
+    AUDIO_FEATURES_PATH=MISSING_MODELS / 'audio_features.npz'
+)
+class QueryBudgetTests(TestCase):
+    """
+    Each view runs the same number of queries whatever the number of
+    tracks, favorites and playlists. A view going over its budget likely
+    queries once per row again.
+    """
+    # (user, view) -> queries, once the caches were filled by a first
+    # request. Reads of the database cache count as queries.
+    BUDGETS = {
+        (None, 'home'): 4,
+        (None, 'music_list'): 3,
+        (None, 'music_list_api'): 1,
+        (None, 'playlist_list'): 1,
+        (None, 'playlist_detail'): 2,
+        (None, 'music_detail'): 1,
+        ('listener', 'home'): 6,
+        ('listener', 'music_list'): 5,
+        ('listener', 'favorite_list'): 3,
+        ('listener', 'favorite_music_api'): 3,
+        ('listener', 'playlist_list'): 3,
+        ('listener', 'playlist_list_api'): 3,
+        ('listener', 'playlist_detail'): 4,
+        ('listener', 'music_detail'): 8,
+        ('listener', 'dashboard'): 4,
+        ('artist', 'dashboard'): 8,
+        ('admin', 'dashboard'): 9,
+    }
+
+    def setUp(self):
+        cache.clear()
+        popularity.reset()
+
+    def create_rows(self, rows):
+        self.users = {
+            'admin': CustomUser.objects.create_user('admin', user_type=CustomUser.ADMIN),
+            'artist': CustomUser.objects.create_user('artist', user_type=CustomUser.ARTIST),
+            'listener': CustomUser.objects.create_user('listener'),
+        }
+        today = date.today()
+        musics = Music.objects.bulk_create(
+            Music(
+                title=f'Track {index}',
+                artist=self.users['artist'].artist_profile,
+                genre='rock',
+                release_date=today - timedelta(days=index),
+                audio_file=f'music/track{index}.mp3'
+            )
+            for index in range(rows)
+        )
+        self.music = musics[0]
+        UserMusicPreference.objects.bulk_create(
+            UserMusicPreference(user=self.users['listener'], music=music, favorite=True) for music in musics
+        )
+        for user in self.users.values():
+            playlists = Playlist.objects.bulk_create(
+                Playlist(name=f'Playlist {index}', creator=user) for index in range(rows)
+            )
+            Playlist.music.through.objects.bulk_create(
+                Playlist.music.through(playlist=playlist, music=music)
+                for playlist in playlists[:3]
+                for music in musics
+            )
+        self.playlist = playlists[0]
+        popularity.get_lists()
+
+    def url(self, view):
+        if view == 'playlist_detail':
+            return reverse(view, args=[self.playlist.pk])
+        if view == 'music_detail':
+            return reverse(view, args=[self.music.pk])
+        return reverse(view)
+
+    def assert_budgets(self, rows):
+        self.create_rows(rows)
+        for (username, view), budget in self.BUDGETS.items():
+            with self.subTest(user=username, view=view, rows=rows):
+                self.client.logout()
+                if username:
+                    self.client.force_login(self.users[username])
+                url = self.url(view)
+                self.assertEqual(self.client.get(url).status_code, 200)
+                with self.assertNumQueries(budget):
+                    self.client.get(url)
+
+    def test_budgets_with_10_rows(self):
+        self.assert_budgets(10)
+
+    def test_budgets_with_1000_rows(self):
+        self.assert_budgets(1000)
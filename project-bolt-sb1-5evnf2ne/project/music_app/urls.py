@@ -8,10 +8,12 @@ urlpatterns = [
     # User interactions
     path('music/<int:pk>/rate/', views.rate_music, name='rate_music'),
     path('music/<int:pk>/favorite/', views.toggle_favorite, name='toggle_favorite'),
+    path('music/<int:pk>/heartbeat/', views.playback_heartbeat, name='playback_heartbeat'),
     path('favorites/', views.favorite_music_list, name='favorite_list'),
 
     path('', views.home, name='home'),
     path('music/', views.music_list, name='music_list'),
+    path('music/suggest/', views.music_suggest, name='music_suggest'),
     path('music/<int:pk>/', views.music_detail, name='music_detail'),
     path('music/<int:pk>/statistics/', views.music_statistics, name='music_statistics'),
     path('music/upload/', views.upload_music, name='upload_music'),
@@ -22,4 +24,12 @@ urlpatterns = [
     path('playlist/create/', views.create_playlist, name='create_playlist'),
     path('playlist/edit/<int:pk>/', views.edit_playlist, name='edit_playlist'),
     path('playlist/delete/<int:pk>/', views.delete_playlist, name='delete_playlist'),
+
+    # JSON listings, paginated with the cursor of each page
+    path('api/music/', views.music_list_api, name='music_list_api'),
+    path('api/favorites/', views.favorite_music_api, name='favorite_music_api'),
+    path('api/playlists/', views.playlist_list_api, name='playlist_list_api'),
+
+    # Data exports
+    path('export/<str:dataset>/', views.export_data, name='export_data'),
 ]
\ No newline at end of file
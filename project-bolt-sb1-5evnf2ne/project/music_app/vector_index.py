@@ -0,0 +1,361 @@
+"""
+Vector index of the tracks for the "similar music" of the detail page.
+
+Every track gets an embedding made of its co-listening vector (its factors
+in the trained matrix factorization model) and of its genre, normalized so
+that a dot product is a cosine similarity. Tracks of the same artist, matched
+on the exact artist id kept next to the embeddings, get a bonus on top of
+their cosine. Search is a brute-force NumPy top-k; large catalogs can also be
+split into k-means partitions, and only the partitions closest to the query
+are scanned.
+
+build_index() rebuilds everything. Changes between two builds are appended
+to a small change log next to the index: add_track() records a new track,
+embedded with its genre alone since it has no plays yet, or the new genre
+and artist of an edited one, and remove_track() a deleted one. Appending a
+record costs the same whatever the catalog size, and workers read only the
+records added since their last read, without reloading the index itself.
+The next build folds the log in.
+"""
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .models import Music
+from . import factorization
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+GENRES = [code for code, _ in Music.GENRE_CHOICES]
+
+# Share of each part in the embedding
+CO_LISTENING_WEIGHT = 1.0
+GENRE_WEIGHT = 0.5
+
+# Added to the cosine of the tracks of the same artist
+SAME_ARTIST_BONUS = 0.3
+
+# Rows scored per matrix product while partitioning
+CHUNK_ROWS = 10000
+
+# Change log records: music id (negative for a removal), genre position and
+# artist id
+LOG_RECORD = struct.Struct('<qqq')
+
+
+def _index_path():
+    return Path(getattr(settings, 'SIMILAR_MUSIC_INDEX_PATH', Path(settings.BASE_DIR) / 'var' / 'models' / 'similar_music.npz'))
+
+
+def _log_path():
+    return _index_path().with_suffix('.log')
+
+
+def _probes():
+    return getattr(settings, 'SIMILAR_MUSIC_PROBES', 8)
+
+
+def _genre_vector(genre):
+    vector = np.zeros(len(GENRES), dtype=np.float32)
+    if genre in GENRES:
+        vector[GENRES.index(genre)] = GENRE_WEIGHT
+    return vector
+
+
+def _normalized(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def _with_genre(embedding, genre):
+    """An embedding with its genre part replaced, its co-listening part kept."""
+    co_listening = embedding[:-len(GENRES)]
+    norm = np.linalg.norm(co_listening)
+    if norm > 0:
+        co_listening = co_listening * (CO_LISTENING_WEIGHT / norm)
+    return _normalized(np.concatenate([co_listening, _genre_vector(genre)]))
+
+
+def _embed(rows, factor_model):
+    """Embeddings of (music_id, genre, artist_id) rows."""
+    factors = factor_model.item_factors.shape[1] if factor_model is not None else 0
+    embeddings = np.zeros((len(rows), factors + len(GENRES)), dtype=np.float32)
+    for position, (_, genre, _) in enumerate(rows):
+        embeddings[position, factors:] = _genre_vector(genre)
+
+    if factors and rows:
+        music_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        positions = np.searchsorted(factor_model.music_ids, music_ids)
+        known = positions < len(factor_model.music_ids)
+        known[known] = factor_model.music_ids[positions[known]] == music_ids[known]
+        embeddings[known, :factors] = CO_LISTENING_WEIGHT * _normalized(
+            np.asarray(factor_model.item_factors[positions[known]], dtype=np.float32)
+        )
+    return _normalized(embeddings)
+
+
+def _kmeans(vectors, count, iterations=10, seed=0):
+    """Spherical k-means: partition centroids and the partition of each vector."""
+    random = np.random.default_rng(seed)
+    centroids = vectors[random.choice(len(vectors), count, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        # Empty partitions keep their centroid
+        filled = np.bincount(assignments, minlength=count) > 0
+        centroids[filled] = _normalized(sums[filled])
+    return centroids, _assign(vectors, centroids)
+
+
+def _assign(vectors, centroids):
+    return np.concatenate([
+        np.argmax(vectors[start:start + CHUNK_ROWS] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), CHUNK_ROWS)
+    ] or [np.empty(0, dtype=np.int64)])
+
+
+def _save(path, arrays):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    with open(temporary, 'wb') as index_file:
+        np.savez(index_file, **arrays)
+    os.replace(temporary, path)
+
+
+def build_index(partitions=None):
+    """
+    Rebuild the index of every track. Without a number of partitions, the
+    catalog is partitioned once it reaches SIMILAR_MUSIC_PARTITION_THRESHOLD
+    tracks. Returns the number of tracks indexed.
+    """
+    rows = list(Music.objects.order_by('id').values_list('id', 'genre', 'artist_id'))
+    embeddings = _embed(rows, factorization.get_model())
+
+    if partitions is None and len(rows) >= getattr(settings, 'SIMILAR_MUSIC_PARTITION_THRESHOLD', 20000):
+        partitions = int(np.sqrt(len(rows)))
+    partitions = min(partitions or 0, len(rows))
+    if partitions:
+        centroids, assignments = _kmeans(embeddings, partitions)
+    else:
+        centroids = np.empty((0, embeddings.shape[1]), dtype=np.float32)
+        assignments = np.zeros(len(rows), dtype=np.int64)
+
+    indexed = {music_id: (_genre_position(genre), artist_id) for music_id, genre, artist_id in rows}
+    with _locked():
+        # Keep the changes this build did not see: tracks uploaded, edited
+        # or deleted since the catalog was read
+        pending = [
+            record for record in _read_log(_log_path())
+            if (record[0] > 0 and indexed.get(record[0]) != tuple(record[1:])) or -record[0] in indexed
+        ]
+        _save(_index_path(), {
+            'music_ids': np.array([row[0] for row in rows], dtype=np.int64),
+            'artist_ids': np.array([row[2] for row in rows], dtype=np.int64),
+            'embeddings': embeddings,
+            'centroids': centroids,
+            'assignments': assignments,
+        })
+        temporary = _log_path().with_suffix('.log.tmp')
+        with open(temporary, 'wb') as log_file:
+            log_file.write(b''.join(LOG_RECORD.pack(*record) for record in pending))
+        os.replace(temporary, _log_path())
+    return len(rows)
+
+
+def _read_log(path, offset=0):
+    """Records of the change log from a byte offset."""
+    try:
+        with open(path, 'rb') as log_file:
+            log_file.seek(offset)
+            data = log_file.read()
+    except FileNotFoundError:
+        return []
+    # A record being appended is read on the next call
+    data = data[:len(data) - len(data) % LOG_RECORD.size]
+    return list(LOG_RECORD.iter_unpack(data))
+
+
+def _append_to_log(record):
+    with _locked():
+        if not _index_path().exists():
+            # Not built yet: the first build indexes the whole catalog
+            return
+        with open(_log_path(), 'ab') as log_file:
+            log_file.write(LOG_RECORD.pack(*record))
+
+
+def _genre_position(genre):
+    return GENRES.index(genre) if genre in GENRES else -1
+
+
+def add_track(music):
+    """Add a new track, or the genre and artist of an edited one, to the index through the change log."""
+    _append_to_log((music.pk, _genre_position(music.genre), music.artist_id))
+
+
+def remove_track(music_id):
+    """Remove a deleted track from the index, through the change log."""
+    _append_to_log((-music_id, -1, 0))
+
+
+class _locked:
+    """Serialize writers of the index file across processes."""
+
+    def __enter__(self):
+        path = _index_path().with_suffix('.lock')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock_file = open(path, 'w')
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock_file.close()
+
+
+class VectorIndex:
+    def __init__(self, music_ids, artist_ids, embeddings, centroids, assignments):
+        self.music_ids = music_ids
+        self.artist_ids = artist_ids
+        self.embeddings = embeddings
+        self.centroids = centroids
+        self.assignments = assignments
+        self.positions = {int(music_id): position for position, music_id in enumerate(music_ids)}
+        # Rows of each partition, contiguous
+        self.partition_rows = np.argsort(assignments, kind='stable')
+        self.partition_ptr = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=len(centroids)))))
+        # Changes read from the log: added tracks are scanned on every search
+        self.added_ids = []
+        self.added_artist_ids = []
+        self.added_embeddings = np.empty((0, embeddings.shape[1]), dtype=np.float32)
+        self.added_positions = {}
+        self.removed = set()
+        self.log_offset = 0
+
+    def apply_log(self, path):
+        """Apply the records appended to the change log since the last call."""
+        records = _read_log(path, self.log_offset)
+        self.log_offset += len(records) * LOG_RECORD.size
+        added = []
+        for music_id, genre, artist_id in records:
+            genre = GENRES[genre] if genre >= 0 else None
+            if music_id < 0:
+                self.removed.add(-music_id)
+            elif music_id in self.positions:
+                # An edited track keeps its co-listening factors
+                position = self.positions[music_id]
+                self.embeddings[position] = _with_genre(self.embeddings[position], genre)
+                self.artist_ids[position] = artist_id
+            elif music_id in self.added_positions:
+                position = self.added_positions[music_id]
+                self.added_embeddings[position] = _with_genre(self.added_embeddings[position], genre)
+                self.added_artist_ids[position] = artist_id
+            else:
+                self.added_positions[music_id] = len(self.added_ids) + len(added)
+                # New tracks have zeros in place of co-listening factors
+                added.append(_with_genre(np.zeros(self.embeddings.shape[1], dtype=np.float32), genre))
+                self.added_ids.append(music_id)
+                self.added_artist_ids.append(artist_id)
+        if added:
+            self.added_embeddings = np.vstack([self.added_embeddings, *added])
+
+    @classmethod
+    def load(cls, path):
+        """The index saved at path, or None for an index built before artist ids were kept."""
+        with np.load(path) as data:
+            if 'artist_ids' not in data.files:
+                return None
+            return cls(data['music_ids'], data['artist_ids'], data['embeddings'], data['centroids'], data['assignments'])
+
+    def similar(self, music_id, limit=5):
+        """Closest indexed tracks, best first, as (music_id, score) pairs."""
+        if music_id in self.removed:
+            return []
+        position = self.positions.get(music_id)
+        if position is not None:
+            query, artist_id = self.embeddings[position], self.artist_ids[position]
+        elif music_id in self.added_positions:
+            query = self.added_embeddings[self.added_positions[music_id]]
+            artist_id = self.added_artist_ids[self.added_positions[music_id]]
+        else:
+            return []
+
+        if len(self.centroids):
+            probes = min(_probes(), len(self.centroids))
+            nearest = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+            rows = np.concatenate([
+                self.partition_rows[self.partition_ptr[partition]:self.partition_ptr[partition + 1]]
+                for partition in nearest
+            ])
+        else:
+            rows = np.arange(len(self.music_ids))
+
+        music_ids = np.concatenate([self.music_ids[rows], np.array(self.added_ids, dtype=np.int64)])
+        scores = np.concatenate([self.embeddings[rows] @ query, self.added_embeddings @ query])
+        artist_ids = np.concatenate([self.artist_ids[rows], np.array(self.added_artist_ids, dtype=np.int64)])
+        scores += SAME_ARTIST_BONUS * (artist_ids == artist_id)
+        kept = music_ids != music_id
+        if self.removed:
+            kept &= ~np.isin(music_ids, list(self.removed))
+        music_ids, scores = music_ids[kept], scores[kept]
+        if not len(music_ids):
+            return []
+        limit = min(limit, len(music_ids))
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(music_ids[row]), float(scores[row])) for row in best]
+
+
+_loaded = {'index': None, 'mtime': None}
+
+
+def get_index():
+    """
+    The index of this worker process, reloaded when the file changes, with
+    the changes appended to the log since the last call, or None.
+    """
+    path = _index_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    try:
+        log_size = os.stat(_log_path()).st_size
+    except FileNotFoundError:
+        log_size = 0
+
+    index = _loaded['index']
+    # A build rewrites the log: start over from its beginning
+    if _loaded['mtime'] != mtime or (index is not None and log_size < index.log_offset):
+        index = VectorIndex.load(path)
+        _loaded.update(index=index, mtime=mtime)
+    if index is not None and log_size > index.log_offset:
+        index.apply_log(_log_path())
+    return index
+
+
+def similar_music(music, limit=5):
+    """
+    Tracks most similar to a track, loaded in one query. Until the index is
+    built, or for a track it does not know, tracks of the same artist and
+    then of the same genre are returned, newest first.
+    """
+    index = get_index()
+    ranked = index.similar(music.pk, limit=limit) if index is not None else []
+    if not ranked:
+        similar = list(Music.objects.filter(artist_id=music.artist_id).exclude(id=music.id).select_related('artist')[:limit])
+        if len(similar) < limit:
+            similar += Music.objects.filter(genre=music.genre).exclude(
+                id__in=[music.id] + [track.id for track in similar]
+            ).select_related('artist')[:limit - len(similar)]
+        return similar
+
+    musics = Music.objects.select_related('artist').in_bulk([music_id for music_id, _ in ranked])
+    return [musics[music_id] for music_id, _ in ranked if music_id in musics]
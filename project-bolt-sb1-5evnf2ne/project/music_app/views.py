@@ -1,21 +1,32 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponseForbidden, JsonResponse
+from django.http import HttpResponseForbidden, JsonResponse, StreamingHttpResponse, Http404
 from .models import Music, Playlist, UserMusicPreference, ListeningHistory
 from .forms import MusicUploadForm, PlaylistForm
 from users.models import CustomUser
-from django.db.models import Q
-from .recommendations import get_recommendations, update_user_preferences
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from .recommendations import cached_recommendations, update_user_preferences
+from . import exports, facets, listeners, pagination, playback, popularity, recommendation_cache, rollups, search, suggest, vector_index
 
 
 def home(request):
-    recent_music = Music.objects.all().order_by('-release_date')[:5]
+    recent_music = Music.objects.select_related('artist').order_by('-release_date', '-id')[:5]
     
     # Get personalized recommendations for authenticated users
     recommended_music = []
     if request.user.is_authenticated:
-        recommended_music = get_recommendations(request.user, limit=5)
+        recommended_music = cached_recommendations(request.user, limit=5)
+    
+    # Popular tracks for visitors, and for users with too few recommendations
+    if len(recommended_music) < 5:
+        recommended_music += popularity.popular_music(
+            limit=5 - len(recommended_music),
+            exclude={music.id for music in recommended_music}
+        )
     
     # For non-authenticated users, show default playlist
     default_playlist = None
@@ -23,7 +34,7 @@ def home(request):
         # Try to get a default playlist, or create one if needed
         try:
             admin_user = CustomUser.objects.filter(user_type=CustomUser.ADMIN).first()
-            default_playlist = Playlist.objects.filter(creator=admin_user).first()
+            default_playlist = Playlist.objects.with_summary().select_related('creator').filter(creator=admin_user).first()
         except:
             pass
     
@@ -34,42 +45,97 @@ def home(request):
     })
 
 
-def music_list(request):
+def _music_json(music):
+    return {
+        'id': music.id,
+        'title': music.title,
+        'artist': music.artist.full_name,
+        'genre': music.genre,
+        'duration': music.duration.total_seconds() if music.duration else None,
+        'release_date': music.release_date.isoformat(),
+        'url': reverse('music_detail', args=[music.id]),
+        'cover_image': music.cover_image.url if music.cover_image else None,
+    }
+
+
+def _page_json(request, page, serialize):
+    return JsonResponse({
+        'results': [serialize(item) for item in page],
+        'next_cursor': page.next_cursor,
+        'next': pagination.next_url(request, page),
+    })
+
+
+def _library_page(request):
     genre_filter = request.GET.get('genre', '')
     search_query = request.GET.get('search', '')
     
-    music = Music.objects.all()
+    music = Music.objects.select_related('artist')
     
-    if genre_filter:
+    keys = pagination.CATALOG_KEYS
+    if search_query:
+        # Le filtre de genre est appliqué dans l'index, avant la limite
+        music = search.search(music, search_query, genre=genre_filter or None)
+        keys = pagination.SEARCH_KEYS
+    elif genre_filter:
         music = music.filter(genre=genre_filter)
     
-    if search_query:
-        music = music.filter(
-            Q(title__icontains=search_query) | 
-            Q(artist__full_name__icontains=search_query)
-        )
+    return pagination.paginate(music, keys, request.GET.get('cursor'), pagination.page_size(request))
+
+
+def music_list(request):
+    genre_filter = request.GET.get('genre', '')
+    search_query = request.GET.get('search', '')
+    page = _library_page(request)
+    
+    # Popular tracks of the genre above the first page, unless searching
+    popular_music = []
+    if not search_query and not request.GET.get('cursor'):
+        popular_music = popularity.popular_music(genre_filter or None, limit=6)
+    
+    # Nombre de morceaux par genre, pour la recherche en cours
+    genre_counts = facets.genre_counts(search_query)
     
     return render(request, 'music_app/music_list.html', {
-        'music_list': music,
-        'genres': dict(Music.GENRE_CHOICES),
+        'music_list': page,
+        'next_url': pagination.next_url(request, page),
+        'popular_music': popular_music,
+        'genres': facets.genre_choices(genre_counts),
+        'total_count': sum(genre_counts.values()),
         'current_genre': genre_filter,
         'search_query': search_query
     })
 
 
+def music_list_api(request):
+    return _page_json(request, _library_page(request), _music_json)
+
+
+def music_suggest(request):
+    # Suggestions de saisie, servies depuis l'index en mémoire
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    return JsonResponse({'query': query, 'suggestions': suggest.suggest(query, limit)})
+
+
 def music_detail(request, pk):
-    music = get_object_or_404(Music, pk=pk)
+    music = get_object_or_404(Music.objects.select_related('artist'), pk=pk)
     
     # Get playlists containing this music, if user is authenticated
     user_playlists = []
+    playlist_choices = []
     user_preference = None
     similar_music = []
     
     if request.user.is_authenticated:
-        user_playlists = Playlist.objects.filter(
+        user_playlists = Playlist.objects.with_summary().filter(
             creator=request.user,
             music=music
         )
+        playlist_choices = Playlist.objects.filter(creator=request.user).only('id', 'name')
         
         # Get or create user preference
         user_preference, _ = UserMusicPreference.objects.get_or_create(
@@ -77,17 +143,16 @@ def music_detail(request, pk):
             music=music
         )
         
-        # Get similar music based on genre and artist
-        similar_music = Music.objects.filter(
-            Q(genre=music.genre) | Q(artist=music.artist)
-        ).exclude(id=music.id)[:5]
-        
-        # Record listening history
-        update_user_preferences(request.user, music)
+        # Get similar music ranked by the vector index
+        similar_music = vector_index.similar_music(music, limit=5)
+
+        # Les écoutes sont enregistrées par les heartbeats du lecteur
+        playback.finalize_stale_sessions(request.user)
     
     return render(request, 'music_app/music_detail.html', {
         'music': music,
         'user_playlists': user_playlists,
+        'playlist_choices': playlist_choices,
         'user_preference': user_preference,
         'similar_music': similar_music
     })
@@ -165,20 +230,48 @@ def delete_music(request, pk):
     return render(request, 'music_app/music_confirm_delete.html', {'music': music})
 
 
-def playlist_list(request):
+def _playlist_json(playlist):
+    return {
+        'id': playlist.id,
+        'name': playlist.name,
+        'creator': playlist.creator.username,
+        'total_duration': playlist.total_duration.total_seconds() if playlist.total_duration else None,
+        'created_at': playlist.created_at.isoformat(),
+        'url': reverse('playlist_detail', args=[playlist.id]),
+    }
+
+
+def _playlists_page(request):
     if request.user.is_authenticated:
         # Show user's playlists
         playlists = Playlist.objects.filter(creator=request.user)
-    else:
-        # Show some public playlists for non-authenticated users
-        playlists = Playlist.objects.all()[:5]
+        return pagination.paginate(
+            playlists.with_summary().select_related('creator'),
+            pagination.PLAYLIST_KEYS,
+            request.GET.get('cursor'),
+            pagination.page_size(request)
+        )
+    # Show some public playlists for non-authenticated users
+    return pagination.Page(list(Playlist.objects.with_summary().select_related('creator')[:5]), None)
+
+
+def playlist_list(request):
+    page = _playlists_page(request)
     
-    return render(request, 'music_app/playlist_list.html', {'playlists': playlists})
+    return render(request, 'music_app/playlist_list.html', {
+        'playlists': page,
+        'next_url': pagination.next_url(request, page)
+    })
+
+
+def playlist_list_api(request):
+    return _page_json(request, _playlists_page(request), _playlist_json)
 
 
 def playlist_detail(request, pk):
-    playlist = get_object_or_404(Playlist, pk=pk)
-    return render(request, 'music_app/playlist_detail.html', {'playlist': playlist})
+    playlist = get_object_or_404(Playlist.objects.select_related('creator'), pk=pk)
+    tracks = list(playlist.music.select_related('artist'))
+    return render(request, 'music_app/playlist_detail.html', {'playlist': playlist, 'tracks': tracks})
 
 
 @login_required
@@ -193,6 +286,7 @@ def create_playlist(request):
             form.save_m2m()
             # Update the duration
             playlist.update_duration()
+            recommendation_cache.invalidate(request.user.pk)
             messages.success(request, 'Playlist created successfully!')
             return redirect('playlist_detail', pk=playlist.pk)
     else:
@@ -218,6 +312,7 @@ def edit_playlist(request, pk):
             form.save()
             # Update the duration
             playlist.update_duration()
+            recommendation_cache.invalidate(playlist.creator_id)
             messages.success(request, 'Playlist updated successfully!')
             return redirect('playlist_detail', pk=playlist.pk)
     else:
@@ -240,6 +335,7 @@ def delete_playlist(request, pk):
     
     if request.method == 'POST':
         playlist.delete()
+        recommendation_cache.invalidate(playlist.creator_id)
         messages.success(request, 'Playlist deleted successfully!')
         return redirect('playlist_list')
     
@@ -263,17 +359,33 @@ def rate_music(request, pk):
     return JsonResponse({'status': 'error'}, status=400)
 
 
+@login_required
+def playback_heartbeat(request, pk):
+    # Ping du lecteur pendant la lecture, ajouté à sa session ouverte
+    if request.method == 'POST':
+        session_id = request.POST.get('session', '')
+        event = request.POST.get('event', 'progress')
+        if session_id and len(session_id) <= 64 and event in playback.EVENTS:
+            listened = playback.heartbeat(request.user, pk, session_id, event)
+            return JsonResponse({'status': 'success', 'listened': round(listened)})
+
+    return JsonResponse({'status': 'error'}, status=400)
+
+
 @login_required
 def toggle_favorite(request, pk):
     if request.method == 'POST':
         music = get_object_or_404(Music, pk=pk)
-        preference, created = UserMusicPreference.objects.get_or_create(
-            user=request.user,
-            music=music
-        )
-        
-        preference.favorite = not preference.favorite
-        preference.save()
+        # The favorite counter is updated with the preference
+        with transaction.atomic():
+            preference, created = UserMusicPreference.objects.select_for_update().get_or_create(
+                user=request.user,
+                music=music
+            )
+
+            preference.favorite = not preference.favorite
+            preference.save()
+            recommendation_cache.invalidate(request.user.pk)
         
         return JsonResponse({
             'status': 'success',
@@ -286,7 +398,7 @@ def toggle_favorite(request, pk):
 @login_required
 def get_recommendations_view(request):
     limit = int(request.GET.get('limit', 10))
-    recommendations = get_recommendations(request.user, limit=limit)
+    recommendations = cached_recommendations(request.user, limit=limit)
     
     return render(request, 'music_app/recommendations.html', {
         'recommendations': recommendations
@@ -300,13 +412,27 @@ def favorite_music_list(request):
         messages.warning(request, 'You must be logged in to view your favorites.')
         return redirect('login')
     
-    favorites = Music.objects.filter(usermusicpreference__user=request.user, usermusicpreference__favorite=True)
+    page = _favorites_page(request)
     
     return render(request, 'music_app/favorite_music_list.html', {
-        'favorites': favorites
+        'favorites': page,
+        'next_url': pagination.next_url(request, page)
     })
 
 
+def _favorites_page(request):
+    favorites = Music.objects.filter(
+        usermusicpreference__user=request.user,
+        usermusicpreference__favorite=True
+    ).select_related('artist')
+    return pagination.paginate(favorites, pagination.CATALOG_KEYS, request.GET.get('cursor'), pagination.page_size(request))
+
+
+@login_required
+def favorite_music_api(request):
+    return _page_json(request, _favorites_page(request), _music_json)
+
+
 def music_statistics(request, pk):
     # Affiche les statistiques détaillées d'une musique
     music = get_object_or_404(Music, pk=pk)
@@ -316,6 +442,37 @@ def music_statistics(request, pk):
         messages.warning(request, 'You must be logged in to view statistics.')
         return redirect('login')
     
+    # Tendance des écoutes lue dans les agrégats horaires et journaliers
     return render(request, 'music_app/music_statistics.html', {
-        'music': music
-    })
\ No newline at end of file
+        'music': music,
+        'statistics': music.get_statistics().with_shards(),
+        'daily_plays': rollups.daily_plays(days=30, music=music),
+        'plays_this_week': rollups.plays_since(timezone.now() - timedelta(days=7), music=music),
+        'listeners_last_30_days': listeners.unique_listeners_last_days(music, days=30)
+    })
+
+
+@login_required
+def export_data(request, dataset):
+    # Export en flux de l'historique, des préférences ou des statistiques
+    if not (request.user.is_admin() or request.user.is_staff):
+        return HttpResponseForbidden("You don't have permission to export data.")
+
+    export_format = request.GET.get('format', 'csv')
+    if dataset not in exports.DATASETS or export_format not in exports.FORMATS:
+        raise Http404
+
+    try:
+        start = exports.parse_date(request.GET.get('start'))
+        end = exports.parse_date(request.GET.get('end'), end=True)
+        artist_id = int(request.GET['artist']) if request.GET.get('artist') else None
+    except ValueError:
+        return JsonResponse({'status': 'error'}, status=400)
+
+    columns, rows = exports.export_rows(dataset, start=start, end=end, artist_id=artist_id)
+    response = StreamingHttpResponse(
+        exports.render(export_format, columns, rows),
+        content_type=exports.FORMATS[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{export_format}"'
+    return response
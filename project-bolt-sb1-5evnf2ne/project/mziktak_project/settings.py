@@ -20,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.humanize',
     'crispy_forms',
     'crispy_bootstrap5',
     'music_app',
@@ -66,6 +67,18 @@ DATABASES = {
     }
 }
 
+# The cache holds state every worker process must see: recommendation cache
+# versions. The database cache is shared without an extra service (its table
+# is created by `manage.py migrate`); Redis or Memcached can replace it. A
+# per-process cache (LocMemCache) would let each worker serve its own stale
+# copy.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'mziktak_cache',
+    }
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -108,6 +121,106 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Play events are buffered on disk and written to the listening history in
+# batches by `manage.py flush_play_buffer`, outside of the requests. Run it
+# with --watch as a background worker, which flushes once BATCH_SIZE plays
+# are waiting or the oldest one is older than FLUSH_INTERVAL seconds, or
+# periodically from cron.
+PLAY_BUFFER_ENABLED = True
+PLAY_BUFFER_DIR = BASE_DIR / 'var' / 'play_buffer'
+PLAY_BUFFER_BATCH_SIZE = 100
+PLAY_BUFFER_FLUSH_INTERVAL = 30
+
+# Play counters of a track can be spread over several rows so that
+# concurrent listeners of a hot track do not all update the same row. 0
+# writes to MusicStatistics directly. With shards, run
+# `manage.py fold_statistics_shards` periodically.
+STATISTICS_COUNTER_SHARDS = 0
+STATISTICS_SHARD_CACHE_TIMEOUT = 5
+
+# Listening history older than the retention period is moved to compressed
+# monthly archive files by `manage.py archive_listening_history`
+LISTENING_HISTORY_RETENTION_DAYS = 180
+LISTENING_ARCHIVE_DIR = BASE_DIR / 'var' / 'listening_archive'
+
+# Players ping the server every PLAYBACK_HEARTBEAT_INTERVAL seconds while a
+# track plays (keep in sync with static/js/playback.js). A session that stops
+# pinging for PLAYBACK_SESSION_TIMEOUT seconds is recorded as one play, if it
+# lasted at least PLAYBACK_MIN_LISTEN_SECONDS. Run
+# `manage.py finalize_playback_sessions` every few minutes to record the
+# sessions of users who do not come back.
+PLAYBACK_HEARTBEAT_INTERVAL = 15
+PLAYBACK_SESSION_TIMEOUT = 60
+PLAYBACK_MIN_LISTEN_SECONDS = 5
+
+# Item-item similarity model built by `manage.py build_similarity_model`.
+# Rebuild it periodically (e.g. nightly); each worker reloads it when the
+# file changes.
+SIMILARITY_MODEL_PATH = BASE_DIR / 'var' / 'models' / 'item_similarity.npz'
+
+# Matrix factorization model trained by `manage.py train_recommender`. Each
+# training writes a new version directory and switches manifest.json to it;
+# workers memory-map the factors and pick up new versions on their own.
+RECOMMENDER_MODEL_DIR = BASE_DIR / 'var' / 'models' / 'als'
+
+# Vector index of the tracks for "similar music", built by
+# `manage.py build_similar_music_index`. Uploads, edits and deletes until the
+# next build go to a change log next to it, which workers read incrementally.
+# From SIMILAR_MUSIC_PARTITION_THRESHOLD tracks it is split into k-means
+# partitions and a search scans the SIMILAR_MUSIC_PROBES closest ones.
+SIMILAR_MUSIC_INDEX_PATH = BASE_DIR / 'var' / 'models' / 'similar_music.npz'
+SIMILAR_MUSIC_PARTITION_THRESHOLD = 20000
+SIMILAR_MUSIC_PROBES = 8
+
+# Content features of the audio files (metadata and spectral summaries),
+# extracted by `manage.py extract_audio_features`. They let tracks nobody has
+# listened to yet be recommended by their sound. Uploads and deletes are
+# appended to a change log next to the file, which the command folds in;
+# run it with --missing periodically (e.g. nightly).
+AUDIO_FEATURES_PATH = BASE_DIR / 'var' / 'models' / 'audio_features.npz'
+
+# Popular tracks overall and per genre, the fallback of home, the library and
+# recommendations when personal signal is thin. Plays of the last
+# POPULARITY_WINDOW_DAYS count half as much every POPULARITY_HALF_LIFE_DAYS;
+# each worker keeps the top POPULARITY_TOP_N in memory and recomputes them
+# every POPULARITY_REFRESH_SECONDS.
+POPULARITY_HALF_LIFE_DAYS = 7
+POPULARITY_WINDOW_DAYS = 90
+POPULARITY_TOP_N = 50
+POPULARITY_REFRESH_SECONDS = 300
+
+# Rows per page of the catalog, favorites, playlists and dashboard
+# listings, which are paginated by cursor
+PAGE_SIZE = 24
+
+# Tracks returned by a full-text search of the catalog, best ranked first
+SEARCH_MAX_RESULTS = 500
+
+# Typeahead suggestions are served from a prefix index held by each worker.
+# Changes made by a worker are applied to its index at once; the other
+# workers rebuild theirs every SUGGEST_REFRESH_SECONDS.
+SUGGEST_REFRESH_SECONDS = 600
+
+# Weight of each recommendation strategy in the blended score. Strategies
+# with a weight of 0 are skipped.
+RECOMMENDATION_WEIGHTS = {
+    'genre': 1.0,
+    'artist': 1.0,
+    'collaborative': 1.5,
+    'factors': 1.5,
+    'playlist': 0.5,
+    'content': 0.5,
+}
+
+# Recommendations are cached per user and limit in the RECOMMENDATION_CACHE
+# alias of CACHES. They are fresh for RECOMMENDATION_CACHE_TTL seconds, then
+# served stale for up to RECOMMENDATION_CACHE_STALE_TTL seconds while they
+# are recomputed in the background. A user's entries are dropped whenever
+# they rate, favorite, listen or edit a playlist.
+RECOMMENDATION_CACHE = 'default'
+RECOMMENDATION_CACHE_TTL = 300
+RECOMMENDATION_CACHE_STALE_TTL = 3600
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
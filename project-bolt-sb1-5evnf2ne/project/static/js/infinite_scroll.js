@@ -0,0 +1,37 @@
+// Infinite scroll: when the "load more" link of a paginated list comes into
+// view, the next page is fetched and its items are appended to the list.
+// Without JavaScript the link still opens the next page.
+function infiniteScroll(listId, linkId) {
+    const list = document.getElementById(listId);
+    const link = document.getElementById(linkId);
+    if (!list || !link || !('IntersectionObserver' in window)) return;
+
+    let loading = false;
+    const observer = new IntersectionObserver(function(entries) {
+        if (!entries[0].isIntersecting || loading) return;
+        loading = true;
+
+        fetch(link.href, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.text())
+            .then(html => {
+                const page = new DOMParser().parseFromString(html, 'text/html');
+                const items = page.getElementById(listId);
+                if (items) list.append(...items.children);
+
+                const next = page.getElementById(linkId);
+                if (next) {
+                    link.href = next.href;
+                    // Check again in case the link is still in view
+                    observer.unobserve(link);
+                    observer.observe(link);
+                } else {
+                    observer.disconnect();
+                    link.remove();
+                }
+            })
+            .catch(error => console.error('Error:', error))
+            .finally(() => { loading = false; });
+    }, { rootMargin: '400px' });
+
+    observer.observe(link);
+}
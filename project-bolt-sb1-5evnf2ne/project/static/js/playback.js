@@ -0,0 +1,60 @@
+// Report playback to the heartbeat endpoint so that each real listen is
+// recorded once, with the time actually spent listening
+const PLAYBACK_HEARTBEAT_INTERVAL = 15000;
+
+function trackPlayback(audio, getMusicId, csrfToken) {
+    let session = null;
+    let musicId = null;
+    let timer = null;
+
+    function send(event, useBeacon) {
+        if (!session) return;
+
+        const data = new FormData();
+        data.append('session', session);
+        data.append('event', event);
+        data.append('csrfmiddlewaretoken', csrfToken);
+
+        const url = `/music/${musicId}/heartbeat/`;
+        if (useBeacon && navigator.sendBeacon) {
+            navigator.sendBeacon(url, data);
+        } else {
+            fetch(url, { method: 'POST', body: data, keepalive: true });
+        }
+    }
+
+    function endSession(useBeacon) {
+        clearInterval(timer);
+        send('ended', useBeacon);
+        session = null;
+    }
+
+    audio.addEventListener('play', function() {
+        const current = getMusicId();
+        if (session && current !== musicId) {
+            // Another track was loaded in the same player
+            endSession();
+        }
+        if (!session) {
+            musicId = current;
+            session = Date.now().toString(36) + Math.random().toString(36).slice(2);
+        }
+        send('play');
+        clearInterval(timer);
+        timer = setInterval(() => send('progress'), PLAYBACK_HEARTBEAT_INTERVAL);
+    });
+
+    audio.addEventListener('pause', function() {
+        if (audio.ended) return;
+        clearInterval(timer);
+        send('pause');
+    });
+
+    audio.addEventListener('ended', function() {
+        endSession();
+    });
+
+    window.addEventListener('pagehide', function() {
+        if (session) endSession(true);
+    });
+}
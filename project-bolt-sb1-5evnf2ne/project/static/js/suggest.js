@@ -0,0 +1,39 @@
+// Typeahead for a search input: suggestions from /music/suggest/ fill a
+// datalist as the user types, a short pause after the last keystroke
+const SUGGEST_DELAY = 120;
+
+function attachSuggestions(input, url) {
+    const list = document.createElement('datalist');
+    list.id = input.name + '-suggestions';
+    input.setAttribute('list', list.id);
+    input.setAttribute('autocomplete', 'off');
+    input.after(list);
+
+    let timer = null;
+    let controller = null;
+
+    input.addEventListener('input', function() {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (!query) {
+            list.replaceChildren();
+            return;
+        }
+        timer = setTimeout(function() {
+            // Only the answer to the latest query is shown
+            if (controller) controller.abort();
+            controller = new AbortController();
+            fetch(`${url}?q=${encodeURIComponent(query)}`, { signal: controller.signal })
+                .then(response => response.json())
+                .then(data => {
+                    list.replaceChildren(...data.suggestions.map(suggestion => {
+                        const option = document.createElement('option');
+                        option.value = suggestion.type === 'music' ? suggestion.title : suggestion.name;
+                        option.label = suggestion.type === 'music' ? suggestion.artist || '' : 'Artist';
+                        return option;
+                    }));
+                })
+                .catch(() => {});
+        }, SUGGEST_DELAY);
+    });
+}
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:30
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_favorite_counts(apps, schema_editor):
+    CustomUser = apps.get_model('users', 'CustomUser')
+    UserMusicPreference = apps.get_model('music_app', 'UserMusicPreference')
+
+    favorites = UserMusicPreference.objects.filter(favorite=True).values('user').annotate(count=Count('id'))
+    for row in favorites:
+        CustomUser.objects.filter(pk=row['user']).update(favorite_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('music_app', '0014_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='favorite_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_favorite_counts, migrations.RunPython.noop),
+    ]
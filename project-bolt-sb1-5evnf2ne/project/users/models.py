@@ -23,6 +23,8 @@ class CustomUser(AbstractUser):
         upload_to='profile_images/', 
         default='profile_images/default.png'
     )
+    # Number of favorite tracks, kept up to date as preferences are saved
+    favorite_count = models.PositiveIntegerField(default=0, editable=False)
     
     def __str__(self):
         return f"{self.username} ({self.get_user_type_display()})"
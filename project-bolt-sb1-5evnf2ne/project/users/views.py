@@ -3,7 +3,10 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from .forms import UserRegisterForm, ArtistProfileForm, UserLoginForm
-from music_app.models import Music, Playlist
+from django.utils import timezone
+from datetime import timedelta
+from music_app.models import Music, Playlist, ArtistPlayRollup
+from music_app import facets, pagination, rollups
 
 
 def register(request):
@@ -46,30 +49,53 @@ def dashboard(request):
     
     if user.is_artist():
         # For artist dashboard
-        music_list = Music.objects.filter(artist__user=user)
-        playlists = Playlist.objects.filter(creator=user)
+        artist = user.artist_profile
+        music_list = Music.objects.filter(artist=artist)
+        playlists = Playlist.objects.with_summary().filter(creator=user)
+        plays_this_week = rollups.plays_since(
+            timezone.now() - timedelta(days=7),
+            model=ArtistPlayRollup,
+            artist=artist
+        )
         context.update({
             'music_list': music_list,
-            'playlists': playlists
+            'track_count': facets.artist_counts([artist.id]).get(artist.id, 0),
+            'playlists': playlists,
+            'plays_this_week': plays_this_week
         })
         return render(request, 'users/artist_dashboard.html', context)
     
     elif user.is_admin():
-        # For admin dashboard
+        # For admin dashboard: each tab is paginated with its own cursor
         all_music = Music.objects.all()
         all_playlists = Playlist.objects.all()
         all_users = user.__class__.objects.all()
+        size = pagination.page_size(request)
+        users_page = pagination.paginate(all_users, pagination.USER_KEYS, request.GET.get('users_cursor'), size)
+        music_page = pagination.paginate(
+            all_music.select_related('artist'), pagination.CATALOG_KEYS, request.GET.get('music_cursor'), size
+        )
+        playlists_page = pagination.paginate(
+            all_playlists.with_summary().select_related('creator'), pagination.PLAYLIST_KEYS, request.GET.get('playlists_cursor'), size
+        )
         context.update({
             'all_music': all_music,
             'all_playlists': all_playlists,
-            'all_users': all_users
+            'all_users': all_users,
+            'artist_count': all_users.filter(user_type=user.__class__.ARTIST).count(),
+            'users_page': users_page,
+            'music_page': music_page,
+            'playlists_page': playlists_page,
+            'users_next_url': pagination.next_url(request, users_page, 'users_cursor'),
+            'music_next_url': pagination.next_url(request, music_page, 'music_cursor'),
+            'playlists_next_url': pagination.next_url(request, playlists_page, 'playlists_cursor')
         })
         return render(request, 'users/admin_dashboard.html', context)
     
     else:
         # For regular user dashboard
-        playlists = Playlist.objects.filter(creator=user)
-        recent_music = Music.objects.all().order_by('-release_date')[:10]
+        playlists = Playlist.objects.with_summary().filter(creator=user)
+        recent_music = Music.objects.select_related('artist').order_by('-release_date', '-id')[:10]
         context.update({
             'playlists': playlists,
             'recent_music': recent_music